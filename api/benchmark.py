@@ -0,0 +1,574 @@
+"""
+Benchmarks locais da API (não faz parte do deploy)
+
+Uso, de dentro da pasta api/:
+    python benchmark.py engine --sizes 10000 100000 1000000
+    python benchmark.py index --sizes 100000 1000000
+    python benchmark.py intents
+    python benchmark.py api --scales 1000 10000 100000 --output resultados.json
+    python benchmark.py api --baseline resultados-anteriores.json
+    python benchmark.py coldstart
+    python benchmark.py upload-parse --sizes 10000 100000 500000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# O módulo da API lê as variáveis no import; nenhum acesso real ao Supabase é feito aqui
+os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+
+import index
+from fake_supabase import FakeSupabase
+
+PRODUTOS = [f'Produto {i:03d}' for i in range(120)]
+CATEGORIAS = ['Eletrônicos', 'Acessórios', 'Móveis', 'Papelaria', 'Games']
+REGIOES = ['Norte', 'Nordeste', 'Centro-Oeste', 'Sudeste', 'Sul']
+
+
+def synthetic_rows(n, seed=42, years=(2024,)):
+    """Linhas no formato devolvido pelo Supabase (números como JSON number)"""
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        quantidade = rnd.randint(1, 20)
+        preco = round(rnd.uniform(5, 3000), 2)
+        rows.append({
+            'data': f'{years[i % len(years)]}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}',
+            'produto': rnd.choice(PRODUTOS),
+            'categoria': rnd.choice(CATEGORIAS),
+            'regiao': rnd.choice(REGIOES),
+            'quantidade': quantidade,
+            'receita_total': round(quantidade * preco, 2)
+        })
+    return rows
+
+
+def best_of(repeat, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_engine(args):
+    """Laço em Python x motor colunar NumPy para o store de agregados"""
+    print(f"{'linhas':>10} {'python':>12} {'colunas':>12} {'group-by':>12} {'numpy total':>12} {'speedup':>8}")
+    for size in args.sizes:
+        rows = synthetic_rows(size)
+        python_s, python_agg = best_of(args.repeat, lambda: index._build_aggregates_python(rows))
+        columns_s, columns = best_of(args.repeat, lambda: index.SalesColumns.from_rows(rows))
+        groupby_s, numpy_agg = best_of(args.repeat, lambda: index.aggregate_columns(columns))
+
+        differences = index.compare_aggregates(python_agg, numpy_agg)
+        if differences:
+            print(f"  ⚠️ resultados diferentes em {size} linhas: {differences[:3]}")
+
+        numpy_s = columns_s + groupby_s
+        print(f"{size:>10} {python_s * 1000:>10.1f}ms {columns_s * 1000:>10.1f}ms "
+              f"{groupby_s * 1000:>10.1f}ms {numpy_s * 1000:>10.1f}ms {python_s / numpy_s:>7.1f}x")
+
+
+def scan_top_products(rows, mes_suffix, regiao):
+    """Varredura linha a linha como o fallback fazia antes do índice"""
+    totals = {}
+    for row in rows:
+        if mes_suffix not in str(row.get('data') or '') or row.get('regiao') != regiao:
+            continue
+        totals[row['produto']] = totals.get(row['produto'], 0) + float(row['quantidade'])
+    return sorted(totals.items(), key=lambda x: x[1], reverse=True)
+
+
+def mask_top_products(np, columns, meses, regiao):
+    """Máscara booleana sobre as colunas inteiras (sem índice)"""
+    mes_codes = [columns.labels['mes'].index(m) for m in meses]
+    mask = np.isin(columns.mes, mes_codes) & (columns.regiao == columns.labels['regiao'].index(regiao))
+    sums = np.bincount(columns.produto[mask], weights=columns.quantidade[mask],
+                       minlength=len(columns.labels['produto']))
+    return sorted(((columns.labels['produto'][i], float(sums[i])) for i in np.flatnonzero(sums)),
+                  key=lambda x: x[1], reverse=True)
+
+
+def bench_index(args):
+    """Top-N filtrado (mês + região): varredura x máscara NumPy x índice do snapshot"""
+    import numpy as np
+    print(f"{'linhas':>10} {'índice':>10} {'varredura':>12} {'máscara':>10} {'com índice':>11} {'speedup':>8}")
+    for size in args.sizes:
+        rows = synthetic_rows(size, years=(2023, 2024, 2025))
+        columns = index.SalesColumns.from_rows(rows)
+        build_s, sales_index = best_of(1, lambda: index.SalesIndex(columns))
+        meses = [m for m in columns.labels['mes'] if m.endswith('-01')]
+
+        scan_s, scan = best_of(args.repeat, lambda: scan_top_products(rows, '-01-', 'Sul'))
+        mask_s, mask = best_of(args.repeat, lambda: mask_top_products(np, columns, meses, 'Sul'))
+        index_s, indexed = best_of(args.repeat, lambda: sales_index.top_products(mes=meses, regiao='Sul'))
+
+        for name, other in (('máscara', mask), ('índice', indexed)):
+            if {p: round(q, 6) for p, q in other} != {p: round(q, 6) for p, q in scan}:
+                print(f"  ⚠️ {name} diferente da varredura em {size} linhas")
+        print(f"{size:>10} {build_s * 1000:>8.1f}ms {scan_s * 1000:>10.2f}ms {mask_s * 1000:>8.2f}ms "
+              f"{index_s * 1000:>9.3f}ms {scan_s / index_s:>7.0f}x")
+
+
+# Perguntas de exemplo com a intenção e os meses esperados do classificador do fallback
+INTENT_CORPUS = [
+    ('Qual mês teve a maior receita total em 2024?', 'mensal', []),
+    ('Liste os 5 produtos com mais unidades vendidas', 'ranking', []),
+    ('Quanto foi a receita total do ano de 2024?', 'total', []),
+    ('Qual região gerou mais receita de vendas?', 'regiao', []),
+    ('Mostre a receita de cada mês de 2024', 'mensal', []),
+    ('Qual categoria tem o maior volume de vendas?', 'categoria', []),
+    ('Compare o faturamento de Março e Abril de 2024', 'comparar_meses', [3, 4]),
+    ('Qual produto foi mais vendido em Janeiro?', 'produto', [1]),
+    ('produto mais vendido em marco', 'produto', [3]),
+    ('Qual produto teve a maior venda?', 'produto', []),
+    ('quantos produtos diferentes foram vendidos?', 'diversidade', []),
+    ('Quais produtos vendemos?', 'diversidade', []),
+    ('variedade do portfólio', 'diversidade', []),
+    ('top 5', 'ranking', []),
+    ('Top10 do ano', 'ranking', []),
+    ('ranking de produtos', 'ranking', []),
+    ('Abril versus Março', 'comparar_meses', [3, 4]),
+    ('diferença entre maio e junho', 'comparar_meses', [5, 6]),
+    ('compare janeiro com os outros meses', 'contexto_mes', [1]),
+    ('janeiro, fevereiro e março', 'generico', []),
+    ('vendas por regiao', 'regiao', []),
+    ('Receita das regiões', 'regiao', []),
+    ('desempenho regional', 'regiao', []),
+    ('Quais são os tipos de produto?', 'produto', []),
+    ('liste as categorias', 'ranking', []),
+    ('vendas mensais', 'mensal', []),
+    ('melhor mês', 'mensal', []),
+    ('faturamento total', 'total', []),
+    ('total do ano', 'total', []),
+    ('quanto foi vendido em dezembro', 'produto', [12]),
+    ('O mesmo produto vendeu bem?', 'produto', []),
+    ('oi, tudo bem?', 'generico', []),
+    ('janeiro 2024 vs janeiro 2025', 'comparar_meses', [1]),
+    ('Compare março de 2023 com abril de 2024', 'comparar_meses', [3, 4]),
+    ('compare 2024 e 2025', 'comparar_anos', []),
+    ('receita total de 2025', 'total', []),
+    ('Qual região vendeu mais em 2023?', 'regiao', []),
+]
+
+
+def check_intents(args):
+    """Confere o classificador de intenções contra o corpus e mede o tempo por pergunta"""
+    failures = 0
+    for question, expected, months in INTENT_CORPUS:
+        intent = index.classify_question(question)
+        if intent.name != expected or intent.months != months:
+            failures += 1
+            print(f"❌ {question!r}: esperado {expected} {months}, obtido {intent.name} {intent.months}")
+    
+    questions = [question for question, _, _ in INTENT_CORPUS]
+    elapsed, _ = best_of(args.repeat, lambda: [index.classify_question(q) for q in questions])
+    print(f"{len(INTENT_CORPUS) - failures}/{len(INTENT_CORPUS)} perguntas corretas, "
+          f"{elapsed / len(questions) * 1_000_000:.1f}µs por pergunta")
+    return 1 if failures else 0
+
+
+def table_rows(n, seed=42, years=(2024,)):
+    """Linhas completas da tabela (colunas gravadas pelo upload) para o Supabase falso"""
+    rows = synthetic_rows(n, seed, years)
+    for i, row in enumerate(rows):
+        row['id_transacao'] = f'TXN{seed}-{i:08d}'
+        row['preco_unitario'] = round(row['receita_total'] / row['quantidade'], 2)
+    return rows
+
+
+def upload_csv(n, seed=7):
+    """Arquivo CSV de upload com n linhas, no formato que o usuário envia"""
+    output = io.StringIO()
+    fields = ['data', 'id_transacao', 'produto', 'categoria', 'regiao', 'quantidade', 'preco_unitario', 'receita_total']
+    writer = csv.DictWriter(output, fieldnames=fields)
+    writer.writeheader()
+    for row in table_rows(n, seed):
+        writer.writerow({field: row[field] for field in fields})
+    return output.getvalue().encode()
+
+
+class FakeLLM:
+    """LLM local com latência fixa no lugar do Gemini (index.set_llm_backend)"""
+    name = 'fake'
+
+    def __init__(self, latency_ms=300, chunks=8):
+        self.latency = latency_ms / 1000
+        self.chunks = chunks
+
+    def generate(self, prompt):
+        time.sleep(self.latency)
+        return f'Resposta simulada ({len(prompt)} caracteres de contexto)'
+
+    def stream(self, prompt):
+        for i in range(self.chunks):
+            time.sleep(self.latency / self.chunks)
+            yield f'trecho {i} '
+
+
+def _server_timing(header):
+    """'fetch;dur=12.3, total;dur=20.1' -> {'fetch': 12.3, 'total': 20.1}"""
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, duration = entry.strip().partition(';dur=')
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def run_requests(make_request, count, concurrency=1):
+    """Executa count requisições e resume latência (ms), vazão e etapas do Server-Timing"""
+    def one(i):
+        started = time.perf_counter()
+        response = make_request(i)
+        response.get_data()
+        return (time.perf_counter() - started) * 1000, response
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(one, range(count)))
+    else:
+        results = [one(i) for i in range(count)]
+    elapsed = time.perf_counter() - started
+
+    latencies = [ms for ms, _ in results]
+    stages = {}
+    for _, response in results:
+        for name, ms in _server_timing(response.headers.get('Server-Timing')).items():
+            stages.setdefault(name, []).append(ms)
+    summary = index._percentiles(latencies)
+    summary.update(
+        mean=round(sum(latencies) / len(latencies), 2),
+        requests_per_second=round(count / elapsed, 1),
+        errors=sum(1 for _, response in results if response.status_code >= 400),
+        stages_mean_ms={name: round(sum(values) / len(values), 2) for name, values in sorted(stages.items())}
+    )
+    return summary
+
+
+def reset_api_state(fake):
+    """Caches zerados para a próxima escala (como uma instância recém-iniciada)"""
+    index.SUPABASE_URL = fake.url
+    index.invalidate_sales_snapshot()
+    index.answer_cache.clear()
+    index._views_missing_until = 0.0
+
+
+def bench_api_scale(args, size):
+    """Todos os cenários de uma escala contra um Supabase falso com size linhas"""
+    started = time.perf_counter()
+    rows = table_rows(size, years=tuple(args.years))
+    fake = FakeSupabase(rows, table=index.TABLE_NAME, view_prefix=index.AGGREGATE_VIEW_PREFIX,
+                        views=args.views, latency_ms=args.latency_ms).start()
+    seed_seconds = time.perf_counter() - started
+    client = index.app.test_client()
+    questions = list(dict.fromkeys(question for question, _, _ in INTENT_CORPUS))
+    scenarios = {}
+
+    def cold_metrics(i):
+        index.invalidate_sales_snapshot()
+        return client.get('/api/metrics')
+
+    try:
+        reset_api_state(fake)
+        scenarios['metrics_cold'] = run_requests(cold_metrics, args.cold)
+        scenarios['metrics'] = run_requests(lambda i: client.get('/api/metrics'), args.requests, args.concurrency)
+        scenarios['monthly_metrics'] = run_requests(lambda i: client.get('/api/monthly-metrics'),
+                                                    args.requests, args.concurrency)
+        scenarios['database_stats'] = run_requests(lambda i: client.get('/api/database-stats'), args.cold)
+
+        # Perguntas inéditas (chamam o LLM falso) e depois repetidas (cache de respostas)
+        ask = lambda i: client.post('/api/analyze', json={'message': questions[i % len(questions)]})
+        scenarios['analyze_llm'] = run_requests(ask, len(questions), args.concurrency)
+        scenarios['analyze_cached'] = run_requests(ask, len(questions), args.concurrency)
+        index.answer_cache.clear()
+        scenarios['analyze_stream'] = run_requests(
+            lambda i: client.post('/api/analyze?stream=1', json={'message': questions[i % len(questions)]}),
+            min(len(questions), args.requests))
+
+        if args.upload_rows:
+            payload = upload_csv(args.upload_rows)
+            upload = lambda i: client.post('/api/upload-data', content_type='multipart/form-data',
+                                           data={'file': (io.BytesIO(payload), 'vendas.csv')})
+            scenarios['upload'] = run_requests(upload, 1)
+            scenarios['upload']['rows_per_second'] = round(
+                args.upload_rows / (scenarios['upload']['mean'] / 1000), 1)
+
+            # Reenvio do mesmo arquivo (upsert): tabela e agregados recarregados não podem mudar
+            def totals():
+                index.invalidate_sales_snapshot()
+                aggregates = index.get_sales_aggregates()
+                return len(fake.rows), aggregates.rows_processed, round(aggregates.receita_total, 2)
+
+            before = totals()
+            scenarios['upload_reimport'] = run_requests(upload, 1)
+            after = totals()
+            scenarios['upload_reimport']['totals_unchanged'] = before == after
+            if before != after:
+                print(f"  ❌ reenvio mudou (tabela, agregados, receita): {before} -> {after}")
+    finally:
+        fake.stop()
+
+    return {
+        'rows': size,
+        'seed_seconds': round(seed_seconds, 2),
+        'scenarios': scenarios,
+        'supabase_requests': dict(sorted(fake.requests.items())),
+        'supabase_bytes_sent': fake.bytes_sent
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_api(args):
+    """Endpoints reais (Flask test client) contra o PostgREST falso, em várias escalas"""
+    index.set_llm_backend(FakeLLM(args.llm_latency_ms))
+    index.snapshot_store.directory = args.snapshot_dir or ''
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'config': {key: getattr(args, key) for key in ('requests', 'concurrency', 'cold', 'latency_ms', 'llm_latency_ms',
+                                                       'views', 'upload_rows', 'years', 'snapshot_dir')},
+        'scales': []
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {scale['rows']: scale['scenarios'] for scale in json.load(f)['scales']}
+
+    print(f"{'linhas':>9} {'cenário':<16} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>8} {'antes p50':>10}")
+    for size in args.scales:
+        scale = bench_api_scale(args, size)
+        results['scales'].append(scale)
+        for name, summary in scale['scenarios'].items():
+            before = ((baseline or {}).get(size) or {}).get(name)
+            comparison = f"{before['p50']:>8.1f}ms" if before else ''
+            print(f"{size:>9} {name:<16} {summary['p50']:>7.1f}ms {summary['p95']:>7.1f}ms {summary['p99']:>7.1f}ms "
+                  f"{summary['requests_per_second']:>8.1f} {comparison:>10}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {args.output}")
+    failures = sum(summary['errors'] for scale in results['scales'] for summary in scale['scenarios'].values())
+    return 1 if failures else 0
+
+
+# Processo novo: importa a API e faz a primeira requisição de uma rota, como uma instância fria
+COLDSTART_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+client = index.app.test_client()
+method, path, payload = sys.argv[1], sys.argv[2], sys.argv[3]
+if payload:
+    import io
+    with open(payload, 'rb') as f:
+        data = {'file': (io.BytesIO(f.read()), 'vendas.csv')}
+    response = client.post(path, data=data, content_type='multipart/form-data')
+else:
+    response = client.open(path, method=method)
+finished = time.perf_counter()
+print(json.dumps({
+    'status': response.status_code,
+    'import_ms': round((imported - started) * 1000, 1),
+    'first_request_ms': round((finished - imported) * 1000, 1),
+    'server_timing': response.headers.get('Server-Timing'),
+    'loaded': [name for name in ('numpy', 'pandas', 'openpyxl', 'google.generativeai') if name in sys.modules]
+}))
+"""
+
+# Rotas medidas e módulos pesados que cada uma não pode carregar
+COLDSTART_ROUTES = [
+    ('GET', '/api/health', ('numpy', 'pandas', 'google.generativeai')),
+    ('GET', '/api/metrics', ('pandas', 'openpyxl', 'google.generativeai')),
+    ('GET', '/api/monthly-metrics', ('pandas', 'openpyxl', 'google.generativeai')),
+    ('GET', '/api/database-stats', ('numpy', 'pandas', 'google.generativeai')),
+    ('POST', '/api/upload-data', ('pandas', 'openpyxl', 'google.generativeai')),
+]
+
+
+def _importtime_top(stderr, n):
+    """Total do -X importtime (ms) e os imports diretos mais lentos (de index ou do script)"""
+    total, modules = 0.0, []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # O -X importtime indenta o nome com 2 espaços por nível (1 espaço de separação)
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        ms = int(cumulative) / 1000
+        if level == 0:
+            total += ms
+        if level == 0 and name.strip() != 'index' or level == 1:
+            modules.append((name.strip(), ms))
+    top = sorted(modules, key=lambda module: module[1], reverse=True)[:n]
+    return round(total, 1), [(name, round(ms, 1)) for name, ms in top]
+
+
+def bench_coldstart(args):
+    """Custo de partida a frio por rota: import da API (-X importtime) + primeira requisição"""
+    import tempfile
+    api_dir = os.path.dirname(os.path.abspath(__file__))
+    failures = 0
+    with FakeSupabase(table_rows(args.rows), table=index.TABLE_NAME,
+                      view_prefix=index.AGGREGATE_VIEW_PREFIX) as fake, \
+            tempfile.NamedTemporaryFile(suffix='.csv') as payload:
+        payload.write(upload_csv(args.upload_rows))
+        payload.flush()
+        env = dict(os.environ, SUPABASE_URL=fake.url, SUPABASE_KEY='benchmark', SNAPSHOT_DIR='')
+        print(f"{'rota':<22} {'import':>9} {'1ª req':>9} {'importtime':>11}  módulos pesados carregados")
+        for method, path, forbidden in COLDSTART_ROUTES:
+            best = None
+            for _ in range(args.repeat):
+                process = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', COLDSTART_SCRIPT, method, path,
+                     payload.name if path == '/api/upload-data' else ''],
+                    capture_output=True, text=True, cwd=api_dir, env=env)
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+                result['importtime_ms'], result['top_modules'] = _importtime_top(process.stderr, args.top)
+                if best is None or result['import_ms'] + result['first_request_ms'] < \
+                        best['import_ms'] + best['first_request_ms']:
+                    best = result
+            unexpected = [name for name in best['loaded'] if name in forbidden]
+            failures += bool(unexpected) or best['status'] >= 400
+            print(f"{path:<22} {best['import_ms']:>7.1f}ms {best['first_request_ms']:>7.1f}ms "
+                  f"{best['importtime_ms']:>9.1f}ms  {', '.join(best['loaded']) or '-'}"
+                  f"{'  ❌ ' + ', '.join(unexpected) if unexpected else ''}")
+            if args.verbose:
+                print('    ' + ', '.join(f'{name} {ms}ms' for name, ms in best['top_modules']))
+                print(f"    {best['server_timing']}")
+    return 1 if failures else 0
+
+
+# Leitura de um .csv pelo caminho de upload (sem envio ao Supabase), num processo por medição
+UPLOAD_PARSE_SCRIPT = """
+import json, resource, sys, time
+import index
+from werkzeug.datastructures import FileStorage
+def peak_rss_kb():
+    # VmHWM é zerado no exec; o ru_maxrss herdaria o pico do processo pai
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+engine, path = sys.argv[1], sys.argv[2]
+index.UPLOAD_CSV_ENGINE = engine
+if engine == 'pandas':
+    import pandas  # import fora da medição
+baseline_kb = peak_rss_kb()
+started = time.perf_counter()
+rows = valid = 0
+with open(path, 'rb') as f:
+    for read, records, row_numbers in index._iter_upload_batches(FileStorage(f, 'vendas.csv'), '.csv', True):
+        rows += read
+        valid += len(records)
+elapsed = time.perf_counter() - started
+peak_kb = peak_rss_kb()
+print(json.dumps({'rows': rows, 'valid': valid, 'seconds': elapsed,
+                  'peak_rss_mb': peak_kb / 1024, 'rss_growth_mb': (peak_kb - baseline_kb) / 1024}))
+"""
+
+
+def bench_upload_parse(args):
+    """Leitor CSV do upload: módulo csv (uma passada) x pandas, em linhas/s e pico de memória"""
+    import tempfile
+    api_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, SUPABASE_URL='http://127.0.0.1:9', SUPABASE_KEY='benchmark')
+    print(f"{'linhas':>9} {'leitor':<7} {'linhas/s':>11} {'tempo':>9} {'pico RSS':>10} {'crescimento':>12}")
+    failures = 0
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile(suffix='.csv') as payload:
+            payload.write(upload_csv(size))
+            payload.flush()
+            results = {}
+            for engine in ('csv', 'pandas'):
+                process = subprocess.run([sys.executable, '-c', UPLOAD_PARSE_SCRIPT, engine, payload.name],
+                                         capture_output=True, text=True, cwd=api_dir, env=env)
+                if process.returncode:
+                    print(process.stderr[-2000:])
+                    return 1
+                result = results[engine] = json.loads(process.stdout.strip().splitlines()[-1])
+                print(f"{size:>9} {engine:<7} {result['rows'] / result['seconds']:>11,.0f} "
+                      f"{result['seconds'] * 1000:>7.0f}ms {result['peak_rss_mb']:>8.1f}MB "
+                      f"{result['rss_growth_mb']:>10.1f}MB")
+            if results['csv']['valid'] != results['pandas']['valid']:
+                failures += 1
+                print(f"  ⚠️ linhas válidas diferentes: csv {results['csv']['valid']}, "
+                      f"pandas {results['pandas']['valid']}")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks da API Alpha Insights')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    engine = sub.add_parser('engine', help='motor de agregação Python x NumPy')
+    engine.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    engine.add_argument('--repeat', type=int, default=3)
+    engine.set_defaults(func=bench_engine)
+
+    idx = sub.add_parser('index', help='top-N filtrado: varredura x índice do snapshot')
+    idx.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    idx.add_argument('--repeat', type=int, default=5)
+    idx.set_defaults(func=bench_index)
+
+    intents = sub.add_parser('intents', help='corpus de perguntas do classificador do fallback')
+    intents.add_argument('--repeat', type=int, default=100)
+    intents.set_defaults(func=check_intents)
+
+    api = sub.add_parser('api', help='endpoints contra um Supabase falso local (latência e vazão)')
+    api.add_argument('--scales', type=int, nargs='+', default=[1_000, 10_000])
+    api.add_argument('--years', type=int, nargs='+', default=[2024])
+    api.add_argument('--requests', type=int, default=50, help='requisições por cenário com cache quente')
+    api.add_argument('--cold', type=int, default=3, help='cargas completas do snapshot medidas')
+    api.add_argument('--concurrency', type=int, default=1)
+    api.add_argument('--latency-ms', type=float, default=0.0, help='latência simulada por chamada ao Supabase')
+    api.add_argument('--llm-latency-ms', type=float, default=300.0)
+    api.add_argument('--views', action='store_true', help='simula as views de resumo do banco')
+    api.add_argument('--upload-rows', type=int, default=5_000, help='linhas do CSV enviado (0 = sem upload)')
+    api.add_argument('--snapshot-dir', default=None, help='SNAPSHOT_DIR usado pela API durante o benchmark')
+    api.add_argument('--output', default='benchmark-resultados.json')
+    api.add_argument('--baseline', default=None, help='resultados anteriores para comparar o p50')
+    api.set_defaults(func=bench_api)
+
+    coldstart = sub.add_parser('coldstart', help='import + primeira requisição por rota em processos novos')
+    coldstart.add_argument('--rows', type=int, default=5_000)
+    coldstart.add_argument('--upload-rows', type=int, default=1_000)
+    coldstart.add_argument('--repeat', type=int, default=3, help='melhor de N processos por rota')
+    coldstart.add_argument('--top', type=int, default=6)
+    coldstart.add_argument('--verbose', action='store_true', help='mostra os módulos mais lentos de importar')
+    coldstart.set_defaults(func=bench_coldstart)
+
+    upload_parse = sub.add_parser('upload-parse', help='leitor CSV do upload: módulo csv x pandas')
+    upload_parse.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 500_000])
+    upload_parse.set_defaults(func=bench_upload_parse)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
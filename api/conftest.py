@@ -0,0 +1,36 @@
+"""
+Fixtures dos testes: API contra o Supabase falso (fake_supabase.py)
+
+Uso:
+    python -m pytest -q api
+"""
+import importlib
+
+import pytest
+
+import benchmark
+import index
+from fake_supabase import FakeSupabase
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'sales_years(*years): anos das linhas do Supabase falso (padrão: 2024)')
+
+
+@pytest.fixture(params=[False, True], ids=['python', 'views'])
+def supabase(request, monkeypatch):
+    """Supabase falso com 25 mil linhas (acima do antigo limite de 10 mil) e max-rows de 1000, sem e com as views
+
+    index é recarregado com a configuração do ambiente: cada teste vê uma instância
+    recém-iniciada, sem caches de outro Supabase.
+    """
+    marker = request.node.get_closest_marker('sales_years')
+    years = marker.args if marker else (2024,)
+    fake = FakeSupabase(benchmark.table_rows(25000, years=years), table=index.TABLE_NAME, views=request.param,
+                        view_prefix=index.AGGREGATE_VIEW_PREFIX, max_rows=1000).start()
+    monkeypatch.setenv('SUPABASE_URL', fake.url)
+    monkeypatch.setenv('SUPABASE_KEY', 'test')
+    monkeypatch.setenv('SNAPSHOT_DIR', '')
+    importlib.reload(index)
+    yield fake
+    fake.stop()
@@ -0,0 +1,359 @@
+"""
+Stand-in local do PostgREST do Supabase para benchmarks (não faz parte do deploy)
+
+Implementa só o que index.py usa da API REST:
+- GET/HEAD com select, filtros (eq, neq, gt, gte, lt, lte, in, or=(and(...))),
+  order, limit e offset
+- header Range e Prefer: count=exact|planned|estimated (total no Content-Range)
+- max_rows: limite de linhas por resposta, como o db-max-rows do PostgREST
+  (1000 no Supabase), aplicado também às views
+- POST com uma lista de registros (insert em lote, id e created_at automáticos)
+  e upsert com on_conflict=<chave> + Prefer: resolution=merge-duplicates|ignore-duplicates
+  (return=representation devolve as linhas gravadas, com select)
+  (key_column=None simula um schema sem a coluna da chave)
+- views <prefixo>_geral, _mensal, _produto, _produto_mes, _categoria, _regiao,
+  _categoria_ano, _regiao_ano e _upload calculadas na hora, com filtros
+  (desligadas por padrão, como num schema antigo)
+
+Uso:
+    with FakeSupabase(rows, latency_ms=20) as supabase:
+        index.SUPABASE_URL = supabase.url
+"""
+import csv
+import json
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a > b,
+    'gte': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'lte': lambda a, b: a <= b,
+}
+
+
+def _split_top_level(text):
+    """'a.eq.1,and(b.gt.2,c.lt.3)' -> ['a.eq.1', 'and(b.gt.2,c.lt.3)']"""
+    parts, depth, current = [], 0, []
+    quoted = False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and char == ',' and depth == 0:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+def _typed(row_value, text):
+    """Converte o valor do filtro para o tipo da coluna (números comparam como números)"""
+    if isinstance(row_value, (int, float)) and not isinstance(row_value, bool):
+        return float(text)
+    return text
+
+
+def _condition(field, expression):
+    """Predicado de uma linha para 'campo=op.valor' (ou or/and aninhados)"""
+    if field in ('or', 'and'):
+        inner = [_term(part) for part in _split_top_level(expression[1:-1])]
+        combine = any if field == 'or' else all
+        return lambda row: combine(test(row) for test in inner)
+
+    op, _, value = expression.partition('.')
+    if op == 'in':
+        values = set(next(csv.reader([value[1:-1]], escapechar='\\')))
+        return lambda row: row.get(field) is not None and str(row[field]) in values
+    if op == 'is':
+        return lambda row: (row.get(field) is None) == (value == 'null')
+    compare = OPERATORS[op]
+
+    def test(row):
+        row_value = row.get(field)
+        if row_value is None:
+            return False
+        if isinstance(row_value, (int, float)) and not isinstance(row_value, bool):
+            return compare(float(row_value), _typed(row_value, value))
+        return compare(str(row_value), value)
+    return test
+
+
+def _term(text):
+    """Termo de um or=(...): 'campo.op.valor', 'and(...)' ou 'or(...)'"""
+    for group in ('and', 'or'):
+        if text.startswith(f'{group}('):
+            return _condition(group, text[len(group):])
+    field, _, expression = text.partition('.')
+    return _condition(field, expression)
+
+
+def _sort_key(value):
+    # None sempre por último (nullslast) e números antes de textos
+    return (value is None, not isinstance(value, (int, float)), value if value is not None else 0)
+
+
+class FakeSupabase:
+    """Servidor HTTP local com uma tabela em memória e as views de resumo"""
+
+    def __init__(self, rows=(), table='vendas_2024', view_prefix='vendas_resumo',
+                 views=False, latency_ms=0.0, port=0, key_column='chave', max_rows=None):
+        self.table = table
+        self.max_rows = max_rows
+        self.key_column = key_column
+        self.view_prefix = view_prefix
+        self.views = views
+        self.latency = latency_ms / 1000
+        self.rows = []
+        self.requests = defaultdict(int)
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._keys = {}
+        self.insert(rows)
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def insert(self, records, resolution=None):
+        """Grava os registros; com resolution, chave repetida atualiza (merge) ou é ignorada
+
+        Devolve (linhas inseridas, linhas atualizadas). Chave repetida sem resolution
+        levanta KeyError sem gravar nada, como a violação do índice único no Postgres.
+        """
+        created_at = datetime.utcnow().isoformat(timespec='seconds')
+        key_column = self.key_column
+        inserted, updated = [], []
+        with self._lock:
+            if resolution is None and key_column:
+                batch_keys = [record.get(key_column) for record in records if record.get(key_column) is not None]
+                if len(set(batch_keys)) != len(batch_keys) or any(key in self._keys for key in batch_keys):
+                    raise KeyError('duplicate key value violates unique constraint')
+            for record in records:
+                key = record.get(key_column) if key_column else None
+                existing = self._keys.get(key) if key is not None else None
+                if existing is not None:
+                    if resolution == 'merge-duplicates':
+                        existing.update({field: value for field, value in record.items() if field != 'id'})
+                        updated.append(existing)
+                    continue
+                row = dict(record)
+                row.setdefault('id', self._next_id)
+                row.setdefault('created_at', created_at)
+                self._next_id = max(self._next_id, row['id']) + 1
+                self.rows.append(row)
+                if key is not None:
+                    self._keys[key] = row
+                inserted.append(row)
+        return inserted, updated
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent = 0
+
+    # Consultas -----------------------------------------------------------
+
+    def select(self, params):
+        """Linhas filtradas e ordenadas + projeção, limit e offset da query string"""
+        with self._lock:
+            rows = self.rows
+        select_fields, order, limit, offset = '*', None, None, 0
+        tests = []
+        for name, value in params:
+            if name == 'select':
+                select_fields = value
+            elif name == 'order':
+                order = value
+            elif name == 'limit':
+                limit = int(value)
+            elif name == 'offset':
+                offset = int(value)
+            else:
+                tests.append(_condition(name, value))
+        if tests:
+            rows = [row for row in rows if all(test(row) for test in tests)]
+        if order:
+            for clause in reversed(order.split(',')):
+                field, _, direction = clause.partition('.')
+                descending = direction.startswith('desc')
+                if field == 'id':
+                    # As linhas já estão em ordem de id
+                    rows = rows[::-1] if descending else rows
+                else:
+                    rows = sorted(rows, key=lambda row: _sort_key(row.get(field)), reverse=descending)
+        return rows, select_fields, limit, offset
+
+    def view(self, name):
+        """Resultado de uma view de resumo (mesmas colunas de supabase_schema.sql)"""
+        with self._lock:
+            rows = list(self.rows)
+        if name == 'geral':
+            return [{'registros': len(rows),
+                     'receita': sum(row['receita_total'] for row in rows),
+                     'quantidade': sum(row['quantidade'] for row in rows)}]
+        if name == 'upload':
+            counts = defaultdict(int)
+            for row in rows:
+                counts[str(row.get('created_at'))[:16]] += 1
+            return [{'enviado_em': key, 'registros': count} for key, count in counts.items()]
+        keys = {
+            'mensal': ('mes',), 'produto': ('produto',), 'produto_mes': ('mes', 'produto'),
+            'categoria': ('categoria',), 'regiao': ('regiao',),
+            'categoria_ano': ('ano', 'categoria'), 'regiao_ano': ('ano', 'regiao')
+        }[name]
+        groups = defaultdict(lambda: [0.0, 0.0, 0])
+        for row in rows:
+            values = dict(row, mes=str(row['data'])[:7], ano=int(str(row['data'])[:4]))
+            group = groups[tuple(values[key] for key in keys)]
+            group[0] += row['quantidade']
+            group[1] += row['receita_total']
+            group[2] += 1
+        return [dict(zip(keys, key), quantidade=quantidade, receita=receita, vendas=vendas)
+                for key, (quantidade, receita, vendas) in groups.items()]
+
+    # HTTP ----------------------------------------------------------------
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b'', headers=None, head=False):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if body and not head:
+                    self.wfile.write(body)
+                    with fake._lock:
+                        fake.bytes_sent += len(body)
+
+            def _resource(self):
+                url = urlparse(self.path)
+                name = url.path.rsplit('/', 1)[-1]
+                with fake._lock:
+                    fake.requests[f'{self.command} {name}'] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                return name, parse_qsl(url.query)
+
+            def do_HEAD(self):
+                self.do_GET(head=True)
+
+            def do_GET(self, head=False):
+                name, params = self._resource()
+                if name.startswith(f'{fake.view_prefix}_'):
+                    if not fake.views:
+                        body = json.dumps({'code': 'PGRST205', 'message': f'relation {name} not found'})
+                        return self._send(404, body.encode(), head=head)
+                    rows, select_fields, limit, offset = fake.view(name[len(fake.view_prefix) + 1:]), '*', None, 0
+                    for key, value in params:
+                        if key not in ('select', 'order', 'limit'):
+                            test = _condition(key, value)
+                            rows = [row for row in rows if test(row)]
+                    for key, value in params:
+                        if key == 'select':
+                            continue
+                        if key == 'limit':
+                            limit = int(value)
+                        else:
+                            for clause in reversed(value.split(',')):
+                                field, _, direction = clause.partition('.')
+                                rows = sorted(rows, key=lambda row: _sort_key(row.get(field)),
+                                              reverse=direction.startswith('desc'))
+                elif name == fake.table:
+                    rows, select_fields, limit, offset = fake.select(params)
+                else:
+                    return self._send(404, b'{"code": "PGRST205"}', head=head)
+
+                total = len(rows)
+                start, end = offset, total - 1 if limit is None else offset + limit - 1
+                if self.headers.get('Range'):
+                    first, _, last = self.headers['Range'].partition('-')
+                    start, end = int(first), min(end, int(last)) if limit is not None else int(last)
+                if fake.max_rows is not None:
+                    end = min(end, start + fake.max_rows - 1)
+                page = rows[start:end + 1]
+                if select_fields != '*':
+                    fields = select_fields.split(',')
+                    page = [{field: row.get(field) for field in fields} for row in page]
+
+                content_range = f'{start}-{start + len(page) - 1}' if page else '*'
+                prefer = self.headers.get('Prefer') or ''
+                content_range += f'/{total}' if 'count=' in prefer else '/*'
+                self._send(200, json.dumps(page).encode(), {'Content-Range': content_range}, head=head)
+
+            def do_POST(self):
+                name, params = self._resource()
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if name != fake.table:
+                    return self._send(404, b'{"code": "PGRST205"}')
+                records = json.loads(body or b'[]')
+                records = records if isinstance(records, list) else [records]
+                on_conflict = dict(params).get('on_conflict')
+                columns = {field for record in records for field in record}
+                if fake.key_column is None and (on_conflict or 'chave' in columns):
+                    missing = on_conflict or 'chave'
+                    body = {'code': 'PGRST204', 'message': f"Could not find the '{missing}' column of '{name}'"}
+                    return self._send(400, json.dumps(body).encode())
+                if on_conflict and on_conflict != fake.key_column:
+                    body = {'code': '42P10', 'message': 'there is no unique or exclusion constraint '
+                                                        'matching the ON CONFLICT specification'}
+                    return self._send(400, json.dumps(body).encode())
+                prefer = self.headers.get('Prefer') or ''
+                resolution = next((part.split('=', 1)[1] for part in prefer.replace(' ', '').split(',')
+                                   if part.startswith('resolution=')), None) if on_conflict else None
+                try:
+                    inserted, updated = fake.insert(records, resolution)
+                except KeyError as e:
+                    return self._send(409, json.dumps({'code': '23505', 'message': str(e)}).encode())
+                if 'return=representation' not in prefer:
+                    return self._send(201)
+                # Como o PostgREST: ignore-duplicates devolve só as inseridas, merge também as atualizadas
+                rows = inserted + updated
+                select_fields = dict(params).get('select', '*')
+                if select_fields != '*':
+                    fields = select_fields.split(',')
+                    rows = [{field: row.get(field) for field in fields} for row in rows]
+                self._send(201, json.dumps(rows).encode())
+
+        return Handler
@@ -1,11 +1,26 @@
 """
 API Flask para Vercel - Versão otimizada com requests direto (sem SDK pesado)
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+import functools
+import hashlib
+import itertools
+import json
+import math
 import os
-from datetime import datetime
+import queue
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import date, datetime
 import requests
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from urllib3.exceptions import NewConnectionError
 
 app = Flask(__name__)
 CORS(app)
@@ -13,45 +28,2129 @@ CORS(app)
 # Configurações
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+# As views de resumo (AGGREGATE_VIEW_PREFIX) precisam ser criadas sobre esta tabela
 TABLE_NAME = os.getenv('SUPABASE_TABLE_NAME', 'vendas_2024')
+SUPABASE_PAGE_SIZE = 1000
+SUPABASE_FETCH_WORKERS = int(os.getenv('SUPABASE_FETCH_WORKERS', '4'))
+SUPABASE_POOL_SIZE = int(os.getenv('SUPABASE_POOL_SIZE', '10'))
+SUPABASE_MAX_RETRIES = int(os.getenv('SUPABASE_MAX_RETRIES', '2'))
+SUPABASE_RETRY_BACKOFF = float(os.getenv('SUPABASE_RETRY_BACKOFF', '0.3'))
+# Origem dos agregados: 'auto' (views do banco com fallback), 'database' ou 'python'
+AGGREGATION_SOURCE = os.getenv('AGGREGATION_SOURCE', 'auto').lower()
+AGGREGATE_VIEW_PREFIX = os.getenv('AGGREGATE_VIEW_PREFIX', 'vendas_resumo')
+AGGREGATE_VIEWS_RETRY_SECONDS = float(os.getenv('AGGREGATE_VIEWS_RETRY_SECONDS', '600'))
+# Motor dos agregados em memória: 'numpy' (colunar, vetorizado), 'python' ou 'auto'
+# (NumPy só a partir de AGGREGATION_NUMPY_MIN_ROWS linhas ou se já estiver importado)
+AGGREGATION_ENGINE = os.getenv('AGGREGATION_ENGINE', 'auto').lower()
+AGGREGATION_NUMPY_MIN_ROWS = int(os.getenv('AGGREGATION_NUMPY_MIN_ROWS', '50000'))
+# Upload: leitura em blocos (streaming) e tamanho dos lotes enviados ao Supabase
+UPLOAD_STREAMING = os.getenv('UPLOAD_STREAMING', '1') not in ('0', 'false')
+UPLOAD_CHUNK_ROWS = int(os.getenv('UPLOAD_CHUNK_ROWS', '5000'))
+UPLOAD_BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', '1000'))
+UPLOAD_MIN_BATCH_SIZE = int(os.getenv('UPLOAD_MIN_BATCH_SIZE', '200'))
+UPLOAD_MAX_BATCH_SIZE = int(os.getenv('UPLOAD_MAX_BATCH_SIZE', '5000'))
+UPLOAD_TARGET_BATCH_SECONDS = float(os.getenv('UPLOAD_TARGET_BATCH_SECONDS', '2'))
+# Leitor de .csv: 'csv' (módulo csv, sem pandas) ou 'pandas'
+UPLOAD_CSV_ENGINE = os.getenv('UPLOAD_CSV_ENGINE', 'csv').lower()
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '4'))
+UPLOAD_BATCH_RETRIES = int(os.getenv('UPLOAD_BATCH_RETRIES', '2'))
+# Upload idempotente: 'upsert' (reenviar um arquivo não duplica vendas) ou 'insert'
+UPLOAD_MODE = os.getenv('UPLOAD_MODE', 'upsert').lower()
+# Chave do upsert: 'auto' (id_transacao do arquivo; sem ele, hash do conteúdo) ou 'hash'
+UPLOAD_KEY = os.getenv('UPLOAD_KEY', 'auto').lower()
+UPLOAD_KEY_COLUMN = os.getenv('UPLOAD_KEY_COLUMN', 'chave')
+# Chaves por consulta ao conferir o que já está gravado (chave=in.(...) na URL)
+UPLOAD_KEY_LOOKUP_SIZE = int(os.getenv('UPLOAD_KEY_LOOKUP_SIZE', '200'))
+# Tabela sem a coluna/índice da chave: segundos usando insert simples antes de tentar o upsert de novo
+UPLOAD_UPSERT_RETRY_SECONDS = float(os.getenv('UPLOAD_UPSERT_RETRY_SECONDS', '600'))
+SNAPSHOT_TTL_SECONDS = float(os.getenv('SNAPSHOT_TTL_SECONDS', '300'))
+SNAPSHOT_WAIT_SECONDS = float(os.getenv('SNAPSHOT_WAIT_SECONDS', '30'))
+# Pasta para gravar as colunas do snapshot entre instâncias (vazio = desativado; no Vercel, /tmp)
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '')
+# /api/database-stats: tipo de contagem do PostgREST ('exact', 'planned' ou 'estimated') e validade do cache
+STATS_COUNT_MODE = os.getenv('STATS_COUNT_MODE', 'exact').lower()
+STATS_CACHE_TTL_SECONDS = float(os.getenv('STATS_CACHE_TTL_SECONDS', '15'))
+# Modelo do Gemini e pré-aquecimento do cliente no início da instância
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+LLM_PREWARM = os.getenv('LLM_PREWARM', '0') not in ('0', 'false')
+# Orçamento do /api/analyze para o Gemini (0 = sem limite); estourado, vale a resposta sem IA
+ANALYZE_LLM_BUDGET_MS = float(os.getenv('ANALYZE_LLM_BUDGET_MS', '8000'))
+LLM_BACKGROUND_WORKERS = int(os.getenv('LLM_BACKGROUND_WORKERS', '4'))
+# Respostas do /api/analyze reaproveitadas para perguntas repetidas (mesma versão dos dados)
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '256'))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+# Tempo por etapa de cada requisição (header Server-Timing e /api/perf) e tamanho da janela de percentis
+PERF_TRACING = os.getenv('PERF_TRACING', '1') not in ('0', 'false')
+PERF_WINDOW_SIZE = int(os.getenv('PERF_WINDOW_SIZE', '1000'))
+
+# Campos usados por /api/metrics, /api/monthly-metrics e /api/analyze
+SNAPSHOT_FIELDS = 'produto,quantidade,receita_total,data,categoria,regiao'
+
+class HttpStats:
+    """Contadores de tempo por tipo de chamada ao Supabase"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def record(self, label, elapsed, ok, retries):
+        with self._lock:
+            entry = self._calls.setdefault(label, {
+                'calls': 0, 'errors': 0, 'retries': 0,
+                'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0
+            })
+            ms = elapsed * 1000
+            entry['calls'] += 1
+            entry['errors'] += 0 if ok else 1
+            entry['retries'] += retries
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['last_ms'] = ms
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                label: dict(entry,
+                            total_ms=round(entry['total_ms'], 2),
+                            max_ms=round(entry['max_ms'], 2),
+                            last_ms=round(entry['last_ms'], 2),
+                            avg_ms=round(entry['total_ms'] / entry['calls'], 2) if entry['calls'] else 0.0)
+                for label, entry in self._calls.items()
+            }
+
+
+http_stats = HttpStats()
+
+
+class RequestTrace:
+    """Etapas medidas durante uma requisição (tempo somado por nome)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.open = set()
+
+    def server_timing(self, total):
+        """Valor do header Server-Timing: 'fetch;dur=12.3, ..., total;dur=20.1'"""
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.spans.items()]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
 
-def query_supabase(select_fields='*', max_records=10000):
-    """Query direta na API REST do Supabase com paginação automática"""
+
+_trace_local = threading.local()
+
+
+@contextmanager
+def trace_span(name):
+    """Mede uma etapa da requisição atual (fetch, parse, aggregate, render, llm...)
+
+    Fora de uma requisição, em threads auxiliares ou dentro de uma etapa com o
+    mesmo nome, não mede nada; assim cada etapa é contada uma vez só.
+    """
+    trace = getattr(_trace_local, 'trace', None)
+    if trace is None or name in trace.open:
+        yield
+        return
+    trace.open.add(name)
+    started = time.perf_counter()
     try:
-        all_data = []
-        page_size = 1000
-        offset = 0
-        
-        while len(all_data) < max_records:
-            url = f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}"
-            headers = {
-                'apikey': SUPABASE_KEY,
-                'Authorization': f'Bearer {SUPABASE_KEY}',
-                'Content-Type': 'application/json',
-                'Range': f'{offset}-{offset + page_size - 1}'
-            }
-            params = {
-                'select': select_fields
+        yield
+    finally:
+        trace.open.discard(name)
+        trace.spans[name] = trace.spans.get(name, 0.0) + time.perf_counter() - started
+
+
+def traced(name):
+    """Decorator: a função inteira conta como a etapa name"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_iter(iterable, name):
+    """Itera medindo só o tempo de produzir cada item (ex: leitura do arquivo em blocos)"""
+    iterator = iter(iterable)
+    while True:
+        with trace_span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def _percentiles(values):
+    values = sorted(values)
+    # Posto mais próximo: o valor abaixo do qual ficam p% das amostras
+    def rank(p):
+        return round(values[max(0, math.ceil(p / 100 * len(values)) - 1)], 2)
+    return {'samples': len(values), 'p50': rank(50), 'p95': rank(95), 'p99': rank(99), 'max': round(values[-1], 2)}
+
+
+class PerfStats:
+    """Janela móvel das últimas durações (ms) por endpoint e etapa"""
+
+    def __init__(self, window=PERF_WINDOW_SIZE):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = {}
+        self._requests = {}
+
+    def record(self, endpoint, total, spans):
+        with self._lock:
+            stages = self._samples.setdefault(endpoint, {})
+            for name, seconds in itertools.chain((('total', total),), spans.items()):
+                samples = stages.get(name)
+                if samples is None:
+                    samples = stages[name] = deque(maxlen=self._window)
+                samples.append(seconds * 1000)
+            self._requests[endpoint] = self._requests.get(endpoint, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            copied = {endpoint: {name: list(samples) for name, samples in stages.items()}
+                      for endpoint, stages in self._samples.items()}
+            requests_seen = dict(self._requests)
+        # Etapas só entram nas requisições em que ocorreram (ex: fetch só quando o cache expira)
+        return {
+            endpoint: {
+                'requests': requests_seen[endpoint],
+                'stages_ms': {name: _percentiles(values) for name, values in stages.items()}
             }
-            
-            response = requests.get(url, headers=headers, params=params, timeout=8)
-            response.raise_for_status()
-            data = response.json()
-            
-            if not data:
-                break
-            
-            all_data.extend(data)
-            
-            if len(data) < page_size:
-                break
-            
-            offset += page_size
+            for endpoint, stages in sorted(copied.items())
+        }
+
+
+perf_stats = PerfStats()
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_supabase_session():
+    """Sessão HTTP compartilhada (keep-alive) reaproveitada entre requisições"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=SUPABASE_POOL_SIZE, pool_maxsize=SUPABASE_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'apikey': SUPABASE_KEY or '',
+                    'Authorization': f'Bearer {SUPABASE_KEY}',
+                    'Content-Type': 'application/json'
+                })
+                _session = session
+    return _session
+
+
+def supabase_request(method, label, headers=None, retries=None, path=None, **kwargs):
+    """Chamada REST ao Supabase pela sessão compartilhada
+    
+    Repete com backoff exponencial em erros 5xx, timeouts e falhas de conexão.
+    POSTs só são repetidos quando retries é passado explicitamente, pois um
+    insert pode ter sido gravado mesmo com erro na resposta.
+    """
+    if retries is None:
+        retries = SUPABASE_MAX_RETRIES if method in ('GET', 'HEAD') else 0
+    url = f"{SUPABASE_URL}/rest/v1/{path or TABLE_NAME}"
+    session = get_supabase_session()
+    started = time.perf_counter()
+    attempt = 0
+    
+    while True:
+        try:
+            response = session.request(method, url, headers=headers, **kwargs)
+        except (requests.Timeout, requests.ConnectionError):
+            if attempt >= retries:
+                http_stats.record(label, time.perf_counter() - started, False, attempt)
+                raise
+        else:
+            if response.status_code < 500 or attempt >= retries:
+                http_stats.record(label, time.perf_counter() - started, response.ok, attempt)
+                return response
+        time.sleep(SUPABASE_RETRY_BACKOFF * (2 ** attempt))
+        attempt += 1
+
+
+def _parse_total_count(content_range):
+    """'0-999/2600' -> 2600 (None se o servidor não informou o total)"""
+    total = (content_range or '').split('/')[-1]
+    return int(total) if total.isdigit() else None
+
+
+def _fetch_page(select_fields, offset, page_size, with_count=False, filters=None):
+    """Busca uma página (Range) da tabela; retorna (linhas, total ou None)"""
+    headers = {'Range': f'{offset}-{offset + page_size - 1}'}
+    if with_count:
+        headers['Prefer'] = 'count=exact'
+    params = [('select', select_fields)] + list(filters or [])
+    
+    response = supabase_request('GET', 'query_page', headers=headers, params=params, timeout=8)
+    response.raise_for_status()
+    total = _parse_total_count(response.headers.get('Content-Range')) if with_count else None
+    return response.json(), total
+
+
+@traced('fetch')
+def _fetch_all_pages(select_fields='*', max_records=None, parallel=None, filters=None):
+    """Query direta na API REST do Supabase com paginação automática
+    
+    A primeira página traz o total (Prefer: count=exact); em modo paralelo as
+    demais são buscadas simultaneamente, até SUPABASE_FETCH_WORKERS por vez.
+    Com o total, uma página curta por causa do max-rows do PostgREST não é
+    confundida com o fim da tabela.
+    filters são pares no formato do PostgREST, ex: [('data', 'gte.2024-01-01')].
+    max_records=None busca todas as linhas. Devolve (linhas, total da tabela ou None).
+    """
+    if parallel is None:
+        parallel = SUPABASE_FETCH_WORKERS > 1
+    if max_records is None:
+        max_records = math.inf
+    page_size = SUPABASE_PAGE_SIZE
+    data, total = _fetch_page(select_fields, 0, page_size, with_count=True, filters=filters)
+    all_data = list(data)
+    
+    if total is not None and 0 < len(data) < min(page_size, total):
+        # max-rows do PostgREST menor que a página: as próximas usam o tamanho que o servidor devolve
+        page_size = len(data)
+    
+    if len(data) < page_size or len(all_data) >= max_records:
+        return all_data, total
+    
+    if parallel and total is not None:
+        limit = min(total, max_records)
+        offsets = list(range(page_size, limit, page_size))
+        if offsets:
+            workers = min(SUPABASE_FETCH_WORKERS, len(offsets))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # map preserva a ordem das páginas
+                pages = executor.map(lambda off: _fetch_page(select_fields, off, page_size, filters=filters)[0], offsets)
+                for page in pages:
+                    all_data.extend(page)
+        return all_data, total
+    
+    # Sequencial (ou servidor sem contagem): página a página até acabar
+    offset = page_size
+    limit = max_records if total is None else min(total, max_records)
+    while len(all_data) < limit:
+        data, _ = _fetch_page(select_fields, offset, page_size, filters=filters)
+        
+        if not data:
+            break
+        
+        all_data.extend(data)
         
-        return all_data, None
+        if len(data) < page_size:
+            break
+        
+        offset += page_size
+    
+    return all_data, total
+
+
+def query_supabase(select_fields='*', max_records=None, parallel=None, filters=None):
+    """Linhas paginadas de _fetch_all_pages; devolve (dados, erro)"""
+    try:
+        return _fetch_all_pages(select_fields, max_records, parallel, filters)[0], None
     except Exception as e:
         return None, str(e)
 
+
+@traced('count')
+def count_rows(filters=None, mode=None, label='count'):
+    """Total de linhas pelo header Content-Range (HEAD, nenhuma linha é transferida)
+
+    filters é uma lista de pares no formato do PostgREST, ex: [('data', 'gte.2024-01-01')].
+    """
+    params = [('select', 'data'), ('limit', '1')] + list(filters or [])
+    headers = {'Prefer': f'count={mode or STATS_COUNT_MODE}'}
+    response = supabase_request('HEAD', label, headers=headers, params=params, timeout=10)
+    response.raise_for_status()
+    total = _parse_total_count(response.headers.get('Content-Range'))
+    if total is None:
+        raise Exception('Supabase não informou a contagem (Content-Range sem total)')
+    return total
+
+
+class _RowChunks:
+    """Linhas do snapshot em blocos: acrescentar um upload não copia as linhas anteriores"""
+
+    def __init__(self, chunks):
+        self._chunks = tuple(chunk for chunk in chunks if chunk)
+        self._len = sum(len(chunk) for chunk in self._chunks)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __add__(self, rows):
+        return _RowChunks(self._chunks + (rows,))
+
+
+class SalesSnapshot:
+    """Cópia das linhas de vendas compartilhada entre os endpoints"""
+
+    def __init__(self, rows, version, columns=None, complete=True):
+        self.rows = rows  # None quando o snapshot veio do disco (só colunas)
+        self.version = version
+        # False quando a busca trouxe menos linhas que o total da tabela
+        self.complete = complete
+        self.loaded_at = time.time()
+        self._columns = columns
+        self._index = None
+        self._columns_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows) if self.rows is not None else len(self._columns)
+
+    def age(self):
+        return time.time() - self.loaded_at
+
+    def with_rows(self, rows, version):
+        """Novo snapshot com as linhas acrescentadas (mantém a idade do original)
+
+        Custo proporcional às linhas novas: as linhas ficam em blocos (_RowChunks)
+        e as colunas em buffers com folga (SalesColumns.with_rows).
+        """
+        if self.rows is None:
+            all_rows = None
+        elif isinstance(self.rows, _RowChunks):
+            all_rows = self.rows + rows
+        else:
+            all_rows = _RowChunks([self.rows, rows])
+        snapshot = SalesSnapshot(all_rows, version, complete=self.complete)
+        snapshot.loaded_at = self.loaded_at
+        if self._columns is not None:
+            snapshot._columns = self._columns.with_rows(rows)
+        return snapshot
+
+    def columns(self):
+        """Colunas tipadas do snapshot (montadas uma única vez)"""
+        if self._columns is None:
+            with self._columns_lock:
+                if self._columns is None:
+                    self._columns = SalesColumns.from_rows(self.rows)
+        return self._columns
+
+    def index(self):
+        """Índice mês/produto/categoria/região das linhas (montado uma única vez)"""
+        if self._index is None:
+            columns = self.columns()
+            with self._columns_lock:
+                if self._index is None:
+                    with trace_span('index'):
+                        self._index = SalesIndex(columns)
+        return self._index
+
+
+# Versões de dados únicas no processo, compartilhadas por todos os caches
+_data_versions = itertools.count(1)
+
+
+def _next_month(mes_key):
+    year, month = int(mes_key[:4]), int(mes_key[5:7])
+    return f'{year + month // 12}-{month % 12 + 1:02d}'
+
+
+def _quote(value):
+    """Valor entre aspas para listas do PostgREST (in/or), escapando aspas e barras"""
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+
+class SalesQuery:
+    """Filtros, projeção e ordenação da tabela de vendas traduzidos para o PostgREST
+
+    O filtro roda no banco (usando idx_vendas_data / idx_vendas_produto) e só as
+    colunas pedidas trafegam:
+
+        SalesQuery('produto,quantidade').month(2024, 1).where(regiao='Sul').fetch()
+    """
+
+    def __init__(self, select_fields='*'):
+        self.select_fields = select_fields
+        self._filters = []
+        self._order = []
+
+    def between(self, start=None, end=None, field='data'):
+        """Intervalo [start, end) de datas 'YYYY-MM-DD'"""
+        if start:
+            self._filters.append((field, f'gte.{start}'))
+        if end:
+            self._filters.append((field, f'lt.{end}'))
+        return self
+
+    def month(self, year, month):
+        mes_key = f'{year}-{month:02d}'
+        return self.between(f'{mes_key}-01', f'{_next_month(mes_key)}-01')
+
+    def year(self, year):
+        return self.between(f'{year}-01-01', f'{year + 1}-01-01')
+
+    def after_id(self, last_id, field='id'):
+        """Só as linhas inseridas depois de last_id (ids crescentes)"""
+        self._filters.append((field, f'gt.{last_id}'))
+        return self
+
+    def months(self, mes_keys, field='data'):
+        """Vários meses 'YYYY-MM' (ex: janeiro de todos os anos) num único filtro or"""
+        mes_keys = sorted(set(mes_keys))
+        if len(mes_keys) == 1:
+            return self.month(int(mes_keys[0][:4]), int(mes_keys[0][5:7]))
+        ranges = ','.join(f'and({field}.gte.{k}-01,{field}.lt.{_next_month(k)}-01)' for k in mes_keys)
+        self._filters.append(('or', f'({ranges})'))
+        return self
+
+    def where(self, **values):
+        """Igualdade por coluna (produto, categoria, regiao...); listas viram in.(...)"""
+        for field, value in values.items():
+            if isinstance(value, (list, tuple, set)):
+                self._filters.append((field, f"in.({','.join(_quote(v) for v in value)})"))
+            else:
+                self._filters.append((field, f'eq.{value}'))
+        return self
+
+    def order(self, field, desc=False):
+        self._order.append(f"{field}.{'desc' if desc else 'asc'}")
+        return self
+
+    @property
+    def filters(self):
+        return list(self._filters)
+
+    def params(self):
+        """Pares (nome, valor) para a query string, na ordem em que foram adicionados"""
+        params = self.filters
+        if self._order:
+            params.append(('order', ','.join(self._order)))
+        return params
+
+    def fetch(self, max_records=None, parallel=None):
+        """Linhas filtradas no banco (todas, por padrão); devolve (dados, erro) como query_supabase"""
+        return query_supabase(self.select_fields, max_records=max_records, parallel=parallel, filters=self.params())
+
+    def fetch_all(self):
+        """(todas as linhas, total do Content-Range); levanta exceção em erro"""
+        return _fetch_all_pages(self.select_fields, filters=self.params())
+
+    def count(self, mode=None, label='count'):
+        return count_rows(self.filters, mode=mode, label=label)
+
+
+class CachedValue:
+    """Valor genérico guardado num SnapshotCache (versão e idade)"""
+
+    def __init__(self, value, version):
+        self.value = value
+        self.version = version
+        self.loaded_at = time.time()
+
+    def age(self):
+        return time.time() - self.loaded_at
+
+
+class SnapshotCache:
+    """Cache em memória com TTL, uma única recarga por vez e invalidação explícita
+
+    O loader devolve o conteúdo e wrap(conteúdo, versão) monta o objeto
+    guardado, que precisa expor version e age(). Se a recarga falha, o conteúdo
+    antigo continua sendo servido, exceto para as exceções em fatal (o dado
+    antigo é descartado e o erro sobe).
+    """
+
+    def __init__(self, loader, ttl=SNAPSHOT_TTL_SECONDS, wait_timeout=SNAPSHOT_WAIT_SECONDS, wrap=None,
+                 fatal=()):
+        self._loader = loader
+        self._fatal = fatal
+        self._wrap = wrap or SalesSnapshot
+        self._ttl = ttl
+        self._wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._snapshot = None
+        self._refilling = False
+        self._generation = 0  # incrementada a cada invalidação
+        self._expired_generation = -1
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.refills = 0
+        self.last_error = None
+
+    def _is_fresh(self, snapshot):
+        return (snapshot is not None
+                and self._expired_generation != self._generation
+                and snapshot.age() < self._ttl)
+
+    def get(self):
+        """Retorna o snapshot atual, recarregando se expirado"""
+        with self._cond:
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot):
+                self.hits += 1
+                return snapshot
+
+            if self._refilling:
+                # Outra requisição já está recarregando: serve dado antigo ou espera
+                if snapshot is not None:
+                    self.stale_served += 1
+                    return snapshot
+                self._cond.wait_for(lambda: not self._refilling, timeout=self._wait_timeout)
+                if self._snapshot is None:
+                    raise Exception(self.last_error or 'Timeout aguardando carga dos dados')
+                self.hits += 1
+                return self._snapshot
+
+            self._refilling = True
+            self.misses += 1
+            generation = self._generation
+
+        try:
+            rows = self._loader()
+        except Exception as e:
+            with self._cond:
+                self._refilling = False
+                self.last_error = str(e)
+                if isinstance(e, self._fatal):
+                    self._snapshot = snapshot = None
+                if snapshot is not None:
+                    self.stale_served += 1
+                self._cond.notify_all()
+            if snapshot is not None:
+                # Supabase indisponível: melhor responder com dado antigo do que falhar
+                print(f"Erro ao recarregar snapshot, servindo versão {snapshot.version}: {str(e)}")
+                return snapshot
+            raise
+
+        with self._cond:
+            self._snapshot = self._wrap(rows, next(_data_versions))
+            self.refills += 1
+            self.last_error = None
+            # Invalidação durante a recarga: os dados podem estar desatualizados
+            self._expired_generation = -1 if generation == self._generation else self._generation
+            self._refilling = False
+            self._cond.notify_all()
+            return self._snapshot
+
+    def peek(self):
+        """Snapshot atual se ainda válido, sem disparar recarga (None caso contrário)"""
+        with self._cond:
+            return self._snapshot if self._is_fresh(self._snapshot) else None
+
+    def update(self, fn):
+        """Troca o snapshot por fn(snapshot, nova_versão) sem recarregar
+
+        Se não houver snapshot válido (ou uma recarga estiver em andamento),
+        apenas invalida e devolve None.
+        """
+        with self._cond:
+            if self._refilling or not self._is_fresh(self._snapshot):
+                self.invalidate()
+                return None
+            self._snapshot = fn(self._snapshot, next(_data_versions))
+            return self._snapshot
+
+    def invalidate(self):
+        """Marca o snapshot atual como expirado (a próxima leitura recarrega)"""
+        with self._cond:
+            self._generation += 1
+            self._expired_generation = self._generation
+
+    def stats(self):
+        with self._cond:
+            snapshot = self._snapshot
+            return {
+                'version': snapshot.version if snapshot else None,
+                'rows': len(snapshot) if hasattr(snapshot, '__len__') else 0,
+                'age_seconds': round(snapshot.age(), 1) if snapshot else None,
+                'fresh': self._is_fresh(snapshot),
+                'ttl_seconds': self._ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_served': self.stale_served,
+                'refills': self.refills,
+                'last_error': self.last_error
+            }
+
+
+def _fetch_sales_rows():
+    """Tabela inteira, paginada por id (páginas estáveis mesmo com inserts durante a busca)"""
+    return SalesQuery(SNAPSHOT_FIELDS).order('id').fetch_all()
+
+
+def _load_sales_rows():
+    """(linhas, colunas, completo) do snapshot; com SNAPSHOT_DIR as colunas podem vir do disco"""
+    if snapshot_store.enabled:
+        try:
+            return snapshot_store.load(_fetch_sales_rows)
+        except Exception as e:
+            snapshot_store.last_error = str(e)
+            print(f"Erro no snapshot em disco, buscando a tabela inteira: {str(e)}")
+    rows, total = _fetch_sales_rows()
+    complete = total is None or len(rows) >= total
+    if not complete:
+        print(f"⚠️ Snapshot incompleto: {len(rows)} de {total} linhas")
+    return rows, None, complete
+
+
+def _sales_snapshot(loaded, version):
+    rows, columns, complete = loaded
+    return SalesSnapshot(rows, version, columns, complete)
+
+
+sales_cache = SnapshotCache(_load_sales_rows, wrap=_sales_snapshot)
+
+
+def get_sales_snapshot():
+    """Snapshot compartilhado das vendas (uma busca serve todos os endpoints)"""
+    return sales_cache.get()
+
+
+def invalidate_sales_snapshot():
+    """Hook de invalidação: chamar sempre que a tabela for alterada"""
+    sales_cache.invalidate()
+    db_aggregates_cache.invalidate()
+    counts_cache.invalidate()
+    count_breakdown_cache.invalidate()
+    sales_partitions.invalidate()
+
+MESES_PT = {
+    1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril',
+    5: 'Maio', 6: 'Junho', 7: 'Julho', 8: 'Agosto',
+    9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
+}
+
+
+def fmt_currency(value):
+    """Formata valor em reais (R$ 1.234,56)"""
+    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def month_name(mes_key):
+    """'2024-01' -> 'Janeiro/2024'"""
+    ano, mes = mes_key.split('-')
+    return f"{MESES_PT[int(mes)]}/{ano}"
+
+
+AGGREGATE_DICT_FIELDS = (
+    'receita_por_mes', 'vendas_por_mes', 'produtos_total',
+    'quantidade_por_categoria', 'receita_por_categoria',
+    'quantidade_por_regiao', 'receita_por_regiao'
+)
+
+
+class SalesAggregates:
+    """Agregados materializados das vendas, calculados em uma única passada"""
+
+    def __init__(self, version=None, source='python'):
+        self.version = version
+        self.source = source
+        self.rows_processed = 0
+        self.receita_total = 0.0
+        self.receita_por_mes = {}  # 'YYYY-MM' -> receita
+        self.vendas_por_mes = {}  # 'YYYY-MM' -> quantidade de vendas
+        self.produtos_total = {}  # produto -> unidades
+        self.produtos_por_mes = {}  # 'YYYY-MM' -> {produto: unidades}
+        self.quantidade_por_categoria = {}
+        self.receita_por_categoria = {}
+        self.quantidade_por_regiao = {}
+        self.receita_por_regiao = {}
+        self.build_seconds = 0.0
+        self.built_at = time.time()
+        self.incremental_rows = 0  # linhas somadas por uploads desde a última reconstrução
+        self._signature = None
+
+    def age(self):
+        return time.time() - self.built_at
+
+    def add_row(self, row):
+        self.rows_processed += 1
+        try:
+            qty = float(str(row.get('quantidade', 0)).replace(',', '.'))
+            receita = float(str(row.get('receita_total', 0)).replace(',', '.'))
+        except (TypeError, ValueError):
+            return
+
+        prod = row.get('produto', 'Desconhecido')
+        categoria = row.get('categoria', 'Sem categoria')
+        regiao = row.get('regiao', 'Sem região')
+
+        self.receita_total += receita
+        self.produtos_total[prod] = self.produtos_total.get(prod, 0) + qty
+        self.quantidade_por_categoria[categoria] = self.quantidade_por_categoria.get(categoria, 0) + qty
+        self.receita_por_categoria[categoria] = self.receita_por_categoria.get(categoria, 0.0) + receita
+        self.quantidade_por_regiao[regiao] = self.quantidade_por_regiao.get(regiao, 0) + qty
+        self.receita_por_regiao[regiao] = self.receita_por_regiao.get(regiao, 0.0) + receita
+
+        data_str = row.get('data')
+        if not data_str:
+            return
+        try:
+            dt = datetime.fromisoformat(str(data_str)[:10])
+        except ValueError:
+            return
+        mes_key = f"{dt.year}-{dt.month:02d}"
+        self.receita_por_mes[mes_key] = self.receita_por_mes.get(mes_key, 0.0) + receita
+        self.vendas_por_mes[mes_key] = self.vendas_por_mes.get(mes_key, 0) + 1
+        produtos_mes = self.produtos_por_mes.setdefault(mes_key, {})
+        produtos_mes[prod] = produtos_mes.get(prod, 0) + qty
+
+    def clone(self, version=None):
+        other = SalesAggregates(version, self.source)
+        other.rows_processed = self.rows_processed
+        other.receita_total = self.receita_total
+        for field in AGGREGATE_DICT_FIELDS:
+            setattr(other, field, dict(getattr(self, field)))
+        other.produtos_por_mes = {mes: dict(prods) for mes, prods in self.produtos_por_mes.items()}
+        other.build_seconds = self.build_seconds
+        other.built_at = self.built_at
+        other.incremental_rows = self.incremental_rows
+        return other
+
+    def content_signature(self):
+        """Hash do conteúdo (valores em centavos), igual entre recargas dos mesmos dados
+
+        A version muda a cada recarga do snapshot, mesmo sem mudança nos dados;
+        caches de respostas usam esta assinatura para sobreviver ao TTL.
+        """
+        if self._signature is None:
+            digest = hashlib.blake2b(digest_size=12)
+            digest.update(repr((self.rows_processed, round(self.receita_total, 2))).encode())
+            for field in AGGREGATE_DICT_FIELDS:
+                items = sorted((str(key), round(value, 2)) for key, value in getattr(self, field).items())
+                digest.update(repr((field, items)).encode())
+            for mes_key in sorted(self.produtos_por_mes):
+                items = sorted((str(key), round(value, 2)) for key, value in self.produtos_por_mes[mes_key].items())
+                digest.update(repr((mes_key, items)).encode())
+            self._signature = digest.hexdigest()
+        return self._signature
+
+    def with_rows(self, rows, version):
+        """Cópia com as linhas novas somadas: custo proporcional às linhas novas, não à tabela"""
+        other = self.clone(version)
+        for row in rows:
+            other.add_row(row)
+        other.incremental_rows += len(rows)
+        return other
+
+    def months(self):
+        """Chaves 'YYYY-MM' em ordem cronológica"""
+        return sorted(self.receita_por_mes)
+
+    def years(self):
+        return sorted({int(mes_key[:4]) for mes_key in self.receita_por_mes})
+
+    def period_label(self):
+        """'2024' para um ano só, '2023 a 2025' para vários"""
+        years = self.years()
+        if not years:
+            return 'período analisado'
+        return str(years[0]) if len(years) == 1 else f'{years[0]} a {years[-1]}'
+
+    def year_summaries(self):
+        """Receita e vendas por ano a partir dos totais mensais (sem linhas brutas)"""
+        summaries = {}
+        for mes_key in self.months():
+            summary = summaries.setdefault(int(mes_key[:4]), {'receita': 0.0, 'vendas': 0, 'meses': 0})
+            summary['receita'] += self.receita_por_mes[mes_key]
+            summary['vendas'] += self.vendas_por_mes.get(mes_key, 0)
+            summary['meses'] += 1
+        return summaries
+
+    def top_products(self, n=None, mes_key=None):
+        produtos = self.produtos_por_mes.get(mes_key, {}) if mes_key else self.produtos_total
+        ranking = sorted(produtos.items(), key=lambda x: x[1], reverse=True)
+        return ranking[:n] if n else ranking
+
+    def summary(self):
+        return {
+            'version': self.version,
+            'source': self.source,
+            'rows_processed': self.rows_processed,
+            'months': len(self.receita_por_mes),
+            'products': len(self.produtos_total),
+            'categories': len(self.receita_por_categoria),
+            'regions': len(self.receita_por_regiao),
+            'build_ms': round(self.build_seconds * 1000, 2),
+            'incremental_rows': self.incremental_rows
+        }
+
+
+@traced('aggregate')
+def _build_aggregates_python(rows, version=None):
+    """Store de agregados com uma passada linha a linha (sem NumPy)"""
+    started = time.perf_counter()
+    aggregates = SalesAggregates(version)
+    for row in rows:
+        aggregates.add_row(row)
+    aggregates.build_seconds = time.perf_counter() - started
+    return aggregates
+
+
+def _to_float(value):
+    try:
+        return float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _float_column(np, values):
+    """float64 direto; só cai no parse valor a valor se houver texto (ex: '1,5')"""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([_to_float(v) for v in values], dtype=np.float64)
+
+
+def _factorize(np, values, known=()):
+    """Códigos int32 por valor distinto, na ordem em que aparecem (após os já conhecidos)"""
+    index = {label: i for i, label in enumerate(known)}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+class _ColumnBuffers:
+    """Arrays com folga no final para acrescentar linhas sem copiar as existentes
+
+    Cada SalesColumns enxerga um prefixo dos buffers ([:n]). Só colunas que
+    terminam exatamente no que já foi escrito podem continuar escrevendo; as
+    demais (ex: um snapshot antigo) copiam para buffers novos.
+    """
+
+    def __init__(self, np, columns, capacity):
+        size = len(columns)
+        self.arrays = {}
+        for name in SalesColumns.NAMES:
+            values = getattr(columns, name)
+            self.arrays[name] = np.empty(capacity, dtype=values.dtype)
+            self.arrays[name][:size] = values
+        self.filled = size
+        self._lock = threading.Lock()
+
+    def views(self, size):
+        return [self.arrays[name][:size] for name in SalesColumns.NAMES]
+
+    def append(self, size, novas):
+        """Escreve novas depois das size primeiras linhas; False se não couber ou size não é o fim"""
+        end = size + len(novas)
+        with self._lock:
+            if size != self.filled or end > len(self.arrays['quantidade']):
+                return False
+            self.filled = end
+        for name in SalesColumns.NAMES:
+            self.arrays[name][size:end] = getattr(novas, name)
+        return True
+
+
+class SalesColumns:
+    """Vendas em colunas NumPy: números em float64 e textos como códigos + rótulos"""
+
+    NAMES = ('quantidade', 'receita', 'produto', 'categoria', 'regiao', 'mes')
+
+    def __init__(self, quantidade, receita, produto, categoria, regiao, mes, labels, buffers=None):
+        self.quantidade = quantidade
+        self.receita = receita
+        self.produto = produto
+        self.categoria = categoria
+        self.regiao = regiao
+        self.mes = mes  # código em labels['mes'] ou -1 quando a data é inválida
+        self.labels = labels
+        self._buffers = buffers  # _ColumnBuffers de onde as colunas são prefixo (with_rows)
+
+    def __len__(self):
+        return len(self.quantidade)
+
+    @classmethod
+    @traced('parse')
+    def from_rows(cls, rows, labels=None):
+        """labels: rótulos de colunas existentes, para manter os mesmos códigos"""
+        import numpy as np
+        labels = labels or {}
+        quantidade = _float_column(np, [row.get('quantidade', 0) for row in rows])
+        receita = _float_column(np, [row.get('receita_total', 0) for row in rows])
+        produto, produtos = _factorize(np, [row.get('produto', 'Desconhecido') for row in rows],
+                                       labels.get('produto', ()))
+        categoria, categorias = _factorize(np, [row.get('categoria', 'Sem categoria') for row in rows],
+                                           labels.get('categoria', ()))
+        regiao, regioes = _factorize(np, [row.get('regiao', 'Sem região') for row in rows],
+                                     labels.get('regiao', ()))
+        datas, datas_distintas = _factorize(np, [str(row.get('data') or '')[:10] for row in rows])
+
+        # Datas são validadas uma vez por valor distinto, não por linha
+        meses = {label: i for i, label in enumerate(labels.get('mes', ()))}
+        mes_por_data = np.full(len(datas_distintas), -1, dtype=np.int32)
+        for i, data_str in enumerate(datas_distintas):
+            try:
+                dt = datetime.fromisoformat(data_str)
+            except ValueError:
+                continue
+            mes_por_data[i] = meses.setdefault(f"{dt.year}-{dt.month:02d}", len(meses))
+        mes = mes_por_data[datas]
+
+        return cls(quantidade, receita, produto, categoria, regiao, mes, {
+            'produto': produtos,
+            'categoria': categorias,
+            'regiao': regioes,
+            'mes': list(meses)
+        })
+
+    def take(self, ids):
+        """Colunas só com as linhas ids (mesmos rótulos e códigos)"""
+        return SalesColumns(*(getattr(self, name)[ids] for name in self.NAMES), self.labels)
+
+    def with_rows(self, rows):
+        """Novas colunas com as linhas acrescentadas ao final
+
+        As linhas novas são escritas na folga dos buffers (custo proporcional a
+        elas); sem folga, os buffers são realocados com o dobro do tamanho.
+        """
+        import numpy as np
+        novas = SalesColumns.from_rows(rows, self.labels)
+        size = len(self)
+        buffers = self._buffers
+        if buffers is None or not buffers.append(size, novas):
+            buffers = _ColumnBuffers(np, self, max(2 * (size + len(novas)), 1024))
+            buffers.append(size, novas)
+        return SalesColumns(*buffers.views(size + len(novas)), novas.labels, buffers)
+
+
+class _RowGroups:
+    """Ids das linhas agrupados por código (formato CSR)
+
+    order traz os ids ordenados pelo código (estável, logo crescentes dentro de cada
+    grupo) e as linhas do código c ocupam o intervalo offsets[c]:offsets[c + 1].
+    """
+
+    def __init__(self, np, codes, size):
+        order = np.argsort(codes, kind='stable')
+        valid = codes >= 0
+        # Códigos -1 (ex: data inválida) ficam no início da ordenação e são descartados
+        self.order = order[len(codes) - int(valid.sum()):]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(codes[valid], minlength=size))))
+
+    def rows(self, code):
+        return self.order[self.offsets[code]:self.offsets[code + 1]]
+
+
+class SalesIndex:
+    """Índice do snapshot: mês ('YYYY-MM'), produto, categoria e região -> ids das linhas
+
+    Consultas filtradas só tocam as linhas do menor grupo filtrado, em vez de
+    percorrer todas as linhas a cada pergunta.
+    """
+    FIELDS = ('mes', 'produto', 'categoria', 'regiao')
+
+    def __init__(self, columns):
+        import numpy as np
+        started = time.perf_counter()
+        self.columns = columns
+        self._codes = {field: {label: i for i, label in enumerate(columns.labels[field])}
+                       for field in self.FIELDS}
+        self._groups = {field: _RowGroups(np, getattr(columns, field), len(columns.labels[field]))
+                        for field in self.FIELDS}
+        self.build_seconds = time.perf_counter() - started
+
+    def labels(self, field):
+        return self.columns.labels[field]
+
+    def rows(self, **filters):
+        """Ids das linhas que atendem a todos os filtros (None = sem filtro, todas as linhas)
+
+        Cada filtro aceita um valor ou uma lista de valores, ex:
+        rows(mes=['2024-01', '2025-01'], regiao='Sul').
+        """
+        import numpy as np
+        selected = []
+        for field, values in filters.items():
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            codes = [self._codes[field][value] for value in values if value in self._codes[field]]
+            groups = [self._groups[field].rows(code) for code in codes]
+            if not groups:
+                return np.empty(0, dtype=np.intp)
+            ids = groups[0] if len(groups) == 1 else np.sort(np.concatenate(groups))
+            selected.append((field, codes, ids))
+        if not selected:
+            return None
+        
+        # Parte do menor grupo e confere os demais filtros só nessas linhas
+        selected.sort(key=lambda item: len(item[2]))
+        ids = selected[0][2]
+        for field, codes, _ in selected[1:]:
+            ids = ids[np.isin(getattr(self.columns, field)[ids], codes)]
+        return ids
+
+    def top_products(self, n=None, **filters):
+        """Ranking (produto, quantidade) das linhas filtradas"""
+        import numpy as np
+        ids = self.rows(**filters)
+        produto, quantidade, receita = self.columns.produto, self.columns.quantidade, self.columns.receita
+        if ids is not None:
+            produto, quantidade, receita = produto[ids], quantidade[ids], receita[ids]
+        # Mesmo critério do store de agregados: linhas com número inválido ficam de fora
+        valid = ~(np.isnan(quantidade) | np.isnan(receita))
+        produto, quantidade = produto[valid], quantidade[valid]
+        size = len(self.columns.labels['produto'])
+        present = np.flatnonzero(np.bincount(produto, minlength=size))
+        sums = np.bincount(produto, weights=quantidade, minlength=size)[present]
+        labels = self.columns.labels['produto']
+        top = [(labels[present[i]], float(sums[i])) for i in np.argsort(-sums, kind='stable')]
+        return top[:n] if n else top
+
+
+def _group_sums(np, codes, labels, *weights):
+    """Soma cada coluna de pesos por código; devolve (rótulos presentes, contagens, somas...)"""
+    counts = np.bincount(codes, minlength=len(labels))
+    present = np.flatnonzero(counts)
+    keys = [labels[i] for i in present]
+    sums = [np.bincount(codes, weights=w, minlength=len(labels))[present].tolist() for w in weights]
+    return keys, counts[present].tolist(), sums
+
+
+@traced('aggregate')
+def aggregate_columns(columns, version=None):
+    """Todos os group-bys do store de agregados com operações vetorizadas"""
+    import numpy as np
+    aggregates = SalesAggregates(version, source='numpy')
+    aggregates.rows_processed = len(columns)
+
+    valid = ~(np.isnan(columns.quantidade) | np.isnan(columns.receita))
+    qty = columns.quantidade[valid]
+    receita = columns.receita[valid]
+    produto = columns.produto[valid]
+    labels = columns.labels
+    aggregates.receita_total = float(receita.sum())
+
+    keys, _, (sums,) = _group_sums(np, produto, labels['produto'], qty)
+    aggregates.produtos_total = dict(zip(keys, sums))
+
+    keys, _, (qtys, receitas) = _group_sums(np, columns.categoria[valid], labels['categoria'], qty, receita)
+    aggregates.quantidade_por_categoria = dict(zip(keys, qtys))
+    aggregates.receita_por_categoria = dict(zip(keys, receitas))
+
+    keys, _, (qtys, receitas) = _group_sums(np, columns.regiao[valid], labels['regiao'], qty, receita)
+    aggregates.quantidade_por_regiao = dict(zip(keys, qtys))
+    aggregates.receita_por_regiao = dict(zip(keys, receitas))
+
+    dated = columns.mes[valid] >= 0
+    mes = columns.mes[valid][dated]
+    keys, counts, (receitas,) = _group_sums(np, mes, labels['mes'], receita[dated])
+    aggregates.receita_por_mes = dict(zip(keys, receitas))
+    aggregates.vendas_por_mes = dict(zip(keys, counts))
+
+    # Produto x mês como um único código combinado
+    n_produtos = len(labels['produto'])
+    combinado = mes.astype(np.int64) * n_produtos + produto[dated]
+    tamanho = len(labels['mes']) * n_produtos
+    counts = np.bincount(combinado, minlength=tamanho)
+    sums = np.bincount(combinado, weights=qty[dated], minlength=tamanho)
+    for idx in np.flatnonzero(counts).tolist():
+        m, p = divmod(idx, n_produtos)
+        aggregates.produtos_por_mes.setdefault(labels['mes'][m], {})[labels['produto'][p]] = float(sums[idx])
+    return aggregates
+
+
+_numpy_available = None
+
+
+def _numpy_engine_enabled(size=None):
+    """Usar o motor colunar para size linhas (size=None: sempre que o NumPy estiver disponível)
+
+    Em 'auto', tabelas pequenas ficam no laço em Python enquanto o NumPy não foi
+    importado: o import (~100ms) custaria mais que a agregação na partida a frio.
+    """
+    global _numpy_available
+    if AGGREGATION_ENGINE not in ('numpy', 'auto'):
+        return False
+    if _numpy_available is None:
+        import importlib.util
+        _numpy_available = importlib.util.find_spec('numpy') is not None
+    if not _numpy_available:
+        return False
+    return (AGGREGATION_ENGINE == 'numpy' or size is None
+            or size >= AGGREGATION_NUMPY_MIN_ROWS or 'numpy' in sys.modules)
+
+
+def build_sales_aggregates(rows, version=None, columns=None):
+    """Reconstrói o store de agregados (motor colunar NumPy ou laço em Python)"""
+    if columns is None and not _numpy_engine_enabled(len(rows)):
+        return _build_aggregates_python(rows, version)
+    started = time.perf_counter()
+    if columns is None:
+        columns = SalesColumns.from_rows(rows)
+    aggregates = aggregate_columns(columns, version)
+    aggregates.build_seconds = time.perf_counter() - started
+    return aggregates
+
+
+class SnapshotStore:
+    """Colunas do snapshot gravadas em disco para a próxima instância não repaginar a tabela
+
+    Cada gravação cria uma pasta com um .npy por coluna (lido com mmap) e o arquivo
+    <tabela>.json aponta para ela, junto com os rótulos e a assinatura da tabela
+    (total de linhas + maior id). Na carga a assinatura é conferida no Supabase:
+    igual, as colunas vêm direto do disco; com linhas novas (ids maiores), só elas
+    são buscadas. UPDATEs não mudam a assinatura: o upload que atualiza linhas
+    existentes (upsert) descarta o snapshot, e UPDATEs feitos por fora não são
+    detectados.
+    """
+
+    COLUMNS = ('quantidade', 'receita', 'produto', 'categoria', 'regiao', 'mes')
+
+    def __init__(self, directory, table):
+        self.directory = directory
+        self.table = table
+        self._lock = threading.Lock()
+        self.disk_loads = 0
+        self.delta_loads = 0
+        self.full_loads = 0
+        self.saves = 0
+        self.last_load_ms = None
+        self.last_save_ms = None
+        self.last_error = None
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and _numpy_engine_enabled()
+
+    def _meta_path(self):
+        return os.path.join(self.directory, f'{self.table}.json')
+
+    @traced('count')
+    def signature(self):
+        """(total de linhas, maior id) num único GET de uma linha"""
+        params = {'select': 'id', 'order': 'id.desc', 'limit': 1}
+        response = supabase_request('GET', 'snapshot_signature', headers={'Prefer': 'count=exact'},
+                                    params=params, timeout=8)
+        response.raise_for_status()
+        total = _parse_total_count(response.headers.get('Content-Range'))
+        if total is None:
+            raise Exception('Supabase não informou a contagem (Content-Range sem total)')
+        rows = response.json()
+        return total, int(rows[0]['id']) if rows else 0
+
+    @traced('disk')
+    def read(self):
+        """(colunas em mmap, assinatura) gravadas no disco, ou None"""
+        import numpy as np
+        try:
+            with open(self._meta_path(), encoding='utf-8') as f:
+                meta = json.load(f)
+            folder = os.path.join(self.directory, meta['folder'])
+            arrays = [np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r') for name in self.COLUMNS]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Snapshot em disco ilegível, ignorando: {str(e)}")
+            return None
+        if any(len(array) != meta['rows'] for array in arrays):
+            return None
+        return SalesColumns(*arrays, meta['labels']), (meta['rows'], meta['max_id'])
+
+    @traced('disk')
+    def write(self, columns, signature):
+        """Grava as colunas numa pasta nova e só então troca o ponteiro (<tabela>.json)"""
+        import numpy as np
+        import shutil
+        started = time.perf_counter()
+        with self._lock:
+            folder = f'{self.table}-{time.time_ns()}'
+            path = os.path.join(self.directory, folder)
+            os.makedirs(path)
+            for name in self.COLUMNS:
+                np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(getattr(columns, name)))
+            meta = {
+                'folder': folder,
+                'rows': signature[0],
+                'max_id': signature[1],
+                'labels': columns.labels,
+                'saved_at': datetime.now().isoformat()
+            }
+            tmp_path = f'{self._meta_path()}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, self._meta_path())
+            # Pastas antigas: arquivos ainda mapeados continuam legíveis até o fim do mmap
+            for entry in os.listdir(self.directory):
+                if entry.startswith(f'{self.table}-') and entry != folder:
+                    shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+            self.saves += 1
+            self.last_save_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def discard(self):
+        """Esquece o snapshot gravado (a próxima carga relê a tabela)"""
+        if not self.directory:
+            return
+        with self._lock:
+            try:
+                os.remove(self._meta_path())
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.last_error = str(e)
+
+    def _save(self, columns, signature):
+        try:
+            self.write(columns, signature)
+        except OSError as e:
+            self.last_error = str(e)
+            print(f"Erro ao gravar snapshot em disco: {str(e)}")
+
+    def load(self, fetch_rows):
+        """(linhas, colunas, completo): do disco, do disco + linhas novas ou da tabela inteira"""
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        signature = self.signature()
+        stored = self.read()
+        try:
+            if stored is not None:
+                columns, saved = stored
+                if saved == signature:
+                    self.disk_loads += 1
+                    return None, columns, True
+                missing = signature[0] - saved[0]
+                if missing > 0 and signature[1] > saved[1]:
+                    rows, error = SalesQuery(SNAPSHOT_FIELDS).after_id(saved[1]).order('id').fetch(max_records=missing)
+                    if error:
+                        raise Exception(error)
+                    # Quantidade diferente: houve exclusões, só a carga completa é confiável
+                    if len(rows) == missing:
+                        columns = columns.with_rows(rows)
+                        self._save(columns, signature)
+                        self.delta_loads += 1
+                        return None, columns, True
+
+            rows, _ = fetch_rows()
+            columns = SalesColumns.from_rows(rows)
+            # Linhas inseridas ou apagadas durante a busca: a assinatura já não descreve o que foi lido
+            if len(rows) == signature[0]:
+                self._save(columns, signature)
+            else:
+                self.last_error = (f'carga completa com {len(rows)} linhas, tabela com {signature[0]}: '
+                                   f'snapshot não gravado')
+                print(f"⚠️ Snapshot em disco não gravado: {self.last_error}")
+            self.full_loads += 1
+            return rows, columns, len(rows) >= signature[0]
+        finally:
+            self.last_load_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'directory': self.directory or None,
+            'disk_loads': self.disk_loads,
+            'delta_loads': self.delta_loads,
+            'full_loads': self.full_loads,
+            'saves': self.saves,
+            'last_load_ms': self.last_load_ms,
+            'last_save_ms': self.last_save_ms,
+            'last_error': self.last_error
+        }
+
+
+snapshot_store = SnapshotStore(SNAPSHOT_DIR, TABLE_NAME)
+
+
+class AggregateViewsMissing(Exception):
+    """As views de resumo não existem no banco (schema antigo)"""
+
+
+class AggregateViewsMismatch(AggregateViewsMissing):
+    """As views existem mas leem outra tabela (contagem diferente de TABLE_NAME)"""
+
+
+@traced('views')
+def _fetch_view(name, select_fields, **params):
+    """Linhas de uma view de resumo, paginadas até o total do Content-Range
+
+    O PostgREST corta cada resposta no max-rows (1000 no Supabase), e views como
+    produto_mes passam disso com muitos produtos × meses. Sem limit, as páginas
+    seguem em ordem estável (order padrão: as colunas pedidas) até o total.
+    """
+    path = f'{AGGREGATE_VIEW_PREFIX}_{name}'
+    if 'limit' in params:
+        pages, headers = False, None
+    else:
+        pages, headers = True, {'Prefer': 'count=exact'}
+        params.setdefault('order', select_fields)
+    params = {'select': select_fields, **params}
+    rows, total = [], None
+    while True:
+        if pages:
+            headers['Range'] = f'{len(rows)}-{len(rows) + SUPABASE_PAGE_SIZE - 1}'
+        response = supabase_request('GET', 'aggregate_view', path=path, headers=headers, params=params, timeout=8)
+        if response.status_code == 404 or (response.status_code >= 400 and 'PGRST205' in response.text):
+            raise AggregateViewsMissing(f'View {path} não encontrada')
+        response.raise_for_status()
+        page = response.json()
+        rows.extend(page)
+        if not pages or not page:
+            return rows
+        if total is None:
+            total = _parse_total_count(response.headers.get('Content-Range'))
+            headers.pop('Prefer')
+        if total is None or len(rows) >= total:
+            return rows
+
+
+def load_aggregates_from_views():
+    """Agregados calculados pelo Postgres (views em supabase_schema.sql)
+
+    Cada view devolve só algumas dezenas de linhas já agrupadas, em vez de
+    transferir a tabela inteira para somar em Python. Na primeira carga (e a
+    cada sync) a contagem da view geral é conferida com a de TABLE_NAME: views
+    criadas sobre outra tabela levantam AggregateViewsMismatch.
+    """
+    global _views_table_checked
+    started = time.perf_counter()
+    views = {
+        'geral': 'registros,receita',
+        'mensal': 'mes,receita,vendas',
+        'produto': 'produto,quantidade',
+        'produto_mes': 'mes,produto,quantidade',
+        'categoria': 'categoria,quantidade,receita',
+        'regiao': 'regiao,quantidade,receita'
+    }
+    check_table = not _views_table_checked
+    with ThreadPoolExecutor(max_workers=len(views) + 1) as executor:
+        futures = {name: executor.submit(_fetch_view, name, fields) for name, fields in views.items()}
+        table_count = executor.submit(count_rows, mode='exact', label='views_check') if check_table else None
+        results = {name: future.result() for name, future in futures.items()}
+
+    if check_table:
+        registros = sum(int(row['registros'] or 0) for row in results['geral'])
+        total = table_count.result()
+        if registros != total:
+            raise AggregateViewsMismatch(
+                f'Views {AGGREGATE_VIEW_PREFIX}_* contam {registros} linhas e a tabela {TABLE_NAME} tem '
+                f'{total}: crie as views sobre {TABLE_NAME} (supabase_schema.sql)')
+        _views_table_checked = True
+
+    aggregates = SalesAggregates(source='database')
+    for row in results['geral']:
+        aggregates.rows_processed += int(row['registros'] or 0)
+        aggregates.receita_total += float(row['receita'] or 0)
+    for row in results['mensal']:
+        aggregates.receita_por_mes[row['mes']] = float(row['receita'] or 0)
+        aggregates.vendas_por_mes[row['mes']] = int(row['vendas'] or 0)
+    for row in results['produto']:
+        aggregates.produtos_total[row['produto']] = float(row['quantidade'] or 0)
+    for row in results['produto_mes']:
+        produtos_mes = aggregates.produtos_por_mes.setdefault(row['mes'], {})
+        produtos_mes[row['produto']] = float(row['quantidade'] or 0)
+    for row in results['categoria']:
+        aggregates.quantidade_por_categoria[row['categoria']] = float(row['quantidade'] or 0)
+        aggregates.receita_por_categoria[row['categoria']] = float(row['receita'] or 0)
+    for row in results['regiao']:
+        aggregates.quantidade_por_regiao[row['regiao']] = float(row['quantidade'] or 0)
+        aggregates.receita_por_regiao[row['regiao']] = float(row['receita'] or 0)
+    aggregates.build_seconds = time.perf_counter() - started
+    return aggregates
+
+
+def _stamp_version(aggregates, version):
+    aggregates.version = version
+    return aggregates
+
+
+db_aggregates_cache = SnapshotCache(load_aggregates_from_views, wrap=_stamp_version, fatal=(AggregateViewsMissing,))
+_views_missing_until = 0.0
+_views_table_checked = False
+_aggregates_lock = threading.Lock()
+_aggregates = None
+_latest_aggregates = None
+
+
+def _local_aggregates():
+    """Agregados da versão atual do snapshot (recalculados só quando a versão muda)"""
+    global _aggregates
+    snapshot = get_sales_snapshot()
+    aggregates = _aggregates
+    if aggregates is not None and aggregates.version >= snapshot.version:
+        return aggregates
+    with _aggregates_lock:
+        if _aggregates is None or _aggregates.version < snapshot.version:
+            started = time.perf_counter()
+            columns = snapshot.columns() if _numpy_engine_enabled(len(snapshot)) else None
+            _aggregates = build_sales_aggregates(snapshot.rows, snapshot.version, columns)
+            _aggregates.build_seconds = time.perf_counter() - started
+            print(f"📊 Agregados reconstruídos: {_aggregates.rows_processed} linhas em "
+                  f"{_aggregates.build_seconds * 1000:.1f}ms (versão {snapshot.version})")
+        return _aggregates
+
+
+def _cached_aggregates():
+    """Agregados válidos em cache agora (views ou snapshot), sem disparar recarga
+
+    Diferente de _latest_aggregates (atualizado só nas leituras), já inclui as
+    linhas somadas por apply_inserted_rows logo após um upload.
+    """
+    aggregates = db_aggregates_cache.peek()
+    if aggregates is None:
+        snapshot, local = sales_cache.peek(), _aggregates
+        if snapshot is not None and local is not None and local.version == snapshot.version:
+            aggregates = local
+    return aggregates
+
+
+def get_sales_aggregates():
+    """Agregados atuais: views do banco quando disponíveis, senão cálculo em Python"""
+    global _views_missing_until, _latest_aggregates
+    if AGGREGATION_SOURCE != 'python' and time.time() >= _views_missing_until:
+        try:
+            _latest_aggregates = db_aggregates_cache.get()
+            return _latest_aggregates
+        except AggregateViewsMissing as e:
+            if AGGREGATION_SOURCE == 'database':
+                raise
+            # Evita testar as views a cada requisição enquanto não forem criadas
+            _views_missing_until = time.time() + AGGREGATE_VIEWS_RETRY_SECONDS
+            print(f"Views de agregação indisponíveis, usando cálculo em Python: {str(e)}")
+        except Exception as e:
+            if AGGREGATION_SOURCE == 'database':
+                raise
+            print(f"Erro nas views de agregação, usando cálculo em Python: {str(e)}")
+    _latest_aggregates = _local_aggregates()
+    return _latest_aggregates
+
+
+def _edge_date(direction):
+    """Primeira ou última data da tabela (uma única linha, só a coluna data)"""
+    params = {'select': 'data', 'order': f'data.{direction}.nullslast', 'limit': 1}
+    response = supabase_request('GET', 'count_bounds', params=params, timeout=8)
+    response.raise_for_status()
+    rows = response.json()
+    return str(rows[0]['data'])[:7] if rows and rows[0].get('data') else None
+
+
+def _count_by_month(total):
+    """Registros por mês: view mensal quando existe, senão um HEAD por mês em paralelo
+
+    A view só vale se somar total (contagem da tabela): views criadas sobre
+    outra tabela caem nos HEADs por mês.
+    """
+    if time.time() >= _views_missing_until:
+        try:
+            by_month = {row['mes']: int(row['vendas'] or 0)
+                        for row in _fetch_view('mensal', 'mes,vendas') if row.get('mes')}
+            if sum(by_month.values()) == total or STATS_COUNT_MODE != 'exact':
+                return by_month
+            print(f"⚠️ View {AGGREGATE_VIEW_PREFIX}_mensal não confere com {TABLE_NAME}, contando por mês")
+        except AggregateViewsMissing:
+            pass
+
+    first, last = _edge_date('asc'), _edge_date('desc')
+    if not first or not last:
+        return {}
+    months = [first]
+    while months[-1] < last:
+        months.append(_next_month(months[-1]))
+
+    def count_month(mes_key):
+        return SalesQuery().month(int(mes_key[:4]), int(mes_key[5:7])).count(label='count_month')
+
+    with ThreadPoolExecutor(max_workers=min(SUPABASE_FETCH_WORKERS, len(months))) as executor:
+        counts = dict(zip(months, executor.map(count_month, months)))
+    return {mes_key: count for mes_key, count in counts.items() if count}
+
+
+def _count_by_upload():
+    """Registros por envio (view vendas_resumo_upload); None se a view não existe"""
+    try:
+        rows = _fetch_view('upload', 'enviado_em,registros', order='enviado_em.desc', limit=50)
+    except AggregateViewsMissing:
+        return None
+    return [{'enviado_em': row['enviado_em'], 'registros': int(row['registros'] or 0)} for row in rows]
+
+
+@traced('count')
+def _load_total_count():
+    started = time.perf_counter()
+    return {'total_records': count_rows(), 'count_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+@traced('count')
+def _load_count_breakdown():
+    """Registros por mês e por envio (só /api/database-stats usa; bem mais caro que o total)"""
+    started = time.perf_counter()
+    counts = {}
+    try:
+        by_month = _count_by_month(counts_cache.get().value['total_records'])
+        counts['by_month'] = [{'mes': mes_key, 'nome': month_name(mes_key), 'registros': by_month[mes_key]}
+                              for mes_key in sorted(by_month)]
+    except Exception as e:
+        print(f"Erro ao contar registros por mês: {str(e)}")
+        counts['by_month'] = None
+    try:
+        counts['by_upload'] = _count_by_upload()
+    except Exception as e:
+        print(f"Erro ao contar registros por envio: {str(e)}")
+        counts['by_upload'] = None
+    counts['count_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return counts
+
+
+# Contagens de /api/database-stats (o painel de upload consulta a cada poucos segundos):
+# o total (um HEAD, também usado por /api/list-files) e o detalhamento ficam em caches separados
+counts_cache = SnapshotCache(_load_total_count, ttl=STATS_CACHE_TTL_SECONDS, wrap=CachedValue)
+count_breakdown_cache = SnapshotCache(_load_count_breakdown, ttl=STATS_CACHE_TTL_SECONDS, wrap=CachedValue)
+
+
+def _year_from_snapshot(year):
+    """Agregados de um ano recortados do snapshot local completo (None se não houver)"""
+    index = local_sales_index()
+    if index is not None:
+        ids = index.rows(mes=[k for k in index.labels('mes') if k.startswith(f'{year}-')])
+        return aggregate_columns(index.columns.take(ids))
+    snapshot = sales_cache.peek()
+    if snapshot is not None and snapshot.complete and snapshot.rows is not None:
+        prefix = f'{year}-'
+        return build_sales_aggregates([row for row in snapshot.rows if str(row.get('data') or '').startswith(prefix)])
+    return None
+
+
+def _year_from_summaries(year):
+    """Agregados de um ano sem linhas brutas: meses recortados dos agregados atuais
+
+    Categoria e região por ano vêm das views *_categoria_ano e *_regiao_ano
+    (duas requisições pequenas); sem elas ficam vazias. Se os agregados atuais
+    vieram do snapshot local (cálculo em Python), o ano é recortado dele.
+    """
+    agg = get_sales_aggregates()
+    if agg.source != 'database':
+        part = _year_from_snapshot(year)
+        if part is not None:
+            return part
+    prefix = f'{year}-'
+    part = SalesAggregates(source=agg.source)
+    for mes_key, receita in agg.receita_por_mes.items():
+        if mes_key.startswith(prefix):
+            part.receita_por_mes[mes_key] = receita
+            part.receita_total += receita
+    for mes_key, vendas in agg.vendas_por_mes.items():
+        if mes_key.startswith(prefix):
+            part.vendas_por_mes[mes_key] = vendas
+            part.rows_processed += vendas
+    for mes_key, produtos in agg.produtos_por_mes.items():
+        if mes_key.startswith(prefix):
+            part.produtos_por_mes[mes_key] = dict(produtos)
+            for produto, quantidade in produtos.items():
+                part.produtos_total[produto] = part.produtos_total.get(produto, 0) + quantidade
+    if agg.source == 'database':
+        try:
+            for field in ('categoria', 'regiao'):
+                for row in _fetch_view(f'{field}_ano', f'{field},quantidade,receita', ano=f'eq.{year}'):
+                    getattr(part, f'quantidade_por_{field}')[row[field]] = float(row['quantidade'] or 0)
+                    getattr(part, f'receita_por_{field}')[row[field]] = float(row['receita'] or 0)
+        except AggregateViewsMissing as e:
+            print(f"Partição {year} sem categoria/região: {str(e)}")
+    return part
+
+
+class YearPartitions:
+    """Agregados por ano, cada ano com o próprio cache
+
+    Com o snapshot local carregado e completo, o ano é recortado dele (pelo índice
+    ou filtrando as linhas, sem nova busca). Senão o ano sai dos agregados por mês
+    e das views por ano (_year_from_summaries): linhas brutas nunca são buscadas
+    só para montar uma partição.
+    """
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, year):
+        with self._lock:
+            cache = self._caches.get(year)
+            if cache is None:
+                cache = SnapshotCache(lambda: self._load(year), wrap=_stamp_version)
+                self._caches[year] = cache
+            return cache
+
+    def _load(self, year):
+        started = time.perf_counter()
+        aggregates = _year_from_snapshot(year)
+        if aggregates is None:
+            aggregates = _year_from_summaries(year)
+        aggregates.build_seconds = time.perf_counter() - started
+        print(f"📆 Partição {year}: {aggregates.rows_processed} linhas em {aggregates.build_seconds * 1000:.1f}ms")
+        return aggregates
+
+    def aggregates(self, year):
+        return self._cache(year).get()
+
+    def invalidate(self, years=None):
+        with self._lock:
+            caches = list(self._caches.values()) if years is None else \
+                [self._caches[year] for year in years if year in self._caches]
+        for cache in caches:
+            cache.invalidate()
+
+    def stats(self):
+        with self._lock:
+            caches = dict(self._caches)
+        return {str(year): cache.stats() for year, cache in sorted(caches.items())}
+
+
+sales_partitions = YearPartitions()
+
+
+def apply_inserted_rows(records):
+    """Hook de upload: soma as linhas inseridas aos caches em vez de reprocessar a tabela"""
+    global _aggregates
+    started = time.perf_counter()
+    fields = SNAPSHOT_FIELDS.split(',')
+    rows = [{field: record.get(field) for field in fields} for record in records]
+    previous = {}
+
+    def append_rows(snapshot, version):
+        previous['version'] = snapshot.version
+        return snapshot.with_rows(rows, version)
+
+    snapshot = sales_cache.update(append_rows)
+    if snapshot is not None:
+        with _aggregates_lock:
+            if _aggregates is not None and _aggregates.version == previous['version']:
+                _aggregates = _aggregates.with_rows(rows, snapshot.version)
+    db_aggregates_cache.update(lambda aggregates, version: aggregates.with_rows(rows, version))
+    counts_cache.invalidate()
+    count_breakdown_cache.invalidate()
+    sales_partitions.invalidate({int(str(row['data'])[:4]) for row in rows if str(row.get('data') or '')[:4].isdigit()})
+    print(f"➕ {len(rows)} linhas somadas aos agregados em {(time.perf_counter() - started) * 1000:.1f}ms")
+
+
+def compare_aggregates(a, b, tolerance=0.01):
+    """Lista as diferenças entre dois stores de agregados (vazia se equivalentes)"""
+    differences = []
+    if a.rows_processed != b.rows_processed:
+        differences.append({'field': 'rows_processed', 'key': None,
+                            'left': a.rows_processed, 'right': b.rows_processed})
+    if abs(a.receita_total - b.receita_total) > tolerance:
+        differences.append({'field': 'receita_total', 'key': None,
+                            'left': round(a.receita_total, 2), 'right': round(b.receita_total, 2)})
+
+    def compare_dicts(field, left, right, key_prefix=None):
+        for key in set(left) | set(right):
+            lv, rv = left.get(key, 0), right.get(key, 0)
+            if abs(lv - rv) > tolerance:
+                differences.append({'field': field, 'key': f'{key_prefix}/{key}' if key_prefix else key,
+                                    'left': round(lv, 2), 'right': round(rv, 2)})
+
+    for field in AGGREGATE_DICT_FIELDS:
+        compare_dicts(field, getattr(a, field), getattr(b, field))
+    for mes_key in set(a.produtos_por_mes) | set(b.produtos_por_mes):
+        compare_dicts('produtos_por_mes', a.produtos_por_mes.get(mes_key, {}),
+                      b.produtos_por_mes.get(mes_key, {}), mes_key)
+    return differences
+
+
+def verify_aggregate_sources():
+    """Compara as views do banco com o cálculo em Python sobre as linhas"""
+    try:
+        database = load_aggregates_from_views()
+    except AggregateViewsMissing as e:
+        return {'checked': False, 'reason': str(e)}
+    snapshot = get_sales_snapshot()
+    local = build_sales_aggregates(snapshot.rows,
+                                   columns=snapshot.columns() if _numpy_engine_enabled(len(snapshot)) else None)
+    differences = compare_aggregates(database, local)
+    return {
+        'checked': True,
+        'matches': not differences,
+        'differences': differences[:50],
+        'database_ms': round(database.build_seconds * 1000, 2),
+        'local_ms': round(local.build_seconds * 1000, 2),
+        'local_engine': local.source
+    }
+
+GEMINI_INSTRUCTIONS = """INSTRUÇÕES DE FORMATAÇÃO:
+- Responda de forma COMPLETA mas DIRETA, focando na pergunta
+- Use emojis com moderação (2-3 no máximo: 📊 💰 🏆 🎯 ⭐)
+- Destaque números importantes com **negrito**
+- Formate valores: R$ X.XXX,XX
+- Seja entusiasmado mas CONCISO (máximo 3-4 parágrafos)
+- SEMPRE use bullet points "•" para listas, NUNCA use asteriscos "*"
+- Organize dados de forma visual e limpa
+
+REGRAS IMPORTANTES:
+1. Se perguntarem "quais produtos", "que produtos", "quais são": SEMPRE liste os nomes
+2. Se perguntarem "quantos produtos": responda o número E liste os nomes
+3. Se perguntarem sobre ranking/top: mostre TOP 5 com valores
+4. Se perguntarem sobre 1 produto específico: seja detalhado sobre aquele produto
+5. Se perguntarem sobre 1 mês específico: foque apenas naquele mês
+6. Se perguntarem comparação: compare os dados relevantes
+
+FORMATO DE RESPOSTA:
+- Comece com um resumo curto (1 linha com número em negrito)
+- Liste itens usando "•" (bullet point) seguido de espaço
+- Se tiver valores/quantidades, mostre após o nome: "• Produto: X unidades"
+- Adicione um insight breve no final (1 frase)
+
+Exemplo CORRETO de formatação:
+"Foram vendidos **25 produtos diferentes**:
+
+• Produto A: 150 unidades
+• Produto B: 120 unidades
+• Produto C: 95 unidades
+
+💡 Insight: Grande variedade de produtos no portfólio!"
+
+NUNCA use este formato ERRADO:
+"* Produto A
+* Produto B"
+"""
+
+
+class PromptContext:
+    """Contexto do Gemini (blocos de resumo) renderizado para um conteúdo dos dados"""
+
+    def __init__(self, blocks, version, signature=None):
+        self.blocks = blocks
+        self.version = version
+        self.signature = signature  # content_signature() dos agregados, chave da memoização
+        self.text = ''.join(blocks.values())
+        self.built_at = time.time()
+        self.build_seconds = 0.0
+
+    def prompt(self, question):
+        return f"{self.text}\n❓ PERGUNTA DO USUÁRIO: {question}\n\n{GEMINI_INSTRUCTIONS}"
+
+    @staticmethod
+    def _size(text):
+        # Estimativa de tokens: ~4 caracteres por token nos modelos Gemini
+        return {'bytes': len(text.encode('utf-8')), 'tokens_estimados': (len(text) + 3) // 4}
+
+    def metrics(self):
+        return dict(self._size(self.text),
+                    version=self.version,
+                    signature=self.signature,
+                    instructions=self._size(GEMINI_INSTRUCTIONS),
+                    blocks={name: self._size(text) for name, text in self.blocks.items()},
+                    build_ms=round(self.build_seconds * 1000, 2))
+
+
+@traced('prompt')
+def build_prompt_context(agg):
+    """Renderiza os blocos do contexto a partir do store de agregados"""
+    started = time.perf_counter()
+    months = agg.months()
+    quantidade_total_vendida = sum(agg.produtos_total.values())
+    
+    years = agg.years()
+    periodo = 'DO ANO' if len(years) <= 1 else 'DO PERÍODO'
+    
+    blocks = {}
+    blocks['resumo'] = (
+        f"Você é um analista de vendas especializado. Aqui está o RESUMO COMPLETO de {agg.rows_processed} registros de vendas de {agg.period_label()}:\n\n"
+        f"📈 RESUMO GERAL {periodo}:\n"
+        f"- Total de registros analisados: {agg.rows_processed}\n"
+        f"- Receita total {periodo.lower()}: {fmt_currency(sum(agg.receita_por_mes.values()))}\n"
+        f"- Quantidade de produtos diferentes vendidos: {len(agg.produtos_total)}\n"
+        f"- Quantidade total de unidades vendidas: {int(quantidade_total_vendida)}\n\n"
+    )
+    
+    if len(years) > 1:
+        # Totais por ano para comparações entre anos
+        lines = ["📆 RESUMO POR ANO:"]
+        for year, summary in agg.year_summaries().items():
+            lines.append(f"- {year}: {fmt_currency(summary['receita'])} ({summary['vendas']} vendas em {summary['meses']} meses)")
+        blocks['resumo_por_ano'] = '\n'.join(lines) + '\n\n'
+    
+    lines = ["📊 RECEITA POR MÊS:"]
+    for mes_key in months:
+        lines.append(f"- {month_name(mes_key)}: {fmt_currency(agg.receita_por_mes[mes_key])} "
+                     f"({agg.vendas_por_mes.get(mes_key, 0)} vendas)")
+    blocks['receita_por_mes'] = '\n'.join(lines) + '\n'
+    
+    lines = ["\n🏆 TOP 10 PRODUTOS MAIS VENDIDOS (quantidade total):"]
+    lines.extend(f"- {prod}: {int(qty)} unidades" for prod, qty in agg.top_products(10))
+    blocks['top_produtos'] = '\n'.join(lines) + '\n'
+    
+    lines = ["\n📅 PRODUTOS MAIS VENDIDOS POR MÊS:"]
+    for mes_key in months:
+        lines.append(f"\n{month_name(mes_key)}:")
+        lines.extend(f"  - {prod}: {int(qty)} unidades" for prod, qty in agg.top_products(3, mes_key))
+    blocks['top_por_mes'] = '\n'.join(lines) + '\n'
+    
+    lines = ["\n📦 VENDAS POR CATEGORIA (unidades e receita):"]
+    for categoria, total_cat in agg.quantidade_por_categoria.items():
+        receita_cat = agg.receita_por_categoria.get(categoria, 0.0)
+        lines.append(f"- {categoria}: {int(total_cat)} unidades | Receita: {fmt_currency(receita_cat)}")
+    lines.append("\n🗺️ VENDAS POR REGIÃO (unidades e receita):")
+    for regiao, total_reg in agg.quantidade_por_regiao.items():
+        receita_reg = agg.receita_por_regiao.get(regiao, 0.0)
+        lines.append(f"- {regiao}: {int(total_reg)} unidades | Receita: {fmt_currency(receita_reg)}")
+    blocks['categorias_regioes'] = '\n'.join(lines) + '\n'
+    
+    context = PromptContext(blocks, agg.version, agg.content_signature())
+    context.build_seconds = time.perf_counter() - started
+    return context
+
+
+_prompt_context = None
+_prompt_context_lock = threading.Lock()
+prompt_context_stats = {'hits': 0, 'builds': 0}
+
+
+def get_prompt_context(agg):
+    """Contexto memoizado: reconstruído só quando o conteúdo dos agregados muda
+
+    Mesma chave do cache de respostas (content_signature): uma recarga pelo TTL
+    com os mesmos dados não reconstrói o prompt.
+    """
+    global _prompt_context
+    signature = agg.content_signature()
+    context = _prompt_context
+    if context is not None and context.signature == signature:
+        prompt_context_stats['hits'] += 1
+        return context
+    with _prompt_context_lock:
+        if _prompt_context is None or _prompt_context.signature != signature:
+            _prompt_context = build_prompt_context(agg)
+            prompt_context_stats['builds'] += 1
+        else:
+            prompt_context_stats['hits'] += 1
+        return _prompt_context
+
+
+# Palavras que não mudam o sentido da pergunta (comparadas já sem acento)
+QUESTION_FILLER_WORDS = frozenset(
+    'o a os as um uma uns umas de do da dos das em no na nos nas ao aos pelo pela '
+    'qual e foi sao me por favor voce pode poderia diga mostre mostra gostaria saber '
+    'queria sobre ola oi obrigado obrigada'.split()
+)
+
+
+def fold_text(text):
+    """Minúsculo, sem acentos e com pontuação trocada por espaço"""
+    folded = unicodedata.normalize('NFKD', text.lower())
+    folded = ''.join(ch if ch.isalnum() else ' ' for ch in folded if not unicodedata.combining(ch))
+    return ' '.join(folded.split())
+
+
+def normalize_question(question):
+    """Forma canônica da pergunta: sem acentos, minúscula, sem pontuação e palavras de preenchimento"""
+    return ' '.join(word for word in fold_text(question).split() if word not in QUESTION_FILLER_WORDS)
+
+
+class AnswerCache:
+    """LRU com TTL das respostas do /api/analyze, chaveado por (pergunta normalizada, assinatura dos dados)"""
+
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL_SECONDS):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] >= self._ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, answer):
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self._max_entries,
+                'ttl_seconds': self._ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'expired': self.expired,
+                'evictions': self.evictions
+            }
+
+
+answer_cache = AnswerCache()
+
+
+class GeminiBackend:
+    """Backend padrão do LLM: Google Gemini via google-generativeai
+
+    Qualquer objeto com name, generate(prompt) -> str e stream(prompt) -> iterável
+    de str pode substituí-lo (ver set_llm_backend).
+    """
+    name = 'gemini'
+
+    def __init__(self, api_key=None, model_name=GEMINI_MODEL):
+        # Import dinâmico (só carrega quando o LLM é usado)
+        import google.generativeai as genai
+
+        api_key = api_key or os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise Exception("GEMINI_API_KEY não configurada")
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self._model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        for chunk in self._model.generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Trecho sem texto (ex: só metadados de segurança)
+                continue
+            if text:
+                yield text
+
+
+class LLMClient:
+    """Backend do LLM criado uma única vez por processo, com latência medida à parte"""
+
+    def __init__(self, factory=GeminiBackend):
+        self._factory = factory
+        self._backend = None
+        self._lock = threading.Lock()
+        self.init_seconds = None
+        self.last_error = None
+        self.stats = HttpStats()
+
+    def backend(self):
+        backend = self._backend
+        if backend is None:
+            with self._lock:
+                if self._backend is None:
+                    started = time.perf_counter()
+                    try:
+                        self._backend = self._factory()
+                    except Exception as e:
+                        self.last_error = str(e)
+                        raise
+                    self.init_seconds = time.perf_counter() - started
+                    self.last_error = None
+                backend = self._backend
+        return backend
+
+    def set_backend(self, backend):
+        with self._lock:
+            self._backend = backend
+            self.init_seconds = 0.0 if backend is not None else None
+            self.last_error = None
+
+    def generate(self, prompt):
+        backend = self.backend()
+        started = time.perf_counter()
+        ok = False
+        try:
+            text = backend.generate(prompt)
+            ok = True
+            return text
+        finally:
+            self.stats.record('generate', time.perf_counter() - started, ok, 0)
+
+    def stream(self, prompt):
+        backend = self.backend()
+        started = time.perf_counter()
+        ok = False
+        try:
+            first = True
+            for text in backend.stream(prompt):
+                if first:
+                    self.stats.record('first_token', time.perf_counter() - started, True, 0)
+                    first = False
+                yield text
+            ok = True
+        finally:
+            self.stats.record('stream', time.perf_counter() - started, ok, 0)
+
+    def prewarm(self):
+        """Cria o backend em segundo plano (chamado no início da instância)"""
+        def warm():
+            try:
+                self.backend()
+                print(f"🤖 LLM pré-aquecido em {self.init_seconds * 1000:.1f}ms")
+            except Exception as e:
+                print(f"Pré-aquecimento do LLM falhou: {str(e)}")
+        threading.Thread(target=warm, daemon=True).start()
+
+    def summary(self):
+        backend = self._backend
+        return {
+            'backend': getattr(backend, 'name', type(backend).__name__) if backend else None,
+            'model': getattr(backend, 'model_name', None),
+            'initialized': backend is not None,
+            'init_ms': round(self.init_seconds * 1000, 2) if self.init_seconds is not None else None,
+            'last_error': self.last_error,
+            'calls': self.stats.snapshot()
+        }
+
+
+llm_client = LLMClient()
+
+
+def set_llm_backend(backend):
+    """Troca o backend do LLM (ex: modelo falso local em testes e benchmarks)"""
+    llm_client.set_backend(backend)
+
+
+if LLM_PREWARM:
+    llm_client.prewarm()
+
+
+@app.before_request
+def start_trace():
+    _trace_local.trace = RequestTrace() if PERF_TRACING else None
+
+
+@app.after_request
+def finish_trace(response):
+    """Header Server-Timing com as etapas da requisição e amostra para /api/perf
+
+    Em respostas em streaming só conta o tempo até o início da resposta.
+    """
+    trace = getattr(_trace_local, 'trace', None)
+    if trace is None:
+        return response
+    _trace_local.trace = None
+    total = time.perf_counter() - trace.started
+    response.headers['Server-Timing'] = trace.server_timing(total)
+    if request.url_rule is not None and request.method != 'OPTIONS':
+        perf_stats.record(request.url_rule.rule, total, trace.spans)
+    return response
+
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check"""
@@ -69,13 +2168,10 @@ def health():
 def metrics():
     """Retorna métricas do Supabase usando requests direto"""
     try:
-        # Buscar todos os registros (até 10000)
-        data, error = query_supabase('produto,quantidade,receita_total,data')
+        # Agregados pré-calculados sobre o snapshot compartilhado
+        agg = get_sales_aggregates()
         
-        if error:
-            raise Exception(error)
-        
-        if not data:
+        if not agg.rows_processed:
             return jsonify({
                 'melhor_mes': {'nome': 'Sem dados', 'valor': 'R$ 0,00'},
                 'produto_mais_vendido': {'nome': 'Sem dados', 'quantidade': 0},
@@ -87,71 +2183,38 @@ def metrics():
                 'no_data': True
             }), 200
         
-        # Processar dados
-        produtos_qty = {}
-        receita_por_mes = {}
-        receita_total = 0.0
-        produtos_set = set()
+        with trace_span('render'):
+            # Melhor mês
+            if agg.receita_por_mes:
+                melhor_mes_key = max(agg.receita_por_mes, key=agg.receita_por_mes.get)
+                melhor_mes_nome = month_name(melhor_mes_key)
+                melhor_mes_valor = agg.receita_por_mes[melhor_mes_key]
+            else:
+                melhor_mes_nome, melhor_mes_valor = 'Sem dados', 0.0
+        
+            # Produto mais vendido
+            if agg.produtos_total:
+                prod_top, qtd_top = agg.top_products(1)[0]
+                qtd_top = int(qtd_top)
+            else:
+                prod_top, qtd_top = 'Sem dados', 0
         
-        meses_pt = {
-            1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril',
-            5: 'Maio', 6: 'Junho', 7: 'Julho', 8: 'Agosto',
-            9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
-        }
-        
-        for row in data:
-            try:
-                prod = row.get('produto', 'Desconhecido')
-                produtos_set.add(prod)
-                
-                qty = float(str(row.get('quantidade', 0)).replace(',', '.'))
-                receita = float(str(row.get('receita_total', 0)).replace(',', '.'))
-                
-                produtos_qty[prod] = produtos_qty.get(prod, 0) + qty
-                receita_total += receita
-                
-                data_str = row.get('data')
-                if data_str:
-                    dt = datetime.fromisoformat(str(data_str)[:10])
-                    mes_nome = f"{meses_pt[dt.month]}/{dt.year}"
-                    receita_por_mes[mes_nome] = receita_por_mes.get(mes_nome, 0.0) + receita
-            except:
-                continue
-        
-        # Melhor mês
-        if receita_por_mes:
-            melhor_mes_nome = max(receita_por_mes, key=receita_por_mes.get)
-            melhor_mes_valor = receita_por_mes[melhor_mes_nome]
-        else:
-            melhor_mes_nome, melhor_mes_valor = 'Sem dados', 0.0
-        
-        # Produto mais vendido
-        if produtos_qty:
-            prod_top = max(produtos_qty, key=produtos_qty.get)
-            qtd_top = int(produtos_qty[prod_top])
-        else:
-            prod_top, qtd_top = 'Sem dados', 0
-        
-        # Formatar moeda
-        def fmt_currency(value):
-            return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-        
-        return jsonify({
-            'melhor_mes': {
-                'nome': melhor_mes_nome,
-                'valor': fmt_currency(melhor_mes_valor)
-            },
-            'produto_mais_vendido': {
-                'nome': prod_top,
-                'quantidade': qtd_top
-            },
-            'quantidade_produtos': len([p for p in produtos_set if p]),
-            'vendas_totais_ano': fmt_currency(receita_total),
-            'files_processed': 1,
-            'records_analyzed': len(data),
-            'last_updated': datetime.utcnow().strftime('%d/%m/%Y %H:%M'),
-            'no_data': False
-        }), 200
+            return jsonify({
+                'melhor_mes': {
+                    'nome': melhor_mes_nome,
+                    'valor': fmt_currency(melhor_mes_valor)
+                },
+                'produto_mais_vendido': {
+                    'nome': prod_top,
+                    'quantidade': qtd_top
+                },
+                'quantidade_produtos': len([p for p in agg.produtos_total if p]),
+                'vendas_totais_ano': fmt_currency(agg.receita_total),
+                'files_processed': 1,
+                'records_analyzed': agg.rows_processed,
+                'last_updated': datetime.utcnow().strftime('%d/%m/%Y %H:%M'),
+                'no_data': False
+            }), 200
         
     except Exception as e:
         print(f"ERRO NO /api/metrics: {str(e)}")
@@ -171,310 +2234,168 @@ def metrics():
 def monthly_metrics():
     """Retorna métricas detalhadas por mês"""
     try:
-        data, error = query_supabase('produto,quantidade,receita_total,data')
+        try:
+            agg = get_sales_aggregates()
+        except Exception as e:
+            print(f"Erro ao carregar agregados: {str(e)}")
+            agg = None
         
-        if error or not data:
+        if agg is None or not agg.rows_processed:
             return jsonify({'no_data': True, 'months': []}), 200
         
-        meses_pt = {
-            1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril',
-            5: 'Maio', 6: 'Junho', 7: 'Julho', 8: 'Agosto',
-            9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
-        }
-        
-        dados_por_mes = {}
-        
-        for row in data:
-            try:
-                data_str = row.get('data')
-                if not data_str:
-                    continue
-                
-                dt = datetime.fromisoformat(str(data_str)[:10])
-                mes_key = f"{dt.year}-{dt.month:02d}"
-                mes_nome = f"{meses_pt[dt.month]}/{dt.year}"
-                
-                if mes_key not in dados_por_mes:
-                    dados_por_mes[mes_key] = {
-                        'nome': mes_nome,
-                        'receita': 0.0,
-                        'vendas': 0,
-                        'produtos': {}
-                    }
-                
-                prod = row.get('produto', 'Desconhecido')
-                qty = float(str(row.get('quantidade', 0)).replace(',', '.'))
-                receita = float(str(row.get('receita_total', 0)).replace(',', '.'))
-                
-                dados_por_mes[mes_key]['receita'] += receita
-                dados_por_mes[mes_key]['vendas'] += 1
-                dados_por_mes[mes_key]['produtos'][prod] = dados_por_mes[mes_key]['produtos'].get(prod, 0) + qty
-            except:
-                continue
-        
-        # Formatar resultado
-        def fmt_currency(value):
-            return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-        
-        months = []
-        for mes_key in sorted(dados_por_mes.keys()):
-            mes_data = dados_por_mes[mes_key]
-            
-            # Top 5 produtos do mês
-            top_produtos = sorted(
-                mes_data['produtos'].items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:5]
+        with trace_span('render'):
+            months = []
+            for mes_key in agg.months():
+                # Top 5 produtos do mês
+                top_produtos = agg.top_products(5, mes_key)
             
-            months.append({
-                'month': mes_data['nome'],
-                'total_revenue': fmt_currency(mes_data['receita']),
-                'total_sales': mes_data['vendas'],
-                'top_products': [
-                    {'name': prod, 'quantity': int(qty)}
-                    for prod, qty in top_produtos
-                ]
-            })
+                months.append({
+                    'month': month_name(mes_key),
+                    'total_revenue': fmt_currency(agg.receita_por_mes[mes_key]),
+                    'total_sales': agg.vendas_por_mes.get(mes_key, 0),
+                    'top_products': [
+                        {'name': prod, 'quantity': int(qty)}
+                        for prod, qty in top_produtos
+                    ]
+                })
         
-        return jsonify({
-            'no_data': False,
-            'months': months
-        }), 200
+            return jsonify({
+                'no_data': False,
+                'months': months
+            }), 200
         
     except Exception as e:
         print(f"ERRO NO /api/monthly-metrics: {str(e)}")
         return jsonify({'no_data': True, 'months': [], 'error': str(e)}), 200
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze():
-    """Análise inteligente com Google Gemini AI usando TODOS os dados agregados"""
-    try:
-        body = request.get_json()
-        question = body.get('message', '')
-        
-        if not question:
-            return jsonify({'answer': '❌ Por favor, faça uma pergunta.'}), 200
-        
-        # Buscar TODOS os dados para análise precisa
-        data, error = query_supabase('produto,quantidade,receita_total,data,categoria,regiao')
-        
-        if error or not data:
-            return jsonify({
-                'answer': '❌ Não foi possível acessar os dados. Verifique a conexão com o Supabase.'
-            }), 200
-        
-        # AGREGAR TODOS OS DADOS (resumo compacto para o Gemini)
-        meses_pt = {
-            1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril',
-            5: 'Maio', 6: 'Junho', 7: 'Julho', 8: 'Agosto',
-            9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'
-        }
-        
-        # Agregações
-        produtos_total = {}  # Total geral de cada produto
-        produtos_por_mes = {}  # Produtos por mês
-        receita_por_mes = {}  # Receita por mês
-        vendas_por_mes = {}  # Quantidade de vendas por mês
-        produtos_por_categoria = {}  # Produtos por categoria
-        receita_por_categoria = {}  # Receita por categoria
-        produtos_por_regiao = {}  # Produtos por região
-        receita_por_regiao = {}  # Receita por região
-        
-        for row in data:
-            try:
-                prod = row.get('produto', 'Desconhecido')
-                qty = float(str(row.get('quantidade', 0)).replace(',', '.'))
-                receita = float(str(row.get('receita_total', 0)).replace(',', '.'))
-                categoria = row.get('categoria', 'Sem categoria')
-                regiao = row.get('regiao', 'Sem região')
-                
-                # Total geral de produtos
-                produtos_total[prod] = produtos_total.get(prod, 0) + qty
-                
-                # Por categoria
-                if categoria not in produtos_por_categoria:
-                    produtos_por_categoria[categoria] = {}
-                    receita_por_categoria[categoria] = 0.0
-                produtos_por_categoria[categoria][prod] = produtos_por_categoria[categoria].get(prod, 0) + qty
-                receita_por_categoria[categoria] += receita
-                
-                # Por região
-                if regiao not in produtos_por_regiao:
-                    produtos_por_regiao[regiao] = {}
-                    receita_por_regiao[regiao] = 0.0
-                produtos_por_regiao[regiao][prod] = produtos_por_regiao[regiao].get(prod, 0) + qty
-                receita_por_regiao[regiao] += receita
-                
-                # Por mês
-                data_str = row.get('data')
-                if data_str:
-                    dt = datetime.fromisoformat(str(data_str)[:10])
-                    mes_nome = f"{meses_pt[dt.month]}/{dt.year}"
-                    
-                    # Produtos por mês
-                    if mes_nome not in produtos_por_mes:
-                        produtos_por_mes[mes_nome] = {}
-                    produtos_por_mes[mes_nome][prod] = produtos_por_mes[mes_nome].get(prod, 0) + qty
-                    
-                    # Receita por mês
-                    receita_por_mes[mes_nome] = receita_por_mes.get(mes_nome, 0.0) + receita
-                    
-                    # Vendas por mês
-                    vendas_por_mes[mes_nome] = vendas_por_mes.get(mes_nome, 0) + 1
-            except:
-                continue
-        
-        # TENTATIVA 1: Usar Gemini AI com dados agregados
-        try:
-            # Import dinâmico (só carrega quando necessário)
-            import google.generativeai as genai
-            
-            gemini_key = os.getenv('GEMINI_API_KEY')
-            if not gemini_key:
-                raise Exception("GEMINI_API_KEY não configurada")
-            
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-2.0-flash-exp')
-            
-            # Preparar contexto com DADOS AGREGADOS (muito mais compacto e preciso)
-            def fmt_currency(value):
-                return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-            
-            # Calcular totais gerais
-            receita_total_ano = sum(receita_por_mes.values())
-            quantidade_produtos_diferentes = len(produtos_total)
-            quantidade_total_vendida = sum(produtos_total.values())
-            
-            context = f"""Você é um analista de vendas especializado. Aqui está o RESUMO COMPLETO de {len(data)} registros de vendas de 2024:
-
-📈 RESUMO GERAL DO ANO:
-- Total de registros analisados: {len(data)}
-- Receita total do ano: {fmt_currency(receita_total_ano)}
-- Quantidade de produtos diferentes vendidos: {quantidade_produtos_diferentes}
-- Quantidade total de unidades vendidas: {int(quantidade_total_vendida)}
-
-📊 RECEITA POR MÊS:
-"""
-            for mes in sorted(receita_por_mes.keys()):
-                context += f"- {mes}: {fmt_currency(receita_por_mes[mes])} ({vendas_por_mes[mes]} vendas)\n"
-            
-            context += f"\n🏆 TOP 10 PRODUTOS MAIS VENDIDOS (quantidade total):\n"
-            top_produtos = sorted(produtos_total.items(), key=lambda x: x[1], reverse=True)[:10]
-            for prod, qty in top_produtos:
-                context += f"- {prod}: {int(qty)} unidades\n"
-            
-            context += f"\n📅 PRODUTOS MAIS VENDIDOS POR MÊS:\n"
-            for mes in sorted(produtos_por_mes.keys()):
-                top_mes = sorted(produtos_por_mes[mes].items(), key=lambda x: x[1], reverse=True)[:3]
-                context += f"\n{mes}:\n"
-                for prod, qty in top_mes:
-                    context += f"  - {prod}: {int(qty)} unidades\n"
-            
-            context += f"\n📦 VENDAS POR CATEGORIA (unidades e receita):\n"
-            for categoria, prods in produtos_por_categoria.items():
-                total_cat = sum(prods.values())
-                receita_cat = receita_por_categoria.get(categoria, 0.0)
-                context += f"- {categoria}: {int(total_cat)} unidades | Receita: {fmt_currency(receita_cat)}\n"
-            
-            context += f"\n🗺️ VENDAS POR REGIÃO (unidades e receita):\n"
-            for regiao, prods in produtos_por_regiao.items():
-                total_reg = sum(prods.values())
-                receita_reg = receita_por_regiao.get(regiao, 0.0)
-                context += f"- {regiao}: {int(total_reg)} unidades | Receita: {fmt_currency(receita_reg)}\n"
-            
-            context += f"\n❓ PERGUNTA DO USUÁRIO: {question}\n\n"
-            context += """INSTRUÇÕES DE FORMATAÇÃO:
-- Responda de forma COMPLETA mas DIRETA, focando na pergunta
-- Use emojis com moderação (2-3 no máximo: 📊 💰 🏆 🎯 ⭐)
-- Destaque números importantes com **negrito**
-- Formate valores: R$ X.XXX,XX
-- Seja entusiasmado mas CONCISO (máximo 3-4 parágrafos)
-- SEMPRE use bullet points "•" para listas, NUNCA use asteriscos "*"
-- Organize dados de forma visual e limpa
-
-REGRAS IMPORTANTES:
-1. Se perguntarem "quais produtos", "que produtos", "quais são": SEMPRE liste os nomes
-2. Se perguntarem "quantos produtos": responda o número E liste os nomes
-3. Se perguntarem sobre ranking/top: mostre TOP 5 com valores
-4. Se perguntarem sobre 1 produto específico: seja detalhado sobre aquele produto
-5. Se perguntarem sobre 1 mês específico: foque apenas naquele mês
-6. Se perguntarem comparação: compare os dados relevantes
-
-FORMATO DE RESPOSTA:
-- Comece com um resumo curto (1 linha com número em negrito)
-- Liste itens usando "•" (bullet point) seguido de espaço
-- Se tiver valores/quantidades, mostre após o nome: "• Produto: X unidades"
-- Adicione um insight breve no final (1 frase)
-
-Exemplo CORRETO de formatação:
-"Foram vendidos **25 produtos diferentes**:
-
-• Produto A: 150 unidades
-• Produto B: 120 unidades
-• Produto C: 95 unidades
-
-💡 Insight: Grande variedade de produtos no portfólio!"
-
-NUNCA use este formato ERRADO:
-"* Produto A
-* Produto B"
-"""
-            
-            response = model.generate_content(context)
-            
-            return jsonify({'answer': response.text}), 200
-            
-        except Exception as gemini_error:
-            print(f"Erro no Gemini: {str(gemini_error)}")
-            
-            # FALLBACK: Análise simples sem IA
-            question_lower = question.lower()
-            
-            # Detectar meses na pergunta
-            meses_nomes = {
-                'janeiro': ('Janeiro/2024', '-01-'), 'fevereiro': ('Fevereiro/2024', '-02-'), 
-                'março': ('Março/2024', '-03-'), 'marco': ('Março/2024', '-03-'),
-                'abril': ('Abril/2024', '-04-'), 'maio': ('Maio/2024', '-05-'), 
-                'junho': ('Junho/2024', '-06-'), 'julho': ('Julho/2024', '-07-'), 
-                'agosto': ('Agosto/2024', '-08-'), 'setembro': ('Setembro/2024', '-09-'),
-                'outubro': ('Outubro/2024', '-10-'), 'novembro': ('Novembro/2024', '-11-'), 
-                'dezembro': ('Dezembro/2024', '-12-')
-            }
-            
-            # Detectar se é comparação entre meses
-            meses_encontrados = []
-            for nome_mes, (mes_completo, filtro) in meses_nomes.items():
-                if nome_mes in question_lower:
-                    meses_encontrados.append((nome_mes, mes_completo, filtro))
-            
-            # Se pergunta sobre COMPARAÇÃO entre meses (detecta 2+ meses OU palavra "compare")
-            if (len(meses_encontrados) >= 2 or 
-                (len(meses_encontrados) >= 1 and any(word in question_lower for word in ['compare', 'compara', 'comparação', 'diferença', 'versus', 'vs']))):
-                
-                def fmt_currency(value):
-                    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-                
-                # Se tem exatamente 2 meses, fazer comparação específica
-                if len(meses_encontrados) == 2:
-                    mes1_nome, mes1_completo, mes1_filtro = meses_encontrados[0]
-                    mes2_nome, mes2_completo, mes2_filtro = meses_encontrados[1]
-                    
-                    receita_mes1 = receita_por_mes.get(mes1_completo, 0.0)
-                    receita_mes2 = receita_por_mes.get(mes2_completo, 0.0)
-                    vendas_mes1 = vendas_por_mes.get(mes1_completo, 0)
-                    vendas_mes2 = vendas_por_mes.get(mes2_completo, 0)
-                    
-                    diferenca = receita_mes2 - receita_mes1
-                    percentual = ((receita_mes2 - receita_mes1) / receita_mes1 * 100) if receita_mes1 > 0 else 0
-                    
-                    vencedor = mes2_completo if receita_mes2 > receita_mes1 else mes1_completo
-                    emoji_resultado = "📈" if diferenca > 0 else "📉"
-                    texto_resultado = "superior" if diferenca > 0 else "inferior"
-                    
-                    answer = f"""📊 **COMPARAÇÃO DE FATURAMENTO** 📊
-
-**{mes1_completo.split('/')[0]} vs {mes2_completo.split('/')[0]}**
+# Palavras-chave de cada intenção (texto já sem acento), na ordem de prioridade do fallback.
+# Expressões mais longas vêm antes para não serem engolidas por uma palavra solta.
+INTENT_KEYWORDS = (
+    ('comparar', r'compar\w*|diferencas?|versus|vs'),
+    ('diversidade', r'quantos produtos|quais produtos|produtos diferentes|variedade|diversidade'),
+    ('ranking', r'top ?5|top ?10|ranking|liste'),
+    ('regiao', r'regiao|regioes|regional'),
+    ('produto', r'vendid[oa]s?|produtos?'),
+    ('categoria', r'categorias?|tipos?'),
+    ('mensal', r'mes|meses|mensal|mensais'),
+    ('total', r'receita total|faturamento total|quanto foi|total do ano'),
+)
+MONTH_NUMBERS = {
+    'janeiro': 1, 'fevereiro': 2, 'marco': 3, 'abril': 4, 'maio': 5, 'junho': 6,
+    'julho': 7, 'agosto': 8, 'setembro': 9, 'outubro': 10, 'novembro': 11, 'dezembro': 12
+}
+# Uma única regex para todas as intenções, meses e anos: a pergunta é lida uma vez só
+INTENT_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(f'(?P<{name}>{pattern})' for name, pattern in INTENT_KEYWORDS)
+    + '|(?P<mes>' + '|'.join(MONTH_NUMBERS) + r')|(?P<ano>(?:19|20)\d\d))\b'
+)
+# Respostas que já tratam os anos citados (as demais usam a partição do ano, se houver um só)
+CROSS_YEAR_INTENTS = ('comparar_meses', 'contexto_mes', 'comparar_anos')
+
+
+class QuestionIntent:
+    """Intenção da pergunta: candidatos em ordem de prioridade, meses e anos citados
+
+    periods traz os pares (ano ou None, mês) em ordem cronológica; months só os meses.
+    """
+
+    def __init__(self, candidates, periods, years):
+        self.candidates = candidates
+        self.periods = periods
+        self.months = sorted({month for _, month in periods})
+        self.years = years
+        self.name = candidates[0] if candidates else 'generico'
+
+    def __repr__(self):
+        return (f'QuestionIntent({self.name!r}, candidates={self.candidates}, '
+                f'periods={self.periods}, years={self.years})')
+
+
+def classify_question(question):
+    """Classifica a pergunta em uma passada (intenções, meses e anos)"""
+    found = set()
+    periods = []
+    years = []
+    previous = None
+    for match in INTENT_PATTERN.finditer(fold_text(question)):
+        kind = match.lastgroup
+        if kind == 'mes':
+            periods.append([None, MONTH_NUMBERS[match.group()]])
+        elif kind == 'ano':
+            year = int(match.group())
+            if year not in years:
+                years.append(year)
+            # "janeiro 2024" / "janeiro de 2024": o ano vale para o mês logo antes
+            if previous == 'mes' and periods[-1][0] is None:
+                periods[-1][0] = year
+        else:
+            found.add(kind)
+        previous = kind if kind != 'ano' else None
+    years.sort()
+    # Um único ano citado vale para todos os meses sem ano ("março e abril de 2024")
+    if len(years) == 1:
+        for period in periods:
+            period[0] = period[0] or years[0]
+    periods = sorted({tuple(period) for period in periods}, key=lambda p: (p[0] or 0, p[1]))
+    
+    candidates = []
+    # Comparação: dois meses citados, ou um mês junto com "compare"/"versus"
+    if len(periods) == 2:
+        candidates.append('comparar_meses')
+    elif len(periods) == 1 and 'comparar' in found:
+        candidates.append('contexto_mes')
+    elif not periods and len(years) >= 2:
+        candidates.append('comparar_anos')
+    candidates.extend(name for name, _ in INTENT_KEYWORDS if name != 'comparar' and name in found)
+    # Três ou mais meses não filtram as demais respostas
+    return QuestionIntent(candidates, periods if len(periods) <= 2 else [], years)
+
+
+def _month_key(agg, number, year=None):
+    """'YYYY-MM' do mês citado: o ano pedido ou o mais recente nos dados que tem esse mês"""
+    if year:
+        return f'{year}-{number:02d}'
+    suffix = f'-{number:02d}'
+    keys = [k for k in agg.months() if k.endswith(suffix)]
+    if keys:
+        return keys[-1]
+    years = [k[:4] for k in agg.months()]
+    return f"{years[-1] if years else datetime.now().year}{suffix}"
+
+
+def _periodo(agg):
+    """'Ano' para dados de um ano só, 'Período' para vários anos"""
+    return 'Ano' if len(agg.years()) <= 1 else 'Período'
+
+
+def _medal(i, fallback="📍"):
+    return "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else fallback
+
+
+def _answer_comparar_meses(agg, question, intent):
+    mes1_key, mes2_key = (_month_key(agg, number, year) for year, number in intent.periods)
+    mes1_completo, mes2_completo = month_name(mes1_key), month_name(mes2_key)
+    # Anos diferentes (ex: janeiro 2024 x janeiro 2025): rótulos com o ano
+    if mes1_key[:4] == mes2_key[:4]:
+        rotulo1, rotulo2 = mes1_completo.split('/')[0], mes2_completo.split('/')[0]
+    else:
+        rotulo1, rotulo2 = mes1_completo, mes2_completo
+    
+    receita_mes1 = agg.receita_por_mes.get(mes1_key, 0.0)
+    receita_mes2 = agg.receita_por_mes.get(mes2_key, 0.0)
+    vendas_mes1 = agg.vendas_por_mes.get(mes1_key, 0)
+    vendas_mes2 = agg.vendas_por_mes.get(mes2_key, 0)
+    
+    diferenca = receita_mes2 - receita_mes1
+    percentual = ((receita_mes2 - receita_mes1) / receita_mes1 * 100) if receita_mes1 > 0 else 0
+    
+    vencedor = mes2_completo if receita_mes2 > receita_mes1 else mes1_completo
+    emoji_resultado = "📈" if diferenca > 0 else "📉"
+    texto_resultado = "superior" if diferenca > 0 else "inferior"
+    
+    answer = f"""📊 **COMPARAÇÃO DE FATURAMENTO** 📊
+
+**{rotulo1} vs {rotulo2}**
 
 📅 **{mes1_completo}**
 💰 Receita: **{fmt_currency(receita_mes1)}**
@@ -493,67 +2414,80 @@ NUNCA use este formato ERRADO:
 • **Vencedor:** 🏆 **{vencedor}**
 
 """
-                    # Adicionar top 3 produtos de cada mês
-                    if mes1_completo in produtos_por_mes and mes2_completo in produtos_por_mes:
-                        top_mes1 = sorted(produtos_por_mes[mes1_completo].items(), key=lambda x: x[1], reverse=True)[:3]
-                        top_mes2 = sorted(produtos_por_mes[mes2_completo].items(), key=lambda x: x[1], reverse=True)[:3]
-                        
-                        answer += f"🏆 **Top 3 Produtos - {mes1_completo.split('/')[0]}**\n"
-                        for i, (prod, qty) in enumerate(top_mes1, 1):
-                            answer += f"{i}. {prod}: {int(qty)} unidades\n"
-                        
-                        answer += f"\n🏆 **Top 3 Produtos - {mes2_completo.split('/')[0]}**\n"
-                        for i, (prod, qty) in enumerate(top_mes2, 1):
-                            answer += f"{i}. {prod}: {int(qty)} unidades\n"
-                    
-                    return jsonify({'answer': answer}), 200
-                
-                # Se tem apenas 1 mês mencionado mas pede comparação, mostrar contexto geral
-                elif len(meses_encontrados) == 1:
-                    mes_nome, mes_completo, mes_filtro = meses_encontrados[0]
-                    
-                    # Mostrar ranking de todos os meses com destaque no mês mencionado
-                    meses_ordenados = sorted(receita_por_mes.items(), key=lambda x: x[1], reverse=True)
-                    
-                    answer = f"""📊 **COMPARAÇÃO MENSAL - Contexto de {mes_completo}** 📊
+    # Adicionar top 3 produtos de cada mês
+    if mes1_key in agg.produtos_por_mes and mes2_key in agg.produtos_por_mes:
+        answer += f"🏆 **Top 3 Produtos - {rotulo1}**\n"
+        for i, (prod, qty) in enumerate(agg.top_products(3, mes1_key), 1):
+            answer += f"{i}. {prod}: {int(qty)} unidades\n"
+        
+        answer += f"\n🏆 **Top 3 Produtos - {rotulo2}**\n"
+        for i, (prod, qty) in enumerate(agg.top_products(3, mes2_key), 1):
+            answer += f"{i}. {prod}: {int(qty)} unidades\n"
+    
+    return answer
+
+
+def _answer_contexto_mes(agg, question, intent):
+    # Mostrar ranking de todos os meses com destaque no mês mencionado
+    mes_consultado = _month_key(agg, intent.periods[0][1], intent.periods[0][0])
+    meses_ordenados = sorted(agg.months(), key=lambda k: agg.receita_por_mes[k], reverse=True)
+    
+    answer = f"""📊 **COMPARAÇÃO MENSAL - Contexto de {month_name(mes_consultado)}** 📊
 
 📊 **Ranking de Todos os Meses:**
 
 """
-                    for i, (mes, receita) in enumerate(meses_ordenados, 1):
-                        vendas = vendas_por_mes.get(mes, 0)
-                        emoji = "⭐" if mes == mes_completo else "📍"
-                        destaque = " **← MÊS CONSULTADO**" if mes == mes_completo else ""
-                        answer += f"{emoji} **{i}º {mes}**: {fmt_currency(receita)} ({vendas} vendas){destaque}\n"
-                    
-                    return jsonify({'answer': answer}), 200
-            
-            # Detectar mês único para filtros simples
-            mes_filtro = None
-            mes_nome = None
-            for nome_mes, (mes_completo, filtro) in meses_nomes.items():
-                if nome_mes in question_lower and len(meses_encontrados) <= 1:
-                    mes_filtro = filtro
-                    mes_nome = nome_mes.capitalize()
-                    break
-            
-            # IMPORTANTE: Verificar "quantos produtos" ANTES de "produto mais vendido"
-            # Se pergunta sobre QUANTOS PRODUTOS ou DIVERSIDADE
-            if any(word in question_lower for word in ['quantos produtos', 'quais produtos', 'produtos diferentes', 'variedade', 'diversidade']):
-                def fmt_currency(value):
-                    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-                
-                qtd_produtos = len(produtos_total)
-                total_unidades = sum(produtos_total.values())
-                
-                # Top 10 produtos
-                top_10 = sorted(produtos_total.items(), key=lambda x: x[1], reverse=True)[:10]
-                
-                answer = f"""🛒 **DIVERSIDADE DE PRODUTOS** 🛒
+    for i, mes_key in enumerate(meses_ordenados, 1):
+        emoji = "⭐" if mes_key == mes_consultado else "📍"
+        destaque = " **← MÊS CONSULTADO**" if mes_key == mes_consultado else ""
+        answer += (f"{emoji} **{i}º {month_name(mes_key)}**: {fmt_currency(agg.receita_por_mes[mes_key])} "
+                   f"({agg.vendas_por_mes.get(mes_key, 0)} vendas){destaque}\n")
+    
+    return answer
+
+
+def _answer_comparar_anos(agg, question, intent):
+    """Anos lado a lado a partir dos resumos por ano (totais mensais, sem linhas brutas)"""
+    summaries = agg.year_summaries()
+    anos = [year for year in intent.years if year in summaries]
+    if len(anos) < 2:
+        return None
+    
+    answer = f"""📊 **COMPARAÇÃO ENTRE ANOS** 📊
+
+**{' vs '.join(str(year) for year in anos)}**
+
+"""
+    for year in anos:
+        summary = summaries[year]
+        answer += (f"📅 **{year}**\n💰 Receita: **{fmt_currency(summary['receita'])}**\n"
+                   f"🛒 Vendas: {summary['vendas']} transações em {summary['meses']} meses\n\n")
+    
+    primeiro, ultimo = summaries[anos[0]]['receita'], summaries[anos[-1]]['receita']
+    diferenca = ultimo - primeiro
+    percentual = (diferenca / primeiro * 100) if primeiro > 0 else 0
+    vencedor = max(anos, key=lambda year: summaries[year]['receita'])
+    answer += f"""---
+
+{"📈" if diferenca > 0 else "📉"} **Resultado da Comparação**
+
+• **Diferença ({anos[0]} → {anos[-1]}):** {fmt_currency(abs(diferenca))}
+• **Variação:** {abs(percentual):.1f}% {"superior" if diferenca > 0 else "inferior"}
+• **Vencedor:** 🏆 **{vencedor}**
+"""
+    return answer
+
+
+def _answer_diversidade(agg, question, intent):
+    produtos_total = agg.produtos_total
+    qtd_produtos = len(produtos_total)
+    total_unidades = sum(produtos_total.values())
+    
+    answer = f"""🛒 **DIVERSIDADE DE PRODUTOS** 🛒
 
 📦 **Portfólio Completo**
 
-Foram vendidos **{qtd_produtos} produtos diferentes** em 2024!
+Foram vendidos **{qtd_produtos} produtos diferentes** em {agg.period_label()}!
 📊 Total de unidades vendidas: **{int(total_unidades)}**
 
 ---
@@ -561,95 +2495,165 @@ Foram vendidos **{qtd_produtos} produtos diferentes** em 2024!
 🏆 **Top 10 Produtos Mais Vendidos:**
 
 """
-                for i, (produto, qty) in enumerate(top_10, 1):
-                    emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}️⃣"
-                    answer += f"{emoji} **{produto}**: {int(qty)} unidades\n"
-                
-                # Média de vendas por produto
-                media_por_produto = total_unidades / qtd_produtos if qtd_produtos > 0 else 0
-                answer += f"\n💡 **Insight:** Média de **{int(media_por_produto)} unidades** por produto!"
-                
-                return jsonify({'answer': answer}), 200
-            
-            # Se pergunta sobre TOP 5 ou RANKING
-            if any(word in question_lower for word in ['top 5', 'top5', 'top 10', 'top10', 'ranking', 'liste']):
-                # Top produtos por quantidade
-                top_produtos = sorted(produtos_total.items(), key=lambda x: x[1], reverse=True)[:5]
-                
-                answer = f"""🏆 **TOP 5 PRODUTOS MAIS VENDIDOS** 🏆
+    for i, (produto, qty) in enumerate(agg.top_products(10), 1):
+        answer += f"{_medal(i, f'{i}️⃣')} **{produto}**: {int(qty)} unidades\n"
+    
+    # Média de vendas por produto
+    media_por_produto = total_unidades / qtd_produtos if qtd_produtos > 0 else 0
+    answer += f"\n💡 **Insight:** Média de **{int(media_por_produto)} unidades** por produto!"
+    
+    return answer
 
-"""
-                for i, (produto, qty) in enumerate(top_produtos, 1):
-                    emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "📍"
-                    answer += f"{emoji} **{i}º lugar: {produto}**\n   📦 {int(qty)} unidades vendidas\n\n"
-                
-                total_top5 = sum(qty for _, qty in top_produtos)
-                total_geral = sum(produtos_total.values())
-                percentual = (total_top5 / total_geral * 100) if total_geral > 0 else 0
-                
-                answer += f"💡 **Insight:** Estes 5 produtos representam **{percentual:.1f}%** de todas as vendas!"
-                
-                return jsonify({'answer': answer}), 200
-            
-            # Se pergunta sobre REGIÃO
-            if any(word in question_lower for word in ['região', 'regiao', 'regiões', 'regioes', 'regional']):
-                def fmt_currency(value):
-                    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-                
-                if receita_por_regiao:
-                    # Ordenar regiões por receita
-                    regioes_ordenadas = sorted(receita_por_regiao.items(), key=lambda x: x[1], reverse=True)
-                    
-                    top_regiao, top_receita = regioes_ordenadas[0]
-                    
-                    answer = f"""🗺️ **ANÁLISE POR REGIÃO** 🗺️
 
-🏆 **Região Campeã em Receita:** **{top_regiao}**
-💰 Receita total: **{fmt_currency(top_receita)}**
+def _answer_ranking(agg, question, intent):
+    top_produtos = agg.top_products(5)
+    
+    answer = f"""🏆 **TOP 5 PRODUTOS MAIS VENDIDOS** 🏆
+
+"""
+    for i, (produto, qty) in enumerate(top_produtos, 1):
+        answer += f"{_medal(i)} **{i}º lugar: {produto}**\n   📦 {int(qty)} unidades vendidas\n\n"
+    
+    total_top5 = sum(qty for _, qty in top_produtos)
+    total_geral = sum(agg.produtos_total.values())
+    percentual = (total_top5 / total_geral * 100) if total_geral > 0 else 0
+    
+    answer += f"💡 **Insight:** Estes 5 produtos representam **{percentual:.1f}%** de todas as vendas!"
+    
+    return answer
+
+
+def _answer_ranking_grupo(titulo, rotulo_lider, nome, receitas, quantidades):
+    """Ranking de receita por região ou categoria (mesmo formato para as duas)"""
+    if not receitas:
+        return None
+    ordenadas = sorted(receitas.items(), key=lambda x: x[1], reverse=True)
+    lider, receita_lider = ordenadas[0]
+    
+    answer = f"""{titulo}
+
+🏆 **{rotulo_lider}:** **{lider}**
+💰 Receita total: **{fmt_currency(receita_lider)}**
 
 ---
 
-📊 **Ranking Completo de Receitas por Região:**
+📊 **Ranking Completo de Receitas por {nome.capitalize()}:**
 
 """
-                    for i, (regiao, receita) in enumerate(regioes_ordenadas, 1):
-                        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "📍"
-                        unidades = sum(produtos_por_regiao.get(regiao, {}).values())
-                        answer += f"{emoji} **{regiao}**: {fmt_currency(receita)} ({int(unidades)} unidades)\n"
-                    
-                    # Calcular participação percentual
-                    receita_total = sum(receita_por_regiao.values())
-                    percentual = (top_receita / receita_total * 100) if receita_total > 0 else 0
-                    
-                    answer += f"\n💡 **Insight:** A região {top_regiao} representa **{percentual:.1f}%** da receita total!"
-                    
-                    return jsonify({'answer': answer}), 200
-            
-            # Se pergunta sobre produto mais vendido
-            if 'vendido' in question_lower or 'produto' in question_lower:
-                produtos_qty = {}
-                
-                for row in data:
-                    data_str = row.get('data', '')
-                    
-                    # Filtrar por mês se especificado
-                    if mes_filtro and mes_filtro not in data_str:
-                        continue
-                    
-                    prod = row.get('produto', 'Desconhecido')
-                    qty = float(str(row.get('quantidade', 0)).replace(',', '.'))
-                    produtos_qty[prod] = produtos_qty.get(prod, 0) + qty
-                
-                if produtos_qty:
-                    top_prod = max(produtos_qty, key=produtos_qty.get)
-                    qty = int(produtos_qty[top_prod])
-                    
-                    # Top 3 para comparação
-                    top_3 = sorted(produtos_qty.items(), key=lambda x: x[1], reverse=True)[:3]
-                    
-                    periodo = f" em **{mes_nome}**" if mes_nome else " no **período analisado**"
-                    
-                    answer = f"""🏆 **PRODUTO CAMPEÃO DE VENDAS** 🏆
+    for i, (chave, receita) in enumerate(ordenadas, 1):
+        answer += f"{_medal(i)} **{chave}**: {fmt_currency(receita)} ({int(quantidades.get(chave, 0))} unidades)\n"
+    
+    # Calcular participação percentual
+    receita_total = sum(receitas.values())
+    percentual = (receita_lider / receita_total * 100) if receita_total > 0 else 0
+    
+    answer += f"\n💡 **Insight:** A {nome} {lider} representa **{percentual:.1f}%** da receita total!"
+    
+    return answer
+
+
+def _answer_regiao(agg, question, intent):
+    return _answer_ranking_grupo("🗺️ **ANÁLISE POR REGIÃO** 🗺️", "Região Campeã em Receita", 'região',
+                                 agg.receita_por_regiao, agg.quantidade_por_regiao)
+
+
+def _answer_categoria(agg, question, intent):
+    return _answer_ranking_grupo("📦 **ANÁLISE POR CATEGORIA** 📦", "Categoria Líder em Receita", 'categoria',
+                                 agg.receita_por_categoria, agg.quantidade_por_categoria)
+
+
+def local_sales_index():
+    """Índice do snapshot local já carregado e completo (None se não houver, sem disparar busca)"""
+    snapshot = sales_cache.peek()
+    if snapshot is None or not snapshot.complete or not _numpy_engine_enabled():
+        return None
+    return snapshot.index()
+
+
+def _label_filters(question, agg):
+    """Categorias e regiões dos dados citadas na pergunta (palavra inteira, sem acento)"""
+    folded = f' {fold_text(question)} '
+    filters = {}
+    for field, labels in (('categoria', agg.receita_por_categoria), ('regiao', agg.receita_por_regiao)):
+        found = [label for label in labels if label and f' {fold_text(str(label))} ' in folded]
+        if found:
+            filters[field] = found
+    return filters
+
+
+def filtered_top_products(mes_keys, filters):
+    """Ranking de produtos das linhas filtradas: índice do snapshot local ou filtro no banco"""
+    index = local_sales_index()
+    if index is not None:
+        return index.top_products(mes=mes_keys, **filters)
+    
+    # Sem snapshot local: o PostgREST filtra e só as colunas do ranking trafegam
+    query = SalesQuery('produto,quantidade,receita_total').where(**filters)
+    if mes_keys:
+        query.months(mes_keys)
+    rows, error = query.fetch()
+    if error:
+        raise Exception(error)
+    totals = {}
+    for row in rows:
+        quantidade, receita = _to_float(row.get('quantidade')), _to_float(row.get('receita_total'))
+        # Mesmo critério do store de agregados: linhas com número inválido ficam de fora
+        if quantidade != quantidade or receita != receita:
+            continue
+        produto = row.get('produto', 'Desconhecido')
+        totals[produto] = totals.get(produto, 0.0) + quantidade
+    return sorted(totals.items(), key=lambda x: x[1], reverse=True)
+
+
+def _answer_produto(agg, question, intent):
+    filters = _label_filters(question, agg)
+    if filters:
+        # Região/categoria citada: ranking só das linhas que atendem aos filtros
+        mes_keys = None
+        periodo = ""
+        year_prefix = f'{intent.years[0]}-' if len(intent.years) == 1 else ''
+        if intent.months:
+            suffix = f'-{intent.months[0]:02d}'
+            mes_keys = [k for k in agg.months() if k.endswith(suffix) and k.startswith(year_prefix)]
+            periodo = f" em **{MESES_PT[intent.months[0]]}**"
+        elif year_prefix:
+            mes_keys = [k for k in agg.months() if k.startswith(year_prefix)]
+            periodo = f" em **{intent.years[0]}**"
+        if mes_keys == []:
+            return None
+        try:
+            produtos_qty = dict(filtered_top_products(mes_keys, filters))
+        except Exception as e:
+            print(f"Erro no ranking filtrado: {str(e)}")
+            return None
+        for field, nome in (('categoria', 'categoria'), ('regiao', 'região')):
+            if field in filters:
+                periodo += f" na {nome} **{', '.join(filters[field])}**"
+    elif intent.months:
+        # Somar o mês pedido em todos os anos a partir dos agregados
+        number = intent.months[0]
+        suffix = f'-{number:02d}'
+        produtos_qty = {}
+        for mes_key in agg.months():
+            if not mes_key.endswith(suffix):
+                continue
+            for prod, q in agg.produtos_por_mes.get(mes_key, {}).items():
+                produtos_qty[prod] = produtos_qty.get(prod, 0) + q
+        periodo = f" em **{MESES_PT[number]}**"
+    else:
+        produtos_qty = agg.produtos_total
+        periodo = " no **período analisado**"
+    
+    if not produtos_qty:
+        return None
+    
+    top_prod = max(produtos_qty, key=produtos_qty.get)
+    qty = int(produtos_qty[top_prod])
+    
+    # Top 3 para comparação
+    top_3 = sorted(produtos_qty.items(), key=lambda x: x[1], reverse=True)[:3]
+    
+    answer = f"""🏆 **PRODUTO CAMPEÃO DE VENDAS** 🏆
 
 🥇 **Produto Mais Vendido{periodo}**
 
@@ -660,107 +2664,64 @@ Foram vendidos **{qtd_produtos} produtos diferentes** em 2024!
 
 📊 **Top 3 Produtos:**
 """
-                    for i, (prod, q) in enumerate(top_3, 1):
-                        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉"
-                        answer += f"{emoji} **{prod}**: {int(q)} unidades\n"
-                    
-                    return jsonify({'answer': answer}), 200
-            
-            # Se pergunta sobre CATEGORIA
-            if any(word in question_lower for word in ['categoria', 'categorias', 'tipo', 'tipos']):
-                def fmt_currency(value):
-                    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-                
-                if receita_por_categoria:
-                    # Ordenar categorias por receita
-                    categorias_ordenadas = sorted(receita_por_categoria.items(), key=lambda x: x[1], reverse=True)
-                    
-                    top_categoria, top_receita = categorias_ordenadas[0]
-                    
-                    answer = f"""📦 **ANÁLISE POR CATEGORIA** 📦
-
-🏆 **Categoria Líder em Receita:** **{top_categoria}**
-💰 Receita total: **{fmt_currency(top_receita)}**
-
----
+    for i, (prod, q) in enumerate(top_3, 1):
+        answer += f"{_medal(i)} **{prod}**: {int(q)} unidades\n"
+    
+    return answer
 
-📊 **Ranking Completo de Receitas por Categoria:**
 
-"""
-                    for i, (categoria, receita) in enumerate(categorias_ordenadas, 1):
-                        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "📍"
-                        unidades = sum(produtos_por_categoria.get(categoria, {}).values())
-                        answer += f"{emoji} **{categoria}**: {fmt_currency(receita)} ({int(unidades)} unidades)\n"
-                    
-                    # Calcular participação percentual
-                    receita_total = sum(receita_por_categoria.values())
-                    percentual = (top_receita / receita_total * 100) if receita_total > 0 else 0
-                    
-                    answer += f"\n💡 **Insight:** A categoria {top_categoria} representa **{percentual:.1f}%** da receita total!"
-                    
-                    return jsonify({'answer': answer}), 200
-            
-            # Se pergunta sobre MELHOR MÊS ou RECEITA POR MÊS
-            if any(word in question_lower for word in ['mês', 'mes', 'mensal', 'meses', 'melhor mês', 'melhor mes']):
-                def fmt_currency(value):
-                    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-                
-                if receita_por_mes:
-                    # Ordenar meses por receita
-                    meses_ordenados = sorted(receita_por_mes.items(), key=lambda x: x[1], reverse=True)
-                    
-                    melhor_mes, melhor_receita = meses_ordenados[0]
-                    
-                    answer = f"""📅 **ANÁLISE MENSAL DE VENDAS** 📅
+def _answer_mensal(agg, question, intent):
+    if not agg.receita_por_mes:
+        return None
+    melhor_key = max(agg.months(), key=lambda k: agg.receita_por_mes[k])
+    
+    answer = f"""📅 **ANÁLISE MENSAL DE VENDAS** 📅
 
-🏆 **Melhor Mês do Ano:** **{melhor_mes}**
-💰 Receita: **{fmt_currency(melhor_receita)}**
+🏆 **Melhor Mês do {_periodo(agg)}:** **{month_name(melhor_key)}**
+💰 Receita: **{fmt_currency(agg.receita_por_mes[melhor_key])}**
 
 ---
 
 📊 **Receita de Todos os Meses:**
 
 """
-                    for mes, receita in sorted(receita_por_mes.items()):
-                        vendas = vendas_por_mes.get(mes, 0)
-                        emoji = "🌟" if mes == melhor_mes else "📍"
-                        answer += f"{emoji} **{mes}**: {fmt_currency(receita)} ({vendas} vendas)\n"
-                    
-                    receita_total = sum(receita_por_mes.values())
-                    answer += f"\n💰 **Receita total do ano:** {fmt_currency(receita_total)}"
-                    
-                    return jsonify({'answer': answer}), 200
-            
-            # Se pergunta sobre RECEITA TOTAL DO ANO
-            if any(word in question_lower for word in ['receita total', 'faturamento total', 'quanto foi', 'total do ano']):
-                def fmt_currency(value):
-                    return f"R$ {value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-                
-                receita_total = sum(receita_por_mes.values())
-                qtd_vendas = sum(vendas_por_mes.values())
-                
-                answer = f"""💰 **RECEITA TOTAL DE 2024** 💰
+    for mes_key in agg.months():
+        emoji = "🌟" if mes_key == melhor_key else "📍"
+        answer += (f"{emoji} **{month_name(mes_key)}**: {fmt_currency(agg.receita_por_mes[mes_key])} "
+                   f"({agg.vendas_por_mes.get(mes_key, 0)} vendas)\n")
+    
+    answer += f"\n💰 **Receita total do {_periodo(agg).lower()}:** {fmt_currency(sum(agg.receita_por_mes.values()))}"
+    
+    return answer
+
 
-📊 **Resultado Geral do Ano**
+def _answer_total(agg, question, intent):
+    receita_total = sum(agg.receita_por_mes.values())
+    qtd_vendas = sum(agg.vendas_por_mes.values())
+    
+    answer = f"""💰 **RECEITA TOTAL DE {agg.period_label().upper()}** 💰
+
+📊 **Resultado Geral do {_periodo(agg)}**
 
 **Receita Total:** {fmt_currency(receita_total)}
 **Total de Vendas:** {qtd_vendas} transações
-**Quantidade de Produtos:** {len(produtos_total)} diferentes
+**Quantidade de Produtos:** {len(agg.produtos_total)} diferentes
 
 ---
 
 📈 **Distribuição Mensal:**
 
 """
-                for mes in sorted(receita_por_mes.keys()):
-                    receita = receita_por_mes[mes]
-                    percentual = (receita / receita_total * 100) if receita_total > 0 else 0
-                    answer += f"• **{mes}**: {fmt_currency(receita)} ({percentual:.1f}%)\n"
-                
-                return jsonify({'answer': answer}), 200
-            
-            # Resposta genérica
-            answer = f"""🤔 **Hmm, preciso de mais contexto!**
+    for mes_key in agg.months():
+        receita = agg.receita_por_mes[mes_key]
+        percentual = (receita / receita_total * 100) if receita_total > 0 else 0
+        answer += f"• **{month_name(mes_key)}**: {fmt_currency(receita)} ({percentual:.1f}%)\n"
+    
+    return answer
+
+
+def _answer_generico(agg, question, intent):
+    return f"""🤔 **Hmm, preciso de mais contexto!**
 
 Recebi sua pergunta: *"{question}"*
 
@@ -789,7 +2750,222 @@ Infelizmente, estou com dificuldades para processar essa análise no momento. Ma
 
 💬 **Dica:** Seja específico nas perguntas para obter respostas mais precisas!
 """
-            return jsonify({'answer': answer}), 200
+
+
+FALLBACK_HANDLERS = {
+    'comparar_meses': _answer_comparar_meses,
+    'contexto_mes': _answer_contexto_mes,
+    'comparar_anos': _answer_comparar_anos,
+    'diversidade': _answer_diversidade,
+    'ranking': _answer_ranking,
+    'regiao': _answer_regiao,
+    'produto': _answer_produto,
+    'categoria': _answer_categoria,
+    'mensal': _answer_mensal,
+    'total': _answer_total,
+}
+
+
+@traced('fallback')
+def keyword_fallback_answer(question, agg):
+    """Resposta sem IA montada a partir dos agregados (intenção classificada pela regex)"""
+    intent = classify_question(question)
+    if len(intent.years) == 1 and intent.name not in CROSS_YEAR_INTENTS:
+        # Pergunta sobre um ano: responde com a partição daquele ano
+        try:
+            year_agg = sales_partitions.aggregates(intent.years[0])
+            # Partição sem categoria/região (views por ano ausentes): essas perguntas usam o total
+            missing = intent.name in ('categoria', 'regiao') and not getattr(year_agg, f'receita_por_{intent.name}')
+            if year_agg.rows_processed and not missing:
+                agg = year_agg
+        except Exception as e:
+            print(f"Erro ao carregar partição {intent.years[0]}: {str(e)}")
+    for name in intent.candidates:
+        answer = FALLBACK_HANDLERS[name](agg, question, intent)
+        if answer is not None:
+            return answer
+    return _answer_generico(agg, question, intent)
+
+
+analyze_stats = HttpStats()
+# Chamadas ao modelo rodam fora da requisição: se o orçamento estourar, terminam em
+# segundo plano e a resposta vai para o answer_cache (a próxima pergunta igual já a recebe)
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_BACKGROUND_WORKERS, thread_name_prefix='llm')
+
+
+def _ndjson(event):
+    return json.dumps(event, ensure_ascii=False) + '\n'
+
+
+def _budget_remaining(request_started):
+    """Segundos restantes do orçamento do modelo (None = sem limite)"""
+    if ANALYZE_LLM_BUDGET_MS <= 0:
+        return None
+    return max(0.0, request_started + ANALYZE_LLM_BUDGET_MS / 1000 - time.perf_counter())
+
+
+def _generate_answer(prompt, cache_key):
+    answer = llm_client.generate(prompt)
+    answer_cache.put(cache_key, answer)
+    return answer
+
+
+_inflight_answers = {}
+_inflight_lock = threading.Lock()
+
+
+def submit_answer(prompt, cache_key):
+    """Dispara o modelo em segundo plano, reaproveitando a chamada em andamento da mesma pergunta"""
+    with _inflight_lock:
+        future = _inflight_answers.get(cache_key)
+        if future is None:
+            future = _llm_executor.submit(_generate_answer, prompt, cache_key)
+            _inflight_answers[cache_key] = future
+    
+    def release(done):
+        with _inflight_lock:
+            if _inflight_answers.get(cache_key) is done:
+                del _inflight_answers[cache_key]
+    
+    future.add_done_callback(release)
+    return future
+
+
+def _stream_answer(prompt, cache_key, events):
+    """Repassa os trechos do modelo para a fila events e guarda a resposta completa no cache"""
+    parts = []
+    try:
+        for text in llm_client.stream(prompt):
+            parts.append(text)
+            events.put(('text', text))
+        if not parts:
+            raise Exception('Resposta vazia do modelo')
+        answer_cache.put(cache_key, ''.join(parts))
+        events.put(('end', None))
+    except Exception as e:
+        events.put(('error', e))
+
+
+def stream_analysis(question, agg, cache_key, cached_answer, request_started):
+    """Resposta do /api/analyze em linhas JSON (NDJSON), enviada à medida que o modelo gera
+
+    Eventos: {"type": "delta", "text"} com cada trecho e {"type": "replace", "text"}
+    quando o texto já enviado deve ser trocado. Se o modelo não começar dentro do
+    orçamento, a resposta sem IA sai como delta provisório e os trechos do modelo a
+    substituem quando chegarem. No final, {"type": "done", "source", "ttfb_ms", "total_ms"}.
+    """
+    if cached_answer is not None:
+        source = 'cache'
+        ttfb = time.perf_counter() - request_started
+        yield _ndjson({'type': 'delta', 'text': cached_answer})
+    else:
+        source = 'gemini'
+        ttfb = None
+        events = queue.Queue()
+        _llm_executor.submit(_stream_answer, get_prompt_context(agg).prompt(question), cache_key, events)
+        received = False
+        provisional = False
+        while True:
+            timeout = None if received or provisional else _budget_remaining(request_started)
+            try:
+                kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                # Orçamento estourado sem nenhum trecho: responde sem IA e continua esperando o modelo
+                print(f"⏱️ Gemini sem resposta em {ANALYZE_LLM_BUDGET_MS:.0f}ms, enviando fallback provisório")
+                provisional = True
+                ttfb = time.perf_counter() - request_started
+                yield _ndjson({'type': 'delta', 'text': keyword_fallback_answer(question, agg), 'provisional': True})
+                continue
+            
+            if kind == 'text':
+                if ttfb is None:
+                    ttfb = time.perf_counter() - request_started
+                # O primeiro trecho do modelo substitui o fallback provisório
+                event_type = 'replace' if provisional and not received else 'delta'
+                received = True
+                yield _ndjson({'type': event_type, 'text': value})
+            elif kind == 'end':
+                break
+            else:
+                print(f"Erro no Gemini: {str(value)}")
+                if provisional and not received:
+                    source = 'fallback'
+                    break
+                # FALLBACK: resposta sem IA pelo mesmo canal, assim que o erro aparece
+                event_type = 'replace' if received else 'delta'
+                source = 'fallback'
+                if ttfb is None:
+                    ttfb = time.perf_counter() - request_started
+                yield _ndjson({'type': event_type, 'text': keyword_fallback_answer(question, agg)})
+                break
+        if source == 'gemini' and provisional:
+            source = 'gemini_upgraded'
+    
+    total = time.perf_counter() - request_started
+    analyze_stats.record(f'stream_ttfb_{source}', ttfb, True, 0)
+    analyze_stats.record(f'stream_total_{source}', total, True, 0)
+    print(f"📡 /api/analyze em streaming ({source}): primeiro byte em {ttfb * 1000:.0f}ms, total {total * 1000:.0f}ms")
+    yield _ndjson({'type': 'done', 'source': source,
+                   'ttfb_ms': round(ttfb * 1000, 2), 'total_ms': round(total * 1000, 2)})
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze():
+    """Análise inteligente com Google Gemini AI usando TODOS os dados agregados"""
+    request_started = time.perf_counter()
+    try:
+        body = request.get_json()
+        question = body.get('message', '')
+        # Streaming (NDJSON): ?stream=1 ou {"stream": true}
+        stream = bool(body.get('stream')) or request.args.get('stream') in ('1', 'true')
+        
+        if not question:
+            return jsonify({'answer': '❌ Por favor, faça uma pergunta.'}), 200
+        
+        # Usar os agregados de TODOS os dados (store materializado do snapshot)
+        try:
+            agg = get_sales_aggregates()
+        except Exception as e:
+            print(f"Erro ao carregar agregados: {str(e)}")
+            agg = None
+        
+        if agg is None or not agg.rows_processed:
+            return jsonify({
+                'answer': '❌ Não foi possível acessar os dados. Verifique a conexão com o Supabase.'
+            }), 200
+        
+        # Pergunta repetida sobre os mesmos dados: devolve a resposta já gerada
+        # Assinatura do conteúdo, não a versão: recargas do snapshot sem dados novos mantêm as respostas
+        cache_key = (normalize_question(question), agg.content_signature())
+        cached_answer = answer_cache.get(cache_key)
+        if stream:
+            return Response(stream_analysis(question, agg, cache_key, cached_answer, request_started),
+                            mimetype='application/x-ndjson',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        if cached_answer is not None:
+            return jsonify({'answer': cached_answer, 'cached': True}), 200
+        
+        # TENTATIVA 1: Gemini em paralelo com o fallback, limitado pelo orçamento
+        # Contexto dos agregados renderizado uma vez por versão; só a pergunta muda
+        future = submit_answer(get_prompt_context(agg).prompt(question), cache_key)
+        fallback_answer = keyword_fallback_answer(question, agg)
+        
+        try:
+            with trace_span('llm'):
+                answer = future.result(timeout=_budget_remaining(request_started))
+        except FuturesTimeout:
+            # O modelo segue em segundo plano e grava a resposta no cache
+            print(f"⏱️ Gemini sem resposta em {ANALYZE_LLM_BUDGET_MS:.0f}ms, respondendo com fallback")
+            analyze_stats.record('budget_exceeded', time.perf_counter() - request_started, True, 0)
+            return jsonify({'answer': fallback_answer, 'fallback': True, 'upgrade_pending': True}), 200
+        except Exception as gemini_error:
+            print(f"Erro no Gemini: {str(gemini_error)}")
+            
+            # FALLBACK: Análise simples sem IA
+            return jsonify({'answer': fallback_answer, 'fallback': True}), 200
+        
+        total_ms = (time.perf_counter() - request_started) * 1000
+        print(f"🤖 Gemini respondeu em {total_ms:.0f}ms (orçamento {ANALYZE_LLM_BUDGET_MS:.0f}ms)")
+        return jsonify({'answer': answer}), 200
         
     except Exception as e:
         print(f"ERRO NO /api/analyze: {str(e)}")
@@ -798,23 +2974,780 @@ Infelizmente, estou com dificuldades para processar essa análise no momento. Ma
 @app.route('/api/sync-data', methods=['POST'])
 def sync_data():
     """Sincroniza dados (recarrega cache/métricas)"""
+    global _views_missing_until, _views_table_checked
     try:
-        # Este endpoint pode ser usado para forçar recarga de dados
-        # Por enquanto, apenas retorna sucesso
-        return jsonify({
+        body = request.get_json(silent=True) or {}
+        verify = body.get('verify') or request.args.get('verify') in ('1', 'true')
+        
+        # Agregados mantidos por uploads, para conferir contra a reconstrução completa
+        incremental = _cached_aggregates()
+        incremental = incremental if incremental is not None and incremental.incremental_rows else None
+        
+        # Recarrega o snapshot e reconstrói o store de agregados em uma passada
+        started = time.perf_counter()
+        _views_missing_until = 0.0  # testa de novo as views (podem ter sido criadas)
+        _views_table_checked = False
+        invalidate_sales_snapshot()
+        agg = get_sales_aggregates()
+        total_seconds = time.perf_counter() - started
+        
+        print(f"🔄 Sync: {agg.rows_processed} linhas, agregados em {agg.build_seconds * 1000:.1f}ms, "
+              f"total {total_seconds * 1000:.1f}ms")
+        
+        result = {
             'success': True,
-            'message': '✅ Dados sincronizados com sucesso! Todas as métricas foram atualizadas.',
+            'message': f'✅ Dados sincronizados com sucesso! {agg.rows_processed} registros processados '
+                       f'e todas as métricas foram atualizadas.',
+            'rows_processed': agg.rows_processed,
+            'rebuild_ms': round(agg.build_seconds * 1000, 2),
+            'total_ms': round(total_seconds * 1000, 2),
+            'aggregates': agg.summary(),
             'timestamp': datetime.now().isoformat()
-        }), 200
+        }
+        if verify:
+            # Confere se views do banco e cálculo em Python dão o mesmo resultado
+            result['verification'] = verify_aggregate_sources()
+            if incremental is not None:
+                differences = compare_aggregates(incremental, agg)
+                result['verification']['incremental'] = {
+                    'incremental_rows': incremental.incremental_rows,
+                    'matches': not differences,
+                    'differences': differences[:50]
+                }
+        return jsonify(result), 200
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Erro na sincronização: {str(e)}'
         }), 500
 
+# Mapear possíveis variações de nomes de colunas
+UPLOAD_COLUMN_MAPPING = {
+    'id_transacao': ['id_transacao', 'id', 'transacao', 'id_venda'],
+    'data': ['data', 'date', 'dt_venda', 'data_venda'],
+    'produto': ['produto', 'product', 'item', 'descricao'],
+    'categoria': ['categoria', 'category', 'tipo'],
+    'regiao': ['regiao', 'region', 'estado', 'uf'],
+    'quantidade': ['quantidade', 'qtd', 'quantity', 'qtde'],
+    'preco_unitario': ['preco_unitario', 'preco', 'price', 'valor_unitario'],
+    'receita_total': ['receita_total', 'total', 'valor_total', 'receita']
+}
+UPLOAD_REQUIRED_COLUMNS = ['data', 'produto', 'quantidade', 'receita_total']
+# Apenas as colunas que existem na tabela
+UPLOAD_VALID_COLUMNS = ['data', 'id_transacao', 'produto', 'categoria', 'regiao',
+                        'quantidade', 'preco_unitario', 'receita_total']
+
+
+class UploadError(Exception):
+    """Erro de validação do arquivo enviado (resposta 400)"""
+
+    def __init__(self, message, **details):
+        super().__init__(message)
+        self.details = details
+
+
+def normalize_column_name(col):
+    """Remove acentos, passa para minúsculas e troca espaços/hífens por _"""
+    col = ''.join(c for c in unicodedata.normalize('NFD', str(col))
+                  if unicodedata.category(c) != 'Mn')
+    return col.lower().replace(' ', '_').replace('-', '_')
+
+
+def _upload_column_targets(columns):
+    """{coluna do arquivo: coluna da tabela} pelo UPLOAD_COLUMN_MAPPING (primeira que casar)"""
+    targets = {}
+    for target_col, possible_names in UPLOAD_COLUMN_MAPPING.items():
+        for col in columns:
+            if col in possible_names:
+                targets[col] = target_col
+                break
+    return targets
+
+
+# Valores que o pandas (read_csv) trata como ausentes; o leitor CSV segue a mesma regra
+CSV_NA_VALUES = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+})
+CSV_YMD_DATE = re.compile(r'(\d{4})[-/](\d{1,2})[-/](\d{1,2})(?:[ T].*)?$')
+CSV_DMY_DATE = re.compile(r'(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})(?:[ T].*)?$')
+
+
+def _csv_date_order(values):
+    """'ymd', 'dmy', 'mdy' ou 'mixed' conforme as datas de amostra (None: formato desconhecido)
+
+    Datas com barra são lidas como dia/mês (padrão brasileiro), a não ser que a
+    amostra só faça sentido como mês/dia (ex: 03/25/2024). Ordens conflitantes
+    na amostra dão 'mixed': cada data é lida pela própria forma.
+    """
+    kinds = set()
+    ambiguous = False
+    for value in values:
+        value = value.strip()
+        if value in CSV_NA_VALUES:
+            continue
+        if CSV_YMD_DATE.match(value):
+            kinds.add('ymd')
+            continue
+        match = CSV_DMY_DATE.match(value)
+        if not match:
+            return None
+        first, second = int(match.group(1)), int(match.group(2))
+        if first > 12:
+            kinds.add('dmy')
+        elif second > 12:
+            kinds.add('mdy')
+        else:
+            ambiguous = True
+    if not kinds:
+        return 'dmy' if ambiguous else 'ymd'
+    if len(kinds) > 1 or (ambiguous and 'ymd' in kinds):
+        return 'mixed'
+    return kinds.pop()
+
+
+def _parse_csv_date(value, order):
+    """'YYYY-MM-DD' da data do CSV na ordem detectada (None se inválida)"""
+    value = value.strip()
+    if order == 'mixed':
+        match = CSV_DMY_DATE.match(value)
+        order = 'ymd' if CSV_YMD_DATE.match(value) else \
+            'mdy' if match and int(match.group(2)) > 12 else 'dmy'
+    match = (CSV_YMD_DATE if order == 'ymd' else CSV_DMY_DATE).match(value)
+    if not match:
+        return None
+    a, b, c = (int(group) for group in match.groups())
+    year, month, day = (a, b, c) if order == 'ymd' else (c, b, a) if order == 'dmy' else (c, a, b)
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+class UploadDates:
+    """Datas do upload lidas com a mesma regra no leitor CSV e no pandas (CSV e Excel)
+
+    A ordem dia/mês é decidida uma vez por arquivo, pelas datas em texto do
+    primeiro bloco (_csv_date_order): ambíguas como 03/04/2024 são dia/mês nos
+    dois caminhos. Células de data do Excel são usadas como estão. invalid
+    conta as linhas descartadas por data vazia ou ilegível.
+    """
+
+    def __init__(self):
+        self.order = None
+        self.invalid = 0
+        self._detected = False
+        self._cache = {}
+
+    def detect(self, values):
+        """Fixa a ordem pela amostra (só no primeiro bloco); False se há formato desconhecido"""
+        if not self._detected:
+            self._detected = True
+            self.order = _csv_date_order([value for value in values if isinstance(value, str)])
+        return self.order is not None
+
+    def parse(self, value):
+        if isinstance(value, datetime):
+            return value.date().isoformat()
+        if isinstance(value, date):
+            return value.isoformat()
+        if not isinstance(value, str):
+            return None
+        parsed = self._cache.get(value, False)
+        if parsed is False:
+            parsed = _parse_csv_date(value, self.order or 'mixed')
+            if parsed is None and self.order is None and value.strip() not in CSV_NA_VALUES:
+                # Formato fora dos reconhecidos (ex: 'Mar 3, 2024'): o pandas tenta, também dia primeiro
+                import pandas as pd
+                timestamp = pd.to_datetime(value, dayfirst=True, errors='coerce')
+                parsed = None if pd.isna(timestamp) else timestamp.date().isoformat()
+            self._cache[value] = parsed
+        return parsed
+
+
+def _parse_csv_number(value):
+    """Número do CSV: '12.5', '12,5' ou com símbolos ('R$ 12,50'), como no caminho pandas"""
+    value = value.strip()
+    if value in CSV_NA_VALUES:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        try:
+            number = float(re.sub(r'[^\d.]', '', value.replace(',', '.')))
+        except ValueError:
+            return None
+    return number if math.isfinite(number) else None
+
+
+def _csv_row_parser(positions, dates):
+    """Função linha do CSV -> registro pronto para o insert (None se inválida)
+
+    Montada uma vez por arquivo: posições das colunas ficam em variáveis locais e
+    cada data distinta é convertida uma única vez pelo UploadDates (arquivos de
+    vendas repetem poucas centenas de datas).
+    """
+    i_data, i_produto, i_quantidade, i_receita = (
+        positions[col] for col in ('data', 'produto', 'quantidade', 'receita_total'))
+    i_id, i_categoria, i_regiao, i_preco = (
+        positions.get(col) for col in ('id_transacao', 'categoria', 'regiao', 'preco_unitario'))
+    width = max(positions.values()) + 1
+    na_values = CSV_NA_VALUES
+    parse_number = _parse_csv_number
+    parse_date = dates.parse
+
+    def parse(row):
+        if len(row) < width:
+            row = row + [''] * (width - len(row))
+        data = parse_date(row[i_data])
+        if data is None:
+            dates.invalid += 1
+            return None
+        produto = row[i_produto]
+        quantidade = parse_number(row[i_quantidade])
+        receita = parse_number(row[i_receita])
+        if produto in na_values or quantidade is None or receita is None:
+            return None
+
+        preco = parse_number(row[i_preco]) if i_preco is not None else None
+        if preco is None:
+            preco = receita / quantidade if quantidade else 0.0
+        id_transacao = row[i_id] if i_id is not None else ''
+        categoria = row[i_categoria] if i_categoria is not None else ''
+        regiao = row[i_regiao] if i_regiao is not None else ''
+        return {
+            'data': data,
+            'id_transacao': id_transacao if id_transacao not in na_values else None,
+            'produto': produto,
+            'categoria': categoria if categoria not in na_values else 'Sem categoria',
+            'regiao': regiao if regiao not in na_values else 'Não especificada',
+            'quantidade': quantidade,
+            'preco_unitario': preco,
+            'receita_total': receita
+        }
+
+    return parse
+
+
+def _csv_upload_batches(file, dates):
+    """Blocos (linhas lidas, registros, números das linhas) de um .csv numa passada só
+
+    Mesmas regras do caminho pandas (colunas equivalentes, vírgula decimal, linhas
+    inválidas descartadas), sem carregar o pandas: cada linha vira direto o
+    registro do insert. Só o primeiro bloco é guardado cru, para detectar o
+    formato das datas; com alguma data fora dos formatos reconhecidos, devolve
+    None com o arquivo de volta ao início.
+    """
+    import csv
+    import io
+
+    stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return iter(())
+    columns = [normalize_column_name(col) for col in header]
+    targets = _upload_column_targets(columns)
+    found_columns = [targets.get(col, col) for col in columns]
+    missing_columns = [col for col in UPLOAD_REQUIRED_COLUMNS if col not in found_columns]
+    if missing_columns:
+        raise UploadError(f'Colunas obrigatórias faltando: {", ".join(missing_columns)}',
+                          found_columns=found_columns)
+    positions = {target: columns.index(col) for col, target in targets.items()}
+
+    # Linhas totalmente vazias são ignoradas (e não contam na numeração), como no pandas
+    rows = (row for row in reader if row)
+    first_chunk = list(itertools.islice(rows, UPLOAD_CHUNK_ROWS))
+    date_column = positions['data']
+    if not dates.detect([row[date_column] for row in first_chunk if date_column < len(row)]):
+        stream.detach()
+        file.stream.seek(0)
+        return None
+    parse = _csv_row_parser(positions, dates)
+
+    def batches():
+        row_number = 0
+        chunk = iter(first_chunk)
+        while True:
+            start = row_number
+            records, row_numbers = [], []
+            for row in chunk:
+                row_number += 1
+                record = parse(row)
+                if record is not None:
+                    records.append(record)
+                    row_numbers.append(row_number)
+            if row_number == start:
+                return
+            yield row_number - start, records, row_numbers
+            chunk = itertools.islice(rows, UPLOAD_CHUNK_ROWS)
+
+    return batches()
+
+
+def _iter_upload_batches(file, file_ext, streaming, dates=None):
+    """(linhas lidas, registros válidos, números das linhas) por bloco do arquivo
+
+    .csv vai pelo módulo csv (sem pandas); Excel, ou CSV com datas em formato não
+    reconhecido, pelo pandas. dates (UploadDates) conta as linhas com data inválida.
+    """
+    dates = dates if dates is not None else UploadDates()
+    if file_ext == '.csv' and UPLOAD_CSV_ENGINE == 'csv':
+        batches = _csv_upload_batches(file, dates)
+        if batches is not None:
+            yield from batches
+            return
+        print("Datas do CSV em formato não reconhecido, lendo com pandas")
+
+    rows_read = 0
+    for chunk in _iter_upload_frames(file, file_ext, streaming):
+        row_offset = rows_read
+        rows_read += len(chunk)
+        df = _prepare_upload_frame(chunk, row_offset, dates)
+        yield len(chunk), _frame_to_records(df), list(df.index)
+
+
+def _iter_upload_frames(file, file_ext, streaming):
+    """DataFrames do arquivo: blocos de UPLOAD_CHUNK_ROWS linhas em modo streaming"""
+    import pandas as pd
+    from io import BytesIO
+
+    if not streaming or file_ext == '.xls':
+        # Arquivo inteiro em memória (.xls não tem leitor incremental)
+        file_content = file.read()
+        if file_ext == '.csv':
+            yield pd.read_csv(BytesIO(file_content))
+        else:
+            yield pd.read_excel(BytesIO(file_content))
+        return
+
+    if file_ext == '.csv':
+        for chunk in pd.read_csv(file.stream, chunksize=UPLOAD_CHUNK_ROWS):
+            yield chunk
+        return
+
+    # .xlsx: openpyxl em modo read-only lê a planilha linha a linha
+    from openpyxl import load_workbook
+    workbook = load_workbook(file.stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [f'Unnamed: {i}' if col is None else col for i, col in enumerate(header)]
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) >= UPLOAD_CHUNK_ROWS:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def _prepare_upload_frame(df, row_offset=0, dates=None):
+    """Normaliza colunas, converte tipos e remove linhas inválidas de um bloco
+
+    O índice do resultado é o número da linha de dados no arquivo (1 = primeira
+    linha após o cabeçalho), usado no relatório de lotes.
+    """
+    import pandas as pd
+
+    df.index = range(row_offset + 1, row_offset + len(df) + 1)
+
+    # Normalizar nomes das colunas
+    df.columns = [normalize_column_name(col) for col in df.columns]
+
+    # Encontrar colunas equivalentes
+    df = df.rename(columns=_upload_column_targets(df.columns))
+
+    # Validar colunas obrigatórias
+    missing_columns = [col for col in UPLOAD_REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        raise UploadError(f'Colunas obrigatórias faltando: {", ".join(missing_columns)}',
+                          found_columns=list(df.columns))
+
+    # Preencher colunas opcionais com valores padrão
+    if 'id_transacao' not in df.columns:
+        df['id_transacao'] = None  # gerado por UploadKeys a partir do conteúdo
+    if 'categoria' not in df.columns:
+        df['categoria'] = 'Sem categoria'
+    if 'regiao' not in df.columns:
+        df['regiao'] = 'Não especificada'
+    if 'preco_unitario' not in df.columns:
+        df['preco_unitario'] = df['receita_total'] / df['quantidade']
+
+    # Datas: mesma regra do leitor CSV (UploadDates), já em ISO
+    dates = dates if dates is not None else UploadDates()
+    raw_dates = df['data'].tolist()
+    dates.detect(raw_dates)
+    df['data'] = [dates.parse(None if pd.isna(value) else value) for value in raw_dates]
+    dates.invalid += int(df['data'].isna().sum())
+
+    # Números (aceita vírgula como decimal)
+    for col in ['quantidade', 'preco_unitario', 'receita_total']:
+        if df[col].dtype == 'object':
+            df[col] = df[col].astype(str).str.replace(',', '.').str.replace(r'[^\d.]', '', regex=True)
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Remover linhas com dados inválidos
+    df = df.dropna(subset=UPLOAD_REQUIRED_COLUMNS)
+    return df[UPLOAD_VALID_COLUMNS]
+
+
+def _frame_to_records(df):
+    """Registros prontos para o insert (datas já em ISO)"""
+    return df.to_dict('records')
+
+
+# Ids só com dígitos (com ou sem '.0' do Excel/pandas) têm uma forma canônica: '001', 1 e 1.0 -> '1'
+UPLOAD_NUMERIC_ID = re.compile(r'(\d+)(?:\.0*)?$')
+# Campos comparados para saber se uma venda já gravada mudou no arquivo
+UPLOAD_CONTENT_FIELDS = ('id_transacao', 'data', 'produto', 'categoria', 'regiao',
+                         'quantidade', 'preco_unitario', 'receita_total')
+
+
+def normalize_transaction_id(value):
+    """id_transacao em texto canônico (None se vazio), igual nos leitores csv e pandas"""
+    if value is None or value != value:  # pandas devolve NaN (float) para células vazias
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    if text in CSV_NA_VALUES:
+        return None
+    match = UPLOAD_NUMERIC_ID.match(text)
+    return str(int(match.group(1))) if match else text
+
+
+def content_digest(record):
+    """Hash do conteúdo da venda (números em centavos): igual para a linha do arquivo e a gravada"""
+    values = []
+    for field in UPLOAD_CONTENT_FIELDS:
+        value = record.get(field)
+        if field in ('quantidade', 'preco_unitario', 'receita_total'):
+            try:
+                value = f'{float(value):.2f}'
+            except (TypeError, ValueError):
+                pass
+        values.append('' if value is None else str(value))
+    return hashlib.blake2b('|'.join(values).encode(), digest_size=12).hexdigest()
+
+
+class UploadKeys:
+    """Chave estável de cada venda do upload (coluna UPLOAD_KEY_COLUMN) para o upsert
+
+    Com id_transacao no arquivo a chave é o próprio id (normalize_transaction_id,
+    a mesma forma nos leitores csv e pandas) e linhas com id repetido no mesmo
+    envio são descartadas. Sem ele (ou com UPLOAD_KEY=hash) a chave é o hash do
+    conteúdo da linha: reenviar o arquivo gera as mesmas chaves, e linhas com
+    conteúdo idêntico no mesmo arquivo são descartadas. O id_transacao que
+    faltava passa a vir desse hash, em vez de um contador que se repete entre
+    arquivos.
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode or UPLOAD_KEY
+        self.duplicates = 0
+        self._seen = set()
+
+    def apply(self, records, row_numbers):
+        """(registros, linhas) sem os repetidos, cada registro com sua chave"""
+        kept, kept_rows = [], []
+        for record, row_number in zip(records, row_numbers):
+            id_transacao = normalize_transaction_id(record.get('id_transacao'))
+            if id_transacao is not None and self.mode != 'hash':
+                key = f'id:{id_transacao}'
+            else:
+                digest = content_digest(dict(record, id_transacao=id_transacao))
+                key = f'h:{digest}'
+                id_transacao = id_transacao or f'TXN-{digest[:12]}'
+            if key in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(key)
+
+            record['id_transacao'] = id_transacao
+            record[UPLOAD_KEY_COLUMN] = key
+            kept.append(record)
+            kept_rows.append(row_number)
+        return kept, kept_rows
+
+
+# Até quando enviar insert simples (tabela sem a coluna/índice único da chave do upsert)
+_upsert_missing_until = 0.0
+UPSERT_MISSING_CODES = ('PGRST204', '42P10', '42703')
+
+
+# POSTs do upload: (rótulo, Prefer, params). 'new' grava só as chaves inéditas e devolve
+# quais foram gravadas; 'merge' atualiza as que já existiam
+UPLOAD_POSTS = {
+    'insert': ('insert_batch', 'return=minimal', None),
+    'new': ('upsert_batch', 'resolution=ignore-duplicates,return=representation',
+            {'on_conflict': UPLOAD_KEY_COLUMN, 'select': UPLOAD_KEY_COLUMN}),
+    'merge': ('merge_batch', 'resolution=merge-duplicates,return=minimal', {'on_conflict': UPLOAD_KEY_COLUMN}),
+}
+
+
+def _upsert_enabled():
+    return UPLOAD_MODE == 'upsert' and time.time() >= _upsert_missing_until
+
+
+def _upsert_missing(response):
+    """True se o upsert foi recusado porque o schema ainda não tem a chave"""
+    if response.status_code != 400:
+        return False
+    try:
+        return response.json().get('code') in UPSERT_MISSING_CODES
+    except ValueError:
+        return False
+
+
+def _request_not_sent(error):
+    """True se a falha foi ao abrir a conexão, antes de o POST chegar ao servidor"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def _stored_digests(keys):
+    """{chave: content_digest da venda gravada} das chaves que já existem na tabela"""
+    stored = {}
+    for i in range(0, len(keys), UPLOAD_KEY_LOOKUP_SIZE):
+        query = SalesQuery(','.join((UPLOAD_KEY_COLUMN,) + UPLOAD_CONTENT_FIELDS))
+        rows, _ = query.where(**{UPLOAD_KEY_COLUMN: keys[i:i + UPLOAD_KEY_LOOKUP_SIZE]}).fetch_all()
+        stored.update((row[UPLOAD_KEY_COLUMN], content_digest(row)) for row in rows)
+    return stored
+
+
+def _batch_payload(batch, upsert):
+    """JSON compacto do lote (NaN/Infinity são recusados); sem a chave no insert simples"""
+    if not upsert:
+        batch = [{field: value for field, value in record.items() if field != UPLOAD_KEY_COLUMN}
+                 for record in batch]
+    return json.dumps(batch, separators=(',', ':'), allow_nan=False).encode()
+
+
+class BatchInserter:
+    """Insere lotes no Supabase em paralelo, com retry por lote e tamanho adaptativo
+
+    Os lotes são enviados por até UPLOAD_WORKERS threads e o tamanho dos
+    próximos lotes é ajustado para que cada POST leve perto de
+    UPLOAD_TARGET_BATCH_SECONDS. Os resultados são coletados na ordem de envio,
+    com a faixa de linhas do arquivo de cada lote.
+    
+    Em modo upsert as chaves do lote são conferidas antes na tabela
+    (_stored_digests): vendas já gravadas com o mesmo conteúdo não são
+    reenviadas, então reimportar um arquivo sem mudanças só faz consultas. As
+    chaves novas vão com resolution=ignore-duplicates e return=representation:
+    a resposta traz só as chaves gravadas agora, e só essas linhas entram nos
+    agregados em memória. As que já existiam com outro conteúdo (ou foram
+    gravadas por outro envio no meio tempo) vão com resolution=merge-duplicates.
+    Os POSTs são repetidos em erro 5xx/timeout sem risco de duplicar. No insert simples (UPLOAD_MODE=insert ou tabela ainda sem a
+    coluna da chave) só a falha ao abrir a conexão é repetida; timeout ou 5xx
+    depois do envio deixam o lote como 'uncertain' (pode ter sido gravado).
+    """
+
+    def __init__(self):
+        self.batch_size = UPLOAD_BATCH_SIZE
+        self.results = []
+        self._inserted_records = []
+        self._workers = max(1, UPLOAD_WORKERS)
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        self._pending = []
+        self._size_lock = threading.Lock()
+
+    def submit(self, records, row_numbers):
+        """Divide em lotes do tamanho atual; row_numbers são as linhas do arquivo"""
+        i = 0
+        while i < len(records):
+            size = self.batch_size
+            self._pending.append(self._executor.submit(
+                self._send, records[i:i + size], row_numbers[i], row_numbers[min(i + size, len(records)) - 1]))
+            i += size
+            # Limita os lotes em memória aguardando envio
+            while len(self._pending) > self._workers * 2:
+                self._collect(self._pending.pop(0))
+
+    def _post(self, kind, records):
+        """POST de um tipo de UPLOAD_POSTS com retry; (resposta, erro, tentativas, incerto)
+
+        Resposta e erro None: a tabela não tem a chave do upsert (usar insert simples).
+        """
+        global _upsert_missing_until
+        label, prefer, params = UPLOAD_POSTS[kind]
+        # Serializado uma vez para todas as tentativas
+        payload = _batch_payload(records, kind != 'insert')
+        attempts = 0
+        error = None
+        uncertain = False
+        while attempts <= UPLOAD_BATCH_RETRIES:
+            attempts += 1
+            attempt_started = time.perf_counter()
+            try:
+                response = supabase_request('POST', label, headers={'Prefer': prefer}, params=params,
+                                            data=payload, timeout=30)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = str(e)
+                # Insert simples: só repete se o POST nem chegou a ser enviado
+                uncertain = kind == 'insert' and not _request_not_sent(e)
+            else:
+                if response.status_code in (200, 201):
+                    self._adapt(time.perf_counter() - attempt_started, len(records))
+                    return response, None, attempts, False
+                if kind != 'insert' and _upsert_missing(response):
+                    print(f"⚠️ Upsert indisponível (sem coluna/índice único {UPLOAD_KEY_COLUMN}), "
+                          f"usando insert simples: {response.text[:200]}")
+                    _upsert_missing_until = time.time() + UPLOAD_UPSERT_RETRY_SECONDS
+                    return None, None, attempts, False
+                error = f'Status {response.status_code}: {response.text[:300]}'
+                if response.status_code < 500:
+                    break  # erro nos dados: repetir não adianta
+                uncertain = kind == 'insert'
+            if uncertain:
+                break  # o lote pode ter sido gravado: repetir poderia duplicá-lo
+            if attempts <= UPLOAD_BATCH_RETRIES:
+                time.sleep(SUPABASE_RETRY_BACKOFF * (2 ** (attempts - 1)))
+        return None, error, attempts, uncertain
+
+    def _send(self, batch, first_row, last_row):
+        started = time.perf_counter()
+        mode = 'upsert' if _upsert_enabled() else 'insert'
+        added, updated, unchanged = [], 0, 0
+        candidates, changed = batch, []
+        if mode == 'upsert':
+            try:
+                stored = _stored_digests([record[UPLOAD_KEY_COLUMN] for record in batch])
+            except Exception as e:
+                # Sem a conferência, todas as chaves vão ao upsert (as existentes são atualizadas)
+                print(f"⚠️ Conferência das chaves gravadas falhou: {str(e)}")
+            else:
+                candidates = [record for record in batch if record[UPLOAD_KEY_COLUMN] not in stored]
+                changed = [record for record in batch if record[UPLOAD_KEY_COLUMN] in stored
+                           and stored[record[UPLOAD_KEY_COLUMN]] != content_digest(record)]
+                unchanged = len(batch) - len(candidates) - len(changed)
+
+        response, error, attempts, uncertain = None, None, 0, False
+        if candidates:
+            response, error, attempts, uncertain = self._post('new' if mode == 'upsert' else 'insert', candidates)
+            if mode == 'upsert' and response is None and error is None:
+                mode = 'insert'
+                response, error, more, uncertain = self._post('insert', candidates)
+                attempts += more
+        if mode == 'insert':
+            added = candidates if response is not None else []
+        elif not error:
+            # ignore-duplicates devolve só as chaves gravadas agora; as demais já existiam
+            new_keys = {row.get(UPLOAD_KEY_COLUMN) for row in response.json()} if response is not None else set()
+            added = [record for record in candidates if record[UPLOAD_KEY_COLUMN] in new_keys]
+            existing = changed + [record for record in candidates if record[UPLOAD_KEY_COLUMN] not in new_keys]
+            if existing:
+                # Valores corrigidos no arquivo atualizam as vendas que já existiam
+                response, error, more, uncertain = self._post('merge', existing)
+                attempts += more
+                updated = len(existing) if response is not None else 0
+        return {
+            'rows': [first_row, last_row],
+            'size': len(batch),
+            'added': len(added),
+            'updated': updated,
+            'unchanged': unchanged,
+            'status': 'uncertain' if uncertain else ('failed' if error else 'ok'),
+            'attempts': attempts,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+            'error': error,
+            'mode': mode,
+            'records': added
+        }
+
+    def _adapt(self, elapsed, size):
+        """Aproxima o tamanho do lote do tempo alvo por POST (média suavizada)"""
+        if elapsed <= 0:
+            return
+        ideal = size * UPLOAD_TARGET_BATCH_SECONDS / elapsed
+        with self._size_lock:
+            novo = int((self.batch_size + ideal) / 2)
+            self.batch_size = max(UPLOAD_MIN_BATCH_SIZE, min(UPLOAD_MAX_BATCH_SIZE, novo))
+
+    def _collect(self, future):
+        result = future.result()
+        # Só as linhas novas vão para os agregados (mesmo se a atualização das demais falhou)
+        self._inserted_records.extend(result.pop('records'))
+        if result['status'] == 'uncertain':
+            print(f"⚠️ Linhas {result['rows'][0]}-{result['rows'][1]} podem ter sido gravadas: {result['error']}")
+        elif result['status'] == 'failed':
+            print(f"❌ Linhas {result['rows'][0]}-{result['rows'][1]} não inseridas: {result['error']}")
+        self.results.append(result)
+
+    def finish(self):
+        """Aguarda todos os lotes; devolve os resultados em ordem"""
+        try:
+            while self._pending:
+                self._collect(self._pending.pop(0))
+        finally:
+            self._executor.shutdown(wait=True)
+        return self.results
+
+    def take_inserted(self):
+        """Registros gravados desde a última chamada"""
+        records, self._inserted_records = self._inserted_records, []
+        return records
+
+    @property
+    def inserted(self):
+        return sum(r['size'] for r in self.results if r['status'] == 'ok')
+
+    @property
+    def added(self):
+        """Linhas que não existiam na tabela (no insert simples, todas as gravadas)"""
+        return sum(r['added'] for r in self.results)
+
+    @property
+    def updated(self):
+        return sum(r['updated'] for r in self.results)
+
+    @property
+    def unchanged(self):
+        """Linhas que já estavam gravadas com o mesmo conteúdo (não reenviadas)"""
+        return sum(r['unchanged'] for r in self.results)
+
+    def failed_ranges(self):
+        return [r['rows'] for r in self.results if r['status'] == 'failed']
+
+    def uncertain_ranges(self):
+        return [r['rows'] for r in self.results if r['status'] == 'uncertain']
+
+
+def _parse_row_ranges(spec):
+    """'1001-2000,5001-' -> [(1001, 2000), (5001, None)] para reimportar só essas linhas"""
+    ranges = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        ranges.append((int(start), int(end) if end else (None if '-' in part else int(start))))
+    return ranges
+
+
 @app.route('/api/upload-data', methods=['POST'])
 def upload_data():
-    """Upload de arquivo de vendas (.xlsx, .xls, .csv)"""
+    """Upload de arquivo de vendas (.xlsx, .xls, .csv)
+    
+    Em modo streaming (padrão) o arquivo é lido em blocos e cada bloco é
+    validado e enviado ao Supabase antes do próximo ser lido, então a
+    memória não cresce com o tamanho do arquivo. Use ?stream=0 para ler
+    o arquivo inteiro de uma vez.
+    
+    Os lotes são inseridos em paralelo e a resposta traz a faixa de linhas
+    de cada lote. Para retomar uma importação, reenvie o arquivo com
+    ?rows=1001-2000,5001- (apenas as faixas que falharam).
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'Nenhum arquivo enviado'}), 400
@@ -829,150 +3762,135 @@ def upload_data():
         if file_ext not in allowed_extensions:
             return jsonify({'error': f'Formato não suportado. Use: {", ".join(allowed_extensions)}'}), 400
         
-        # Importar pandas apenas quando necessário (evita overhead no cold start)
-        import pandas as pd
-        from io import BytesIO
-        import unicodedata
-        
-        # Ler arquivo
-        file_content = file.read()
-        
-        if file_ext == '.csv':
-            df = pd.read_csv(BytesIO(file_content))
-        else:  # .xlsx ou .xls
-            df = pd.read_excel(BytesIO(file_content))
+        stream_param = request.args.get('stream', request.form.get('stream'))
+        streaming = UPLOAD_STREAMING if stream_param is None else stream_param not in ('0', 'false')
+        try:
+            only_rows = _parse_row_ranges(request.args.get('rows', request.form.get('rows')))
+        except ValueError:
+            return jsonify({'error': 'Parâmetro rows inválido. Use faixas como 1001-2000,5001-'}), 400
+        
+        started = time.perf_counter()
+        rows_read = 0
+        rows_valid = 0
+        chunks = 0
+        keys = UploadKeys()
+        dates = UploadDates()
+        inserter = BatchInserter()
         
-        if df.empty:
+        try:
+            for chunk_rows, records, row_numbers in traced_iter(
+                    _iter_upload_batches(file, file_ext, streaming, dates), 'parse'):
+                chunks += 1
+                rows_read += chunk_rows
+                
+                # Chaves antes do filtro de linhas: ?rows= gera as mesmas chaves do envio completo
+                records, row_numbers = keys.apply(records, row_numbers)
+                
+                if only_rows:
+                    keep = [i for i, row in enumerate(row_numbers)
+                            if any(start <= row and (end is None or row <= end) for start, end in only_rows)]
+                    records = [records[i] for i in keep]
+                    row_numbers = [row_numbers[i] for i in keep]
+                
+                if not records:
+                    continue
+                
+                rows_valid += len(records)
+                with trace_span('insert'):
+                    inserter.submit(records, row_numbers)
+                
+                # Agregados em memória recebem só os lotes já gravados (uma vez por bloco)
+                inserted_records = inserter.take_inserted()
+                if inserted_records:
+                    apply_inserted_rows(inserted_records)
+                
+                elapsed = time.perf_counter() - started
+                print(f"📦 Bloco {chunks}: {rows_valid}/{rows_read} linhas válidas enviadas "
+                      f"({rows_valid / elapsed:.0f} linhas/s, lote atual {inserter.batch_size})")
+        finally:
+            with trace_span('insert'):
+                results = inserter.finish()
+            inserted_records = inserter.take_inserted()
+            if inserted_records:
+                apply_inserted_rows(inserted_records)
+        
+        if dates.invalid:
+            print(f"⚠️ {dates.invalid} linhas descartadas por data vazia ou ilegível")
+        
+        if rows_read == 0:
             return jsonify({'error': 'Arquivo vazio ou sem dados válidos'}), 400
         
-        # Função para normalizar nomes de colunas
-        def normalize_column_name(col):
-            # Remove acentos
-            col = ''.join(c for c in unicodedata.normalize('NFD', str(col)) 
-                         if unicodedata.category(c) != 'Mn')
-            # Lowercase e substitui espaços por _
-            return col.lower().replace(' ', '_').replace('-', '_')
-        
-        # Normalizar nomes das colunas
-        df.columns = [normalize_column_name(col) for col in df.columns]
-        
-        # Mapear possíveis variações de nomes de colunas
-        column_mapping = {
-            'id_transacao': ['id_transacao', 'id', 'transacao', 'id_venda'],
-            'data': ['data', 'date', 'dt_venda', 'data_venda'],
-            'produto': ['produto', 'product', 'item', 'descricao'],
-            'categoria': ['categoria', 'category', 'tipo'],
-            'regiao': ['regiao', 'region', 'estado', 'uf'],
-            'quantidade': ['quantidade', 'qtd', 'quantity', 'qtde'],
-            'preco_unitario': ['preco_unitario', 'preco', 'price', 'valor_unitario'],
-            'receita_total': ['receita_total', 'total', 'valor_total', 'receita']
-        }
-        
-        # Encontrar colunas equivalentes
-        final_columns = {}
-        for target_col, possible_names in column_mapping.items():
-            for col in df.columns:
-                if col in possible_names:
-                    final_columns[col] = target_col
-                    break
-        
-        # Renomear colunas
-        df.rename(columns=final_columns, inplace=True)
-        
-        # Validar colunas obrigatórias
-        required_columns = ['data', 'produto', 'quantidade', 'receita_total']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            return jsonify({
-                'error': f'Colunas obrigatórias faltando: {", ".join(missing_columns)}',
-                'found_columns': list(df.columns)
-            }), 400
-        
-        # Preencher colunas opcionais com valores padrão
-        if 'id_transacao' not in df.columns:
-            df['id_transacao'] = [f'TXN{i:06d}' for i in range(len(df))]
-        if 'categoria' not in df.columns:
-            df['categoria'] = 'Sem categoria'
-        if 'regiao' not in df.columns:
-            df['regiao'] = 'Não especificada'
-        if 'preco_unitario' not in df.columns:
-            df['preco_unitario'] = df['receita_total'] / df['quantidade']
-        
-        # Converter tipos de dados
-        # Datas
-        df['data'] = pd.to_datetime(df['data'], errors='coerce')
-        
-        # Números (aceita vírgula como decimal)
-        for col in ['quantidade', 'preco_unitario', 'receita_total']:
-            if df[col].dtype == 'object':
-                df[col] = df[col].astype(str).str.replace(',', '.').str.replace(r'[^\d.]', '', regex=True)
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Remover linhas com dados inválidos
-        df.dropna(subset=['data', 'produto', 'quantidade', 'receita_total'], inplace=True)
-        
-        print(f"📊 Após validação: {len(df)} linhas válidas")
-        
-        if df.empty:
-            return jsonify({'error': 'Nenhuma linha válida encontrada após validação'}), 400
-        
-        # Selecionar apenas as colunas que existem na tabela
-        valid_columns = ['data', 'id_transacao', 'produto', 'categoria', 'regiao', 
-                        'quantidade', 'preco_unitario', 'receita_total']
-        df = df[valid_columns]
-        
-        print(f"📝 Colunas selecionadas: {list(df.columns)}")
-        print(f"📋 Primeira linha: {df.iloc[0].to_dict() if len(df) > 0 else 'VAZIO'}")
-        
-        # Converter para formato JSON para inserção no Supabase
-        records = df.to_dict('records')
-        
-        # Formatar data para ISO string
-        for record in records:
-            if pd.notna(record.get('data')):
-                record['data'] = record['data'].strftime('%Y-%m-%d')
-        
-        # Inserir direto no Supabase
-        url = f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}"
-        headers = {
-            'apikey': SUPABASE_KEY,
-            'Authorization': f'Bearer {SUPABASE_KEY}',
-            'Content-Type': 'application/json',
-            'Prefer': 'return=minimal'
+        if rows_valid == 0:
+            return jsonify({'error': 'Nenhuma linha válida encontrada após validação',
+                            'rows_invalid_date': dates.invalid}), 400
+        
+        total_inserted = inserter.inserted
+        failed_ranges = inserter.failed_ranges()
+        uncertain_ranges = inserter.uncertain_ranges()
+        if uncertain_ranges:
+            # Lotes que podem ter sido gravados ficaram fora dos agregados: recarrega do banco
+            invalidate_sales_snapshot()
+        rows_added = inserter.added
+        rows_updated = inserter.updated
+        if rows_updated:
+            # Vendas que já existiam mudaram de valor: os agregados só somaram as linhas
+            # novas, então recarrega do banco (o snapshot em disco também). Reenvio sem
+            # mudanças não chega aqui e mantém os caches.
+            invalidate_sales_snapshot()
+            snapshot_store.discard()
+        elapsed = time.perf_counter() - started
+        
+        report = {
+            'rows_imported': total_inserted,
+            'rows_added': rows_added,
+            'rows_updated': rows_updated,
+            'rows_unchanged': inserter.unchanged,
+            'rows_read': rows_read,
+            'rows_failed': rows_valid - total_inserted,
+            'duplicates_skipped': keys.duplicates,
+            'rows_invalid_date': dates.invalid,
+            'upload_mode': 'upsert' if any(r['mode'] == 'upsert' for r in results) else 'insert',
+            'filename': file.filename,
+            'columns_found': UPLOAD_VALID_COLUMNS,
+            'streaming': streaming,
+            'chunks': chunks,
+            'batches': results,
+            'failed_ranges': failed_ranges,
+            'uncertain_ranges': uncertain_ranges,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'rows_per_second': round(total_inserted / elapsed, 1) if elapsed else None
         }
         
-        # Inserir no Supabase em lotes (max 1000 por vez)
-        total_inserted = 0
-        batch_size = 1000
-        
-        print(f"🚀 Iniciando inserção de {len(records)} registros...")
-        
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i + batch_size]
-            print(f"📤 Enviando lote {i//batch_size + 1} com {len(batch)} registros...")
-            response = requests.post(url, headers=headers, json=batch, timeout=30)
-            
-            print(f"📥 Resposta: Status {response.status_code}")
-            
-            if response.status_code not in [200, 201]:
-                print(f"❌ ERRO: {response.text}")
-                raise Exception(f'Erro ao inserir lote {i//batch_size + 1}: {response.text}')
-            
-            total_inserted += len(batch)
-            print(f"✅ Lote {i//batch_size + 1} inserido! Total: {total_inserted}")
+        if failed_ranges or uncertain_ranges:
+            faixas = ','.join(f'{start}-{end}' for start, end in failed_ranges)
+            error = ''
+            if failed_ranges:
+                error = (f'Linhas {faixas} não foram importadas. '
+                         f'Reenvie o arquivo com ?rows={faixas} para completar.')
+            if uncertain_ranges:
+                incertas = ','.join(f'{start}-{end}' for start, end in uncertain_ranges)
+                error += (f' Linhas {incertas} podem ter sido gravadas (timeout ou erro do servidor '
+                          f'depois do envio): confira no banco antes de reenviar, para não duplicar.')
+            return jsonify(dict(report,
+                success=False,
+                error=f'{report["rows_failed"]} linhas sem confirmação de importação. {error.strip()}',
+                resume_rows=faixas or None
+            )), 500
         
         # Mensagem de sucesso
         message = f'✅ {total_inserted} linhas importadas com sucesso!'
-        
-        return jsonify({
-            'success': True,
-            'message': message,
-            'rows_imported': total_inserted,
-            'filename': file.filename,
-            'columns_found': list(df.columns)
-        }), 200
-        
+        if rows_updated or inserter.unchanged:
+            message += f' {rows_added} novas; {rows_updated} já existiam e foram atualizadas'
+            message += f'; {inserter.unchanged} já estavam gravadas sem mudanças.' if inserter.unchanged else '.'
+        if keys.duplicates:
+            message += f' {keys.duplicates} linhas repetidas no arquivo (mesmo id_transacao ou conteúdo) foram ignoradas.'
+        if dates.invalid:
+            message += f' {dates.invalid} linhas com data vazia ou ilegível foram descartadas.'
+        
+        return jsonify(dict(report, success=True, message=message)), 200
+        
+    except UploadError as e:
+        return jsonify(dict({'error': str(e)}, **e.details)), 400
     except Exception as e:
         print(f"ERRO NO UPLOAD: {str(e)}")
         return jsonify({
@@ -985,27 +3903,27 @@ def clear_data():
     """Endpoint desabilitado - tabela não tem coluna mes_origem para controle de arquivos"""
     return jsonify({
         'success': False,
-        'error': 'Funcionalidade de limpeza desabilitada. A tabela vendas_2024 não possui rastreamento de arquivos individuais.',
-        'info': 'Para limpar dados, use SQL direto no Supabase: DELETE FROM vendas_2024;'
+        'error': f'Funcionalidade de limpeza desabilitada. A tabela {TABLE_NAME} não possui rastreamento de arquivos individuais.',
+        'info': f'Para limpar dados, use SQL direto no Supabase: DELETE FROM {TABLE_NAME};'
     }), 501  # Not Implemented
 
 @app.route('/api/database-stats', methods=['GET'])
 def database_stats():
-    """Retorna estatísticas do banco de dados"""
+    """Retorna estatísticas do banco de dados (contagens via header, sem baixar linhas)"""
     try:
-        # Buscar contagem total de registros (usando apenas data para contagem)
-        data, error = query_supabase('data', max_records=50000)
-        
-        if error:
-            return jsonify({
-                'error': error,
-                'total_records': 0
-            }), 500
+        total = counts_cache.get()
+        breakdown = count_breakdown_cache.get()
+        oldest = min(total.loaded_at, breakdown.loaded_at)
         
         return jsonify({
             'success': True,
-            'total_records': len(data) if data else 0,
-            'last_updated': datetime.now().strftime('%d/%m/%Y %H:%M')
+            'total_records': total.value['total_records'],
+            'by_month': breakdown.value['by_month'],
+            'by_upload': breakdown.value['by_upload'],
+            'count_mode': STATS_COUNT_MODE,
+            'count_ms': round(total.value['count_ms'] + breakdown.value['count_ms'], 2),
+            'age_seconds': round(time.time() - oldest, 1),
+            'last_updated': datetime.fromtimestamp(oldest).strftime('%d/%m/%Y %H:%M')
         }), 200
         
     except Exception as e:
@@ -1019,24 +3937,8 @@ def database_stats():
 def list_files():
     """Retorna informações sobre os dados no banco (sem mes_origem na tabela)"""
     try:
-        url = f"{SUPABASE_URL}/rest/v1/{TABLE_NAME}"
-        headers = {
-            'apikey': SUPABASE_KEY,
-            'Authorization': f'Bearer {SUPABASE_KEY}',
-            'Content-Type': 'application/json',
-            'Prefer': 'count=exact'
-        }
-        
-        # Buscar contagem total
-        params = {'select': 'id_transacao', 'limit': 1}
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        
-        if response.status_code != 200:
-            raise Exception(f'Erro ao buscar dados: {response.text}')
-        
-        # Pegar contagem do header Content-Range
-        content_range = response.headers.get('Content-Range', '0-0/0')
-        total_count = int(content_range.split('/')[-1]) if '/' in content_range else 0
+        # Só o total pelo header Content-Range (um HEAD, compartilhado com /api/database-stats)
+        total_count = counts_cache.get().value['total_records']
         
         if total_count == 0:
             return jsonify({
@@ -1049,7 +3951,7 @@ def list_files():
         return jsonify({
             'success': True,
             'files': [{
-                'name': 'vendas_2024',
+                'name': TABLE_NAME,
                 'count': total_count,
                 'uploaded_at': 'Dados consolidados',
                 'is_protected': False
@@ -1065,6 +3967,36 @@ def list_files():
             'error': f'Erro ao listar arquivos: {str(e)}'
         }), 500
 
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Estatísticas internas de desempenho (cache e chamadas ao Supabase)"""
+    aggregates = _latest_aggregates
+    return jsonify({
+        'snapshot': sales_cache.stats(),
+        'snapshot_store': snapshot_store.stats(),
+        'aggregate_views': db_aggregates_cache.stats(),
+        'database_counts': counts_cache.stats(),
+        'count_breakdown': count_breakdown_cache.stats(),
+        'year_partitions': sales_partitions.stats(),
+        'answer_cache': answer_cache.stats(),
+        'llm': llm_client.summary(),
+        'analyze': analyze_stats.snapshot(),
+        'prompt_context': dict(_prompt_context.metrics(), **prompt_context_stats) if _prompt_context else None,
+        'aggregates': aggregates.summary() if aggregates else None,
+        'http': http_stats.snapshot(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route('/api/perf', methods=['GET'])
+def perf():
+    """Percentis p50/p95/p99 (ms) por endpoint e etapa nas últimas PERF_WINDOW_SIZE requisições"""
+    return jsonify({
+        'enabled': PERF_TRACING,
+        'window': PERF_WINDOW_SIZE,
+        'endpoints': perf_stats.snapshot(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
 @app.route('/api/diagnostic', methods=['GET'])
 def diagnostic():
     """Diagnóstico"""
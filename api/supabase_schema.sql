@@ -59,3 +59,74 @@ COMMENT ON COLUMN vendas.quantidade IS 'Quantidade de unidades vendidas';
 COMMENT ON COLUMN vendas.preco_unitario IS 'Preço por unidade';
 COMMENT ON COLUMN vendas.receita_total IS 'Receita total da transação';
 COMMENT ON COLUMN vendas.mes_origem IS 'Mês/arquivo de origem dos dados';
+
+-- Views de resumo usadas pela API para agregar no banco (AGGREGATION_SOURCE=auto)
+-- Cada view devolve poucas linhas já agrupadas em vez da tabela inteira.
+-- IMPORTANTE: as views precisam ler a mesma tabela de SUPABASE_TABLE_NAME
+-- (padrão da API: vendas_2024). Troque "FROM vendas" abaixo pelo nome configurado.
+-- A API confere a contagem de vendas_resumo_geral com a da tabela na primeira
+-- carga e a cada /api/sync-data; se não bater, ignora as views e agrega em Python.
+CREATE OR REPLACE VIEW vendas_resumo_geral AS
+SELECT COUNT(*) AS registros,
+       COALESCE(SUM(receita_total), 0) AS receita,
+       COALESCE(SUM(quantidade), 0) AS quantidade
+FROM vendas;
+
+CREATE OR REPLACE VIEW vendas_resumo_mensal AS
+SELECT TO_CHAR(data, 'YYYY-MM') AS mes,
+       SUM(receita_total) AS receita,
+       COUNT(*) AS vendas,
+       SUM(quantidade) AS quantidade
+FROM vendas
+GROUP BY 1;
+
+CREATE OR REPLACE VIEW vendas_resumo_produto AS
+SELECT produto, SUM(quantidade) AS quantidade, SUM(receita_total) AS receita
+FROM vendas
+GROUP BY produto;
+
+CREATE OR REPLACE VIEW vendas_resumo_produto_mes AS
+SELECT TO_CHAR(data, 'YYYY-MM') AS mes, produto, SUM(quantidade) AS quantidade
+FROM vendas
+GROUP BY 1, produto;
+
+CREATE OR REPLACE VIEW vendas_resumo_categoria AS
+SELECT categoria, SUM(quantidade) AS quantidade, SUM(receita_total) AS receita
+FROM vendas
+GROUP BY categoria;
+
+CREATE OR REPLACE VIEW vendas_resumo_regiao AS
+SELECT regiao, SUM(quantidade) AS quantidade, SUM(receita_total) AS receita
+FROM vendas
+GROUP BY regiao;
+
+-- Categoria e região por ano (perguntas de /api/analyze sobre um ano, filtradas
+-- com ano=eq.AAAA): a API não precisa buscar as linhas do ano para respondê-las.
+CREATE OR REPLACE VIEW vendas_resumo_categoria_ano AS
+SELECT EXTRACT(YEAR FROM data)::INT AS ano, categoria,
+       SUM(quantidade) AS quantidade, SUM(receita_total) AS receita
+FROM vendas
+GROUP BY 1, categoria;
+
+CREATE OR REPLACE VIEW vendas_resumo_regiao_ano AS
+SELECT EXTRACT(YEAR FROM data)::INT AS ano, regiao,
+       SUM(quantidade) AS quantidade, SUM(receita_total) AS receita
+FROM vendas
+GROUP BY 1, regiao;
+
+-- Registros por envio (usada por /api/database-stats). Cada upload grava em
+-- poucos segundos, então o minuto de created_at identifica o envio.
+CREATE OR REPLACE VIEW vendas_resumo_upload AS
+SELECT DATE_TRUNC('minute', created_at) AS enviado_em,
+       COUNT(*) AS registros
+FROM vendas
+GROUP BY 1;
+
+-- Upload idempotente (UPLOAD_MODE=upsert): cada venda enviada leva uma chave
+-- estável (id_transacao do arquivo ou hash do conteúdo) e o upsert usa
+-- on_conflict=chave, então reenviar um arquivo não duplica linhas.
+-- Linhas antigas ficam com chave NULL (o índice único aceita vários NULLs).
+-- Sem esta coluna a API volta ao insert simples.
+ALTER TABLE vendas ADD COLUMN IF NOT EXISTS chave TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_chave ON vendas(chave);
+COMMENT ON COLUMN vendas.chave IS 'Chave do upsert do upload (id:<id_transacao> ou h:<hash do conteúdo>)';
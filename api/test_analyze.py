@@ -0,0 +1,27 @@
+"""Respostas de /api/analyze: partições por ano e caches do caminho do Gemini"""
+import pytest
+
+import benchmark
+import index
+
+
+def test_prompt_context_survives_refill_with_same_data():
+    rows = benchmark.table_rows(2000)
+    context = index.get_prompt_context(index.build_sales_aggregates(rows, version=1))
+    # Recarga pelo TTL: nova versão, mesmo conteúdo
+    assert index.get_prompt_context(index.build_sales_aggregates(list(rows), version=2)) is context
+    assert index.get_prompt_context(index.build_sales_aggregates(rows[:-1], version=3)) is not context
+
+
+@pytest.mark.sales_years(2024, 2025)
+def test_year_question_does_not_fetch_raw_rows(supabase):
+    agg = index.get_sales_aggregates()
+    supabase.reset_stats()
+    answer = index.keyword_fallback_answer('Qual região vendeu mais em 2024?', agg)
+
+    assert f'GET {index.TABLE_NAME}' not in supabase.requests
+    rows_2024 = [row for row in supabase.rows if str(row['data']).startswith('2024-')]
+    partition = index.sales_partitions.aggregates(2024)
+    assert index.compare_aggregates(partition, index.build_sales_aggregates(rows_2024)) == []
+    best = max(partition.receita_por_regiao, key=partition.receita_por_regiao.get)
+    assert best in answer
@@ -0,0 +1,22 @@
+"""Import da API sem as dependências pesadas (partida a frio do serverless)"""
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ('numpy', 'pandas', 'openpyxl', 'google.generativeai', 'google.genai')
+
+IMPORT_SCRIPT = """
+import json, sys
+import api.index
+print(json.dumps([name for name in sys.argv[1:] if name in sys.modules]))
+"""
+
+
+def test_import_does_not_load_heavy_modules():
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, SUPABASE_URL='http://127.0.0.1:9', SUPABASE_KEY='test', SNAPSHOT_DIR='')
+    process = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT, *HEAVY_MODULES],
+                             capture_output=True, text=True, cwd=repo_dir, env=env, timeout=60)
+    assert process.returncode == 0, process.stderr
+    assert json.loads(process.stdout.strip().splitlines()[-1]) == []
@@ -0,0 +1,12 @@
+"""Classificador de intenções do fallback de /api/analyze contra o corpus do benchmark"""
+import pytest
+
+import benchmark
+import index
+
+
+@pytest.mark.parametrize('question,expected,months', benchmark.INTENT_CORPUS,
+                         ids=[question for question, _, _ in benchmark.INTENT_CORPUS])
+def test_classify_question(question, expected, months):
+    intent = index.classify_question(question)
+    assert (intent.name, intent.months) == (expected, months)
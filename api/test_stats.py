@@ -0,0 +1,46 @@
+"""Totais de /api/metrics contra as contagens de /api/database-stats"""
+import pytest
+
+import benchmark
+import index
+from fake_supabase import FakeSupabase
+
+
+def table_totals(fake):
+    return len(fake.rows), round(sum(row['receita_total'] for row in fake.rows), 2)
+
+
+def test_metrics_totals_match_database_stats(supabase):
+    client = index.app.test_client()
+    metrics = client.get('/api/metrics').get_json()
+    stats = client.get('/api/database-stats').get_json()
+
+    rows, receita = table_totals(supabase)
+    assert stats['total_records'] == rows == 25000
+    assert metrics['records_analyzed'] == rows
+    assert metrics['vendas_totais_ano'] == index.fmt_currency(receita)
+    assert sum(month['registros'] for month in stats['by_month']) == rows
+
+
+@pytest.mark.parametrize('supabase', [True], indirect=True, ids=['views'])
+def test_views_over_another_table_are_ignored(supabase, monkeypatch):
+    # Views criadas sobre outra tabela (ex: "vendas" com a API em vendas_2024)
+    with FakeSupabase(benchmark.table_rows(100, seed=1), views=True) as other_table:
+        monkeypatch.setattr(supabase, 'view', other_table.view)
+        client = index.app.test_client()
+        metrics = client.get('/api/metrics').get_json()
+        stats = client.get('/api/database-stats').get_json()
+
+    rows, receita = table_totals(supabase)
+    assert index.get_sales_aggregates().source != 'database'
+    assert metrics['records_analyzed'] == stats['total_records'] == rows
+    assert metrics['vendas_totais_ano'] == index.fmt_currency(receita)
+    assert sum(month['registros'] for month in stats['by_month']) == rows
+
+
+def test_list_files_only_counts_the_table(supabase):
+    supabase.reset_stats()
+    files = index.app.test_client().get('/api/list-files').get_json()
+
+    assert files['total_records'] == len(supabase.rows)
+    assert dict(supabase.requests) == {f'HEAD {index.TABLE_NAME}': 1}
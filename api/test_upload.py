@@ -0,0 +1,178 @@
+"""Leitura dos arquivos de upload e importação contra o Supabase falso"""
+import io
+from datetime import datetime
+
+import openpyxl
+from werkzeug.datastructures import FileStorage
+
+import benchmark
+import index
+
+UPLOAD_FIELDS = ['data', 'id_transacao', 'produto', 'categoria', 'regiao',
+                 'quantidade', 'preco_unitario', 'receita_total']
+
+
+def _upload(client, payload, filename='vendas.csv'):
+    response = client.post('/api/upload-data', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(payload), filename)})
+    return response.status_code, response.get_json()
+
+
+def _table_totals(fake):
+    return len(fake.rows), round(sum(row['receita_total'] for row in fake.rows), 2)
+
+
+def _api_totals():
+    index.invalidate_sales_snapshot()
+    agg = index.get_sales_aggregates()
+    return agg.rows_processed, round(agg.receita_total, 2)
+
+
+def test_reimport_does_not_change_totals(supabase):
+    client = index.app.test_client()
+    payload = benchmark.upload_csv(3000)
+
+    status, first = _upload(client, payload)
+    assert status == 200 and first['rows_added'] == 3000
+    before = _table_totals(supabase)
+    assert _api_totals() == before
+
+    client.get('/api/metrics')
+    supabase.reset_stats()
+    status, second = _upload(client, payload)
+    assert status == 200
+    assert (second['rows_added'], second['rows_updated'], second['rows_unchanged']) == (0, 0, 3000)
+    # Só as consultas das chaves: nada é regravado e os caches continuam valendo
+    assert set(supabase.requests) == {f'GET {index.TABLE_NAME}'}
+    assert (index.sales_cache.peek() or index.db_aggregates_cache.peek()) is not None
+    assert _table_totals(supabase) == before
+    assert _api_totals() == before
+
+
+def test_reimport_merges_only_changed_rows(supabase):
+    client = index.app.test_client()
+    lines = benchmark.upload_csv(3000).decode().splitlines()
+    assert _upload(client, '\n'.join(lines).encode())[0] == 200
+
+    fields = lines[5].split(',')
+    fields[-1] = str(float(fields[-1]) + 1)
+    lines[5] = ','.join(fields)
+    supabase.reset_stats()
+    status, second = _upload(client, '\n'.join(lines).encode())
+    assert status == 200
+    assert (second['rows_added'], second['rows_updated'], second['rows_unchanged']) == (0, 1, 2999)
+    assert supabase.requests[f'POST {index.TABLE_NAME}'] == 1
+
+
+def test_sync_verifies_aggregates_kept_by_upload(supabase):
+    client = index.app.test_client()
+    client.get('/api/metrics')
+    status, upload = _upload(client, benchmark.upload_csv(3000))
+    assert status == 200
+
+    verification = client.post('/api/sync-data', json={'verify': True}).get_json()['verification']
+    assert verification['incremental']['incremental_rows'] == upload['rows_added'] == 3000
+    assert verification['incremental']['matches']
+
+
+def test_appending_rows_reuses_column_buffers():
+    rows = benchmark.table_rows(3000)
+    columns = index.SalesColumns.from_rows(rows[:1000])
+    first = columns.with_rows(rows[1000:2000])
+    second = first.with_rows(rows[2000:])
+    assert second._buffers is first._buffers
+    # Colunas antigas continuam vendo só o próprio prefixo
+    assert len(columns) == 1000 and len(first) == 2000 and len(second) == 3000
+
+    expected = index.aggregate_columns(index.SalesColumns.from_rows(rows))
+    assert index.compare_aggregates(index.aggregate_columns(second), expected) == []
+
+    snapshot = index.SalesSnapshot(rows[:1000], 1).with_rows(rows[1000:2000], 2).with_rows(rows[2000:], 3)
+    assert list(snapshot.rows) == rows and len(snapshot) == 3000
+
+
+UPLOAD_DATES = ['03/04/2024', '25/12/2024', '2024-07-01', '', 'sem data']
+
+
+def _upload_lines():
+    lines = [UPLOAD_FIELDS]
+    for i, data in enumerate(UPLOAD_DATES):
+        lines.append([data, f'TXN-{i}', f'Produto {i}', 'Categoria', 'Sul', '2', '10,50', '21,00'])
+    return lines
+
+
+def _parse(content, filename, engine, monkeypatch):
+    monkeypatch.setattr(index, 'UPLOAD_CSV_ENGINE', engine)
+    dates = index.UploadDates()
+    records = []
+    for _, batch, _ in index._iter_upload_batches(FileStorage(io.BytesIO(content), filename),
+                                                   filename[filename.rindex('.'):], True, dates):
+        records += [(r['data'], r['id_transacao'], r['produto'], float(r['quantidade']),
+                     float(r['receita_total'])) for r in batch]
+    return records, dates.invalid
+
+
+def test_csv_and_xlsx_parse_the_same(monkeypatch):
+    csv_content = '\n'.join(','.join(f'"{v}"' for v in line) for line in _upload_lines()).encode()
+    workbook = openpyxl.Workbook()
+    for line in _upload_lines():
+        workbook.active.append(line)
+    xlsx_content = io.BytesIO()
+    workbook.save(xlsx_content)
+
+    parsed = [
+        _parse(csv_content, 'vendas.csv', 'csv', monkeypatch),
+        _parse(csv_content, 'vendas.csv', 'pandas', monkeypatch),
+        _parse(xlsx_content.getvalue(), 'vendas.xlsx', 'csv', monkeypatch),
+    ]
+    assert parsed[0] == parsed[1] == parsed[2]
+    records, invalid = parsed[0]
+    assert [r[0] for r in records] == ['2024-04-03', '2024-12-25', '2024-07-01']
+    assert records[0][3:] == (2.0, 21.0)
+    assert invalid == 2
+
+
+def test_xlsx_date_cells_match_csv_text(monkeypatch):
+    workbook = openpyxl.Workbook()
+    workbook.active.append(UPLOAD_FIELDS)
+    workbook.active.append([datetime(2024, 4, 3), 'TXN-0', 'Produto', 'Categoria', 'Sul', 2, 10.5, 21])
+    workbook.active.append(['05/06/2024', 'TXN-1', 'Produto', 'Categoria', 'Sul', 2, 10.5, 21])
+    content = io.BytesIO()
+    workbook.save(content)
+
+    records, invalid = _parse(content.getvalue(), 'vendas.xlsx', 'csv', monkeypatch)
+    assert [r[0] for r in records] == ['2024-04-03', '2024-06-05']
+    assert invalid == 0
+
+
+def _keys(content, engine, monkeypatch):
+    monkeypatch.setattr(index, 'UPLOAD_CSV_ENGINE', engine)
+    keys = index.UploadKeys()
+    records = []
+    for _, batch, row_numbers in index._iter_upload_batches(FileStorage(io.BytesIO(content), 'vendas.csv'),
+                                                            '.csv', True, index.UploadDates()):
+        records += keys.apply(batch, row_numbers)[0]
+    return [(r['id_transacao'], r[index.UPLOAD_KEY_COLUMN]) for r in records], keys.duplicates
+
+
+def test_csv_and_pandas_build_the_same_keys(monkeypatch):
+    lines = [UPLOAD_FIELDS]
+    for id_transacao in ['001', '2.0', ' 3 ', 'TXN-4', '']:
+        lines.append(['2024-01-05', id_transacao, 'Produto', 'Categoria', 'Sul', '2', '10.5', '21'])
+    content = '\n'.join(','.join(line) for line in lines).encode()
+
+    parsed = [_keys(content, engine, monkeypatch) for engine in ('csv', 'pandas')]
+    assert parsed[0] == parsed[1]
+    keys, duplicates = parsed[0]
+    assert [k for _, k in keys[:4]] == ['id:1', 'id:2', 'id:3', 'id:TXN-4']
+    assert keys[4][1].startswith('h:') and duplicates == 0
+
+
+def test_rows_with_the_same_content_are_dropped(monkeypatch):
+    row = ['2024-01-05', '', 'Produto', 'Categoria', 'Sul', '2', '10.5', '21']
+    lines = [UPLOAD_FIELDS, row, row, row[:5] + ['3', '10.5', '31.5'], ['2024-01-05', '7'] + row[2:],
+             ['2024-01-05', '7.0'] + row[2:]]
+    content = '\n'.join(','.join(line) for line in lines).encode()
+
+    keys, duplicates = _keys(content, 'csv', monkeypatch)
+    assert len(keys) == 3 and duplicates == 2
@@ -179,7 +179,7 @@ const Index = () => {
     setShowSuggestions(false); // Esconder sugestões após primeira pergunta
 
     try {
-      const response = await fetch('/api/analyze', {
+      const response = await fetch('/api/analyze?stream=1', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -187,6 +187,46 @@ const Index = () => {
         body: JSON.stringify({ message: messageText }),
       });
 
+      // Resposta em streaming (NDJSON): mostra o texto à medida que o modelo gera
+      if (response.ok && response.body && response.headers.get('Content-Type')?.includes('application/x-ndjson')) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let content = "";
+        let started = false;
+
+        const applyEvent = (event: { type: string; text?: string }) => {
+          if (event.type === 'delta') {
+            content += event.text ?? "";
+          } else if (event.type === 'replace') {
+            content = event.text ?? "";
+          } else {
+            return;
+          }
+          const botMessage: Message = { role: "assistant", content };
+          if (!started) {
+            started = true;
+            setIsLoading(false);
+            setMessages((prev) => [...prev, botMessage]);
+          } else {
+            setMessages((prev) => [...prev.slice(0, -1), botMessage]);
+          }
+        };
+
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split('\n');
+          buffer = lines.pop() ?? "";
+          for (const line of lines) {
+            if (line.trim()) applyEvent(JSON.parse(line));
+          }
+        }
+        if (buffer.trim()) applyEvent(JSON.parse(buffer));
+        return;
+      }
+
       const data = await response.json();
 
       if (!response.ok) {